@@ -0,0 +1,30 @@
+"""add thumbnails and pipeline task types
+
+Revision ID: 121a362ae263
+Revises: ce3f1fa2ecbc
+Create Date: 2026-10-17 17:38:00.816498
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '121a362ae263'
+down_revision: Union[str, Sequence[str], None] = 'ce3f1fa2ecbc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TYPE tasktype ADD VALUE IF NOT EXISTS 'THUMBNAILS'")
+    op.execute("ALTER TYPE tasktype ADD VALUE IF NOT EXISTS 'PIPELINE'")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Postgres cannot drop a value from an enum type; THUMBNAILS and PIPELINE are left in place.
+    pass
@@ -0,0 +1,44 @@
+"""add derived outputs cache
+
+Revision ID: 21daa66cb716
+Revises: e20914b2adc6
+Create Date: 2026-10-17 10:14:00.362252
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '21daa66cb716'
+down_revision: Union[str, Sequence[str], None] = 'e20914b2adc6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'derived_outputs',
+        sa.Column('cache_key', sa.String(length=64), nullable=False),
+        sa.Column('source_hash', sa.String(length=64), nullable=False),
+        sa.Column('operation', sa.String(), nullable=False),
+        sa.Column('params', sa.JSON(), nullable=False),
+        sa.Column('filepath', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('hits', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('last_accessed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('cache_key'),
+    )
+    op.create_index(op.f('ix_derived_outputs_source_hash'), 'derived_outputs', ['source_hash'], unique=False)
+    op.create_index(op.f('ix_derived_outputs_last_accessed_at'), 'derived_outputs', ['last_accessed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_derived_outputs_last_accessed_at'), table_name='derived_outputs')
+    op.drop_index(op.f('ix_derived_outputs_source_hash'), table_name='derived_outputs')
+    op.drop_table('derived_outputs')
@@ -0,0 +1,28 @@
+"""add job revision
+
+Revision ID: 3ba775605af1
+Revises: 121a362ae263
+Create Date: 2026-10-17 18:15:00.734047
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3ba775605af1'
+down_revision: Union[str, Sequence[str], None] = '121a362ae263'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('revision', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('jobs', 'revision')
@@ -0,0 +1,28 @@
+"""add video version mtime
+
+Revision ID: 557129d7d809
+Revises: f48ab9032d3c
+Create Date: 2026-10-17 13:56:00.577129
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '557129d7d809'
+down_revision: Union[str, Sequence[str], None] = 'f48ab9032d3c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('video_versions', sa.Column('mtime', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('video_versions', 'mtime')
@@ -0,0 +1,35 @@
+"""make video upload_time not null
+
+Revision ID: 55aa96e7d4fd
+Revises: 3ba775605af1
+Create Date: 2026-10-17 18:52:00.063580
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '55aa96e7d4fd'
+down_revision: Union[str, Sequence[str], None] = '3ba775605af1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Rows without an upload time sort as the oldest ones
+    op.execute(
+        "UPDATE videos SET upload_time = COALESCE((SELECT min(upload_time) FROM videos), now()) "
+        "WHERE upload_time IS NULL"
+    )
+    op.alter_column('videos', 'upload_time', existing_type=sa.DateTime(timezone=True),
+                    existing_server_default=sa.text('now()'), nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('videos', 'upload_time', existing_type=sa.DateTime(timezone=True),
+                    existing_server_default=sa.text('now()'), nullable=True)
@@ -0,0 +1,33 @@
+"""add video listing indexes
+
+Revision ID: 6db08442838f
+Revises: 82adb7080c38
+Create Date: 2026-10-17 15:10:00.011336
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6db08442838f'
+down_revision: Union[str, Sequence[str], None] = '82adb7080c38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_videos_upload_time_id', 'videos', ['upload_time', 'id'],
+        unique=False, postgresql_include=['filename', 'duration', 'size', 'width', 'height', 'fps', 'video_codec', 'audio_codec'],
+    )
+    op.create_index(op.f('ix_video_versions_video_id'), 'video_versions', ['video_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_video_versions_video_id'), table_name='video_versions')
+    op.drop_index('ix_videos_upload_time_id', table_name='videos')
@@ -0,0 +1,44 @@
+"""add video probe metadata
+
+Revision ID: 76e08cd5ba37
+Revises: 21daa66cb716
+Create Date: 2026-10-17 10:51:00.487971
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '76e08cd5ba37'
+down_revision: Union[str, Sequence[str], None] = '21daa66cb716'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('videos', 'duration', existing_type=sa.Integer(), type_=sa.Float(), existing_nullable=True)
+    op.add_column('videos', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('videos', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('videos', sa.Column('fps', sa.Float(), nullable=True))
+    op.add_column('videos', sa.Column('video_codec', sa.String(), nullable=True))
+    op.add_column('videos', sa.Column('audio_codec', sa.String(), nullable=True))
+    op.add_column('videos', sa.Column('bitrate', sa.BigInteger(), nullable=True))
+    op.add_column('videos', sa.Column('keyframe_interval', sa.Float(), nullable=True))
+    op.add_column('videos', sa.Column('probe_info', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('videos', 'probe_info')
+    op.drop_column('videos', 'keyframe_interval')
+    op.drop_column('videos', 'bitrate')
+    op.drop_column('videos', 'audio_codec')
+    op.drop_column('videos', 'video_codec')
+    op.drop_column('videos', 'fps')
+    op.drop_column('videos', 'height')
+    op.drop_column('videos', 'width')
+    op.alter_column('videos', 'duration', existing_type=sa.Float(), type_=sa.Integer(), existing_nullable=True)
@@ -0,0 +1,30 @@
+"""add overlay assets and composite task type
+
+Revision ID: 7965598ed16c
+Revises: 947addb14d3a
+Create Date: 2026-10-17 12:42:00.606853
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7965598ed16c'
+down_revision: Union[str, Sequence[str], None] = '947addb14d3a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('overlays', sa.Column('asset_path', sa.String(), nullable=True))
+    op.execute("ALTER TYPE tasktype ADD VALUE IF NOT EXISTS 'COMPOSITE_OVERLAY'")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Postgres cannot drop a value from an enum type; COMPOSITE_OVERLAY is left in place.
+    op.drop_column('overlays', 'asset_path')
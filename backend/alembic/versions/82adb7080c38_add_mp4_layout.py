@@ -0,0 +1,30 @@
+"""add mp4 layout
+
+Revision ID: 82adb7080c38
+Revises: 557129d7d809
+Create Date: 2026-10-17 14:33:00.026136
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '82adb7080c38'
+down_revision: Union[str, Sequence[str], None] = '557129d7d809'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('videos', sa.Column('mp4_layout', sa.String(), nullable=True))
+    op.add_column('video_versions', sa.Column('mp4_layout', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('video_versions', 'mp4_layout')
+    op.drop_column('videos', 'mp4_layout')
@@ -0,0 +1,28 @@
+"""add video trimmed_from index
+
+Revision ID: 8e3ef6cf0e66
+Revises: 6db08442838f
+Create Date: 2026-10-17 15:47:00.628919
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e3ef6cf0e66'
+down_revision: Union[str, Sequence[str], None] = '6db08442838f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_videos_trimmed_from_id'), 'videos', ['trimmed_from_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_videos_trimmed_from_id'), table_name='videos')
@@ -0,0 +1,29 @@
+"""add batch trim task type
+
+Revision ID: 947addb14d3a
+Revises: f0912743d302
+Create Date: 2026-10-17 12:05:00.705227
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '947addb14d3a'
+down_revision: Union[str, Sequence[str], None] = 'f0912743d302'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TYPE tasktype ADD VALUE IF NOT EXISTS 'BATCH_TRIM'")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Postgres cannot drop a value from an enum type; BATCH_TRIM is left in place.
+    pass
@@ -0,0 +1,45 @@
+"""add job indexes and archive
+
+Revision ID: bb9d59a00266
+Revises: 8e3ef6cf0e66
+Create Date: 2026-10-17 16:24:00.277781
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bb9d59a00266'
+down_revision: Union[str, Sequence[str], None] = '8e3ef6cf0e66'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_jobs_status_created_at', 'jobs', ['status', 'created_at'], unique=False)
+    op.create_index('ix_jobs_video_id_created_at', 'jobs', ['video_id', 'created_at'], unique=False)
+    op.create_table(
+        'jobs_archive',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('video_id', sa.Integer(), nullable=True),
+        sa.Column('task', postgresql.ENUM(name='tasktype', create_type=False), nullable=False),
+        sa.Column('status', postgresql.ENUM(name='jobstatus', create_type=False), nullable=False),
+        sa.Column('meta', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_jobs_archive_video_id'), 'jobs_archive', ['video_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_jobs_archive_video_id'), table_name='jobs_archive')
+    op.drop_table('jobs_archive')
+    op.drop_index('ix_jobs_video_id_created_at', table_name='jobs')
+    op.drop_index('ix_jobs_status_created_at', table_name='jobs')
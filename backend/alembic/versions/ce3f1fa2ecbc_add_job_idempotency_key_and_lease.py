@@ -0,0 +1,41 @@
+"""add job idempotency key and lease
+
+Revision ID: ce3f1fa2ecbc
+Revises: bb9d59a00266
+Create Date: 2026-10-17 17:01:00.809722
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ce3f1fa2ecbc'
+down_revision: Union[str, Sequence[str], None] = 'bb9d59a00266'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('idempotency_key', sa.String(), nullable=True))
+    op.add_column('jobs', sa.Column('lease_owner', sa.String(), nullable=True))
+    op.add_column('jobs', sa.Column('lease_expires_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('jobs', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.create_index(
+        'ix_jobs_idempotency_key_active', 'jobs', ['idempotency_key'], unique=True,
+        postgresql_where=sa.text("status IN ('PENDING', 'RUNNING')"),
+    )
+    op.create_index('ix_jobs_idempotency_key', 'jobs', ['idempotency_key'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_idempotency_key', table_name='jobs')
+    op.drop_index('ix_jobs_idempotency_key_active', table_name='jobs')
+    op.drop_column('jobs', 'attempts')
+    op.drop_column('jobs', 'lease_expires_at')
+    op.drop_column('jobs', 'lease_owner')
+    op.drop_column('jobs', 'idempotency_key')
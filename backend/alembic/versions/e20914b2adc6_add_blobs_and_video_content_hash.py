@@ -0,0 +1,39 @@
+"""add blobs and video content hash
+
+Revision ID: e20914b2adc6
+Revises: 2a85650dfc69
+Create Date: 2026-10-17 09:37:00.205280
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e20914b2adc6'
+down_revision: Union[str, Sequence[str], None] = '2a85650dfc69'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'blobs',
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('sha256'),
+    )
+    op.add_column('videos', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_videos_content_hash'), 'videos', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_videos_content_hash'), table_name='videos')
+    op.drop_column('videos', 'content_hash')
+    op.drop_table('blobs')
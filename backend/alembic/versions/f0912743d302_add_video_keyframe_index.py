@@ -0,0 +1,28 @@
+"""add video keyframe index
+
+Revision ID: f0912743d302
+Revises: 76e08cd5ba37
+Create Date: 2026-10-17 11:28:00.388023
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f0912743d302'
+down_revision: Union[str, Sequence[str], None] = '76e08cd5ba37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('videos', sa.Column('keyframes', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('videos', 'keyframes')
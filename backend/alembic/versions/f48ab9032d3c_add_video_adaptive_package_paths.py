@@ -0,0 +1,30 @@
+"""add video adaptive package paths
+
+Revision ID: f48ab9032d3c
+Revises: 7965598ed16c
+Create Date: 2026-10-17 13:19:00.206993
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f48ab9032d3c'
+down_revision: Union[str, Sequence[str], None] = '7965598ed16c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('videos', sa.Column('hls_path', sa.String(), nullable=True))
+    op.add_column('videos', sa.Column('dash_path', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('videos', 'dash_path')
+    op.drop_column('videos', 'hls_path')
@@ -2,101 +2,233 @@
 import json
 from typing import Optional
 import uuid
-from fastapi import APIRouter, Body, Depends, Form, HTTPException, UploadFile
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, Form, Header, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.db.session import get_db
-from app.tasks.video import overlay_video_task, trim_video_task
+from app.db.session import async_unit_of_work, get_async_db
+from app.tasks.routing import route_for
+from app.tasks.video import batch_trim_task, composite_overlays_task, overlay_video_task, trim_video_task
 from app.enums.job_status import JobStatus
 from app.enums.task_type import TaskType
-from app.repositories.job_repo import JobRepository
+from app.enums.overlay_kind import OverlayKind
+from app.repositories.job_repo import AsyncJobRepository, request_key
 from app.log import logger
-from app.schemas.overlay import OverlayConfigCreate
-from app.repositories.video_repo import VideoRepository
+from app.schemas.overlay import CompositeRequest, OverlayConfigCreate
+from app.schemas.video import BatchTrimRequest
+from app.repositories.video_repo import AsyncVideoRepository
+from app.repositories.blob_repo import AsyncBlobRepository
 from app.db.models.video import OverlayConfig
-from app.services import storage
+from app.services import job_cache, job_queue, storage
 
 router = APIRouter(prefix="/edit", tags=["Editing"])
 
 
 @router.post("/trim")
-def trim_video(video_id: int, start: float, end: float, db: Session = Depends(get_db)):
+async def trim_video(video_id: int, start: float, end: float, idempotency_key: Optional[str] = Header(None),
+                     db: AsyncSession = Depends(get_async_db)):
+    """
+    Cut [start, end) of a video into a new video. An identical trim already
+    in flight, or a retry with the same Idempotency-Key header, returns the
+    existing job instead of cutting again.
+    """
     job_id = str(uuid.uuid4())
-    job_repo = JobRepository(db)
+    job_repo = AsyncJobRepository(db)
     logger.info(f"Creating trim job {job_id} for video {video_id} from {start} to {end}")
 
-    # 1. Create job entry in DB (sync)
-    job_repo.create(
+    # 1. Create job entry in DB, or join the identical in-flight job
+    job, created = await job_repo.create_or_coalesce(
         job_id=job_id,
         video_id=video_id,
         task=TaskType.TRIM.value,
-        status=JobStatus.PENDING.value,
-        meta={"start": start, "end": end}
+        idempotency_key=request_key(TaskType.TRIM, video_id, {"start": start, "end": end}, idempotency_key),
+        meta={"start": start, "end": end},
+        reuse_finished=bool(idempotency_key),
     )
-    db.commit()
+    if not created:
+        return {"job_id": job.id, "video_id": video_id, "coalesced": True}
 
     # 2. Enqueue Celery task
-    trim_video_task.apply_async(args=[video_id, start, end, job_id], task_id=job_id)
+    await job_queue.send(job_repo, job_id, trim_video_task.apply_async, args=[video_id, start, end, job_id], task_id=job_id, **route_for(TaskType.TRIM, end - start))
 
     # 3. Return immediately
     return {"job_id": job_id, "video_id": video_id}
 
+@router.post("/trim/batch")
+async def batch_trim_video(req: BatchTrimRequest, idempotency_key: Optional[str] = Header(None),
+                           db: AsyncSession = Depends(get_async_db)):
+    """
+    Cut many clips from one video in a single pass. Ranges are sorted and
+    identical ranges merged; each distinct clip gets its own Video row
+    (overlapping ranges are still separate clips).
+    Identical in-flight requests share one job (see trim_video).
+    """
+    ranges = sorted({(r.start, r.end) for r in req.ranges})
+    if not ranges:
+        raise HTTPException(status_code=400, detail="At least one range is required")
+    invalid = [r for r in ranges if r[0] < 0 or r[1] <= r[0]]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid ranges (need 0 <= start < end): {invalid}")
+    if not await AsyncVideoRepository(db).get_video(req.video_id):
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    job_id = str(uuid.uuid4())
+    job_repo = AsyncJobRepository(db)
+    logger.info(f"Creating batch trim job {job_id} for video {req.video_id} with {len(ranges)} clips")
+
+    # 1. Create parent job with per-clip status, or join the identical in-flight job
+    job, created = await job_repo.create_or_coalesce(
+        job_id=job_id,
+        video_id=req.video_id,
+        task=TaskType.BATCH_TRIM.value,
+        idempotency_key=request_key(TaskType.BATCH_TRIM, req.video_id, {"ranges": ranges}, idempotency_key),
+        meta={"clips": [{"start": s, "end": e, "status": JobStatus.PENDING.value} for s, e in ranges]},
+        reuse_finished=bool(idempotency_key),
+    )
+    if not created:
+        return {"job_id": job.id, "video_id": req.video_id, "clips": len(ranges), "coalesced": True}
+
+    # 2. Enqueue Celery task
+    await job_queue.send(
+        job_repo, job_id, batch_trim_task.apply_async, args=[req.video_id, ranges, job_id], task_id=job_id,
+        **route_for(TaskType.BATCH_TRIM, sum(e - s for s, e in ranges)),
+    )
+
+    # 3. Return immediately
+    return {"job_id": job_id, "video_id": req.video_id, "clips": len(ranges)}
+
 def req_model(req: str = Form(...)) -> OverlayConfigCreate:
     return OverlayConfigCreate(**json.loads(req))
 
 @router.post("/overlay")
-def overlay(overlay_file:Optional[UploadFile] = None,req: OverlayConfigCreate = Depends(req_model), db: Session = Depends(get_db)):
+async def overlay(overlay_file:Optional[UploadFile] = None,req: OverlayConfigCreate = Depends(req_model), apply: bool = True,
+                  idempotency_key: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
     """
-    Enqueue overlay/watermark task immediately.
+    Save an overlay config (and its asset) and enqueue the overlay task immediately.
+    With apply=false the config is only saved, to be rendered later together
+    with other overlays through /edit/composite. An identical overlay already
+    being applied returns that job, without saving another config.
     """
     # req_dict = json.loads(req)  # parse JSON string
     # req = OverlayConfigCreate(**req_dict)  # create Pydantic model
-    v_repo = VideoRepository(db)  
-    video = v_repo.get_video(req.video_id)
+    v_repo = AsyncVideoRepository(db)
+    video = await v_repo.get_video(req.video_id)
 
-    logger.info(f"Received overlay request: {req}, file: {overlay_file.filename}")
+    logger.info(f"Received overlay request: {req}, file: {overlay_file.filename if overlay_file else None}")
 
     if not video:
         raise HTTPException(status_code=404, detail="Video not found")
-    
-    # Read bytes from UploadFile (sync read using file.file.read)
-    file_bytes = overlay_file.file.read()
-
-    if not file_bytes:
-        logger.error(f"Empty file uploaded: {overlay_file.filename}")
-        raise HTTPException(status_code=400, detail="Empty file uploaded")
-    
-    # 1. Save file (sync)
-    filepath = storage.save_upload(file_bytes, overlay_file.filename)
+    if req.kind != OverlayKind.TEXT and not overlay_file:
+        raise HTTPException(status_code=400, detail=f"{req.kind.value} overlay requires an overlay_file")
+
+    # 1. Stream file to the blob store in chunks (file I/O off the event loop)
+    filepath = None
+    if overlay_file:
+        try:
+            filepath, size, sha256 = await run_in_threadpool(storage.save_upload_stream, overlay_file.file, overlay_file.filename)
+        except storage.EmptyUploadError as e:
+            logger.error(str(e))
+            raise HTTPException(status_code=400, detail="Empty file uploaded")
+        except storage.UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
 
     job_id = str(uuid.uuid4())
-    job_repo = JobRepository(db)
+    job_repo = AsyncJobRepository(db)
+
+    # 2. Job entry (or the identical in-flight job), asset reference and
+    # overlay config in one transaction
+    task = TaskType(f"{req.kind.value}_OVERLAY")
+    created = True
+    async with async_unit_of_work(db):
+        if apply:
+            job, created = await job_repo.create_or_coalesce(
+                job_id=job_id,
+                video_id=video.id,
+                task=task.value,
+                idempotency_key=request_key(
+                    task, video.id, {"params": req.params.model_dump(), "asset": sha256 if overlay_file else None}, idempotency_key,
+                ),
+                meta={},
+                reuse_finished=bool(idempotency_key),
+            )
+
+        if created:
+            if overlay_file:
+                await AsyncBlobRepository(db).acquire(sha256, size)
+
+            overlay = OverlayConfig(
+                video_id=req.video_id,
+                kind=req.kind,
+                params=req.params.model_dump(),
+                asset_path=filepath
+            )
+            db.add(overlay)
+            await db.flush()
+            if apply:
+                job.meta = {"overlay_id": overlay.id}
+                await db.flush()
+                job_cache.stage(db, job)
+
+    if not created:
+        # The existing job holds its own reference on the asset
+        if filepath:
+            await AsyncBlobRepository(db).discard(sha256, size, filepath)
+        return {"job_id": job.id, "video_id": video.id, "overlay_id": job.meta.get("overlay_id"), "coalesced": True}
+
+    if not apply:
+        return {"overlay_id": overlay.id, "video_id": video.id}
+
+    # 3. Enqueue Celery task
+    await job_queue.send(
+        job_repo, job_id, overlay_video_task.apply_async, args=[video.id, filepath, req.kind.value, req.params.model_dump(), job_id], task_id=job_id,
+        **route_for(TaskType(f"{req.kind.value}_OVERLAY"), video.duration),
+    )
+
+    return {"job_id": job_id, "video_id": video.id, "overlay_id": overlay.id}
 
-    overlay_tasks = [TaskType.TEXT_OVERLAY.value, TaskType.IMAGE_OVERLAY.value, TaskType.VIDEO_OVERLAY.value]
 
-    task  = TaskType(req.kind).value if req.kind in overlay_tasks else None
-    if not task:
-        raise HTTPException(status_code=400, detail=f"Invalid overlay kind , must be one of {overlay_tasks}")
-    # 1. Create job entry
-    job_repo.create(
+@router.post("/composite")
+async def composite_overlays(req: CompositeRequest, idempotency_key: Optional[str] = Header(None),
+                             db: AsyncSession = Depends(get_async_db)):
+    """
+    Render several saved overlays onto a video in one encode. overlay_ids
+    gives the stacking order (first is drawn first); when omitted every
+    overlay saved for the video is applied in creation order. The result is
+    written as a new video, the source is left untouched. Identical
+    in-flight requests share one job.
+    """
+    video = await AsyncVideoRepository(db).get_video(req.video_id)
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    overlays = (await db.execute(
+        select(OverlayConfig).where(OverlayConfig.video_id == req.video_id).order_by(OverlayConfig.id)
+    )).scalars().all()
+    if req.overlay_ids is not None:
+        by_id = {o.id: o for o in overlays}
+        unknown = [i for i in req.overlay_ids if i not in by_id]
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Overlays not found for video {req.video_id}: {unknown}")
+        overlays = [by_id[i] for i in req.overlay_ids]
+    if not overlays:
+        raise HTTPException(status_code=400, detail="No overlays to apply")
+
+    overlay_ids = [o.id for o in overlays]
+    job_id = str(uuid.uuid4())
+    job_repo = AsyncJobRepository(db)
+    job, created = await job_repo.create_or_coalesce(
         job_id=job_id,
         video_id=video.id,
-        task=task,
-        status=JobStatus.PENDING.value,
-        meta={}
+        task=TaskType.COMPOSITE_OVERLAY.value,
+        idempotency_key=request_key(TaskType.COMPOSITE_OVERLAY, video.id, {"overlay_ids": overlay_ids}, idempotency_key),
+        meta={"overlay_ids": overlay_ids},
+        reuse_finished=bool(idempotency_key),
     )
-    db.commit()
+    if not created:
+        return {"job_id": job.id, "video_id": video.id, "overlay_ids": overlay_ids, "coalesced": True}
 
-    overlay = OverlayConfig(
-        video_id=req.video_id,
-        kind=req.kind,
-        params=req.params
+    await job_queue.send(
+        job_repo, job_id, composite_overlays_task.apply_async, args=[video.id, overlay_ids, job_id], task_id=job_id,
+        **route_for(TaskType.COMPOSITE_OVERLAY, video.duration),
     )
-    # 2. Save overlay/watermark config in DB
-    db.add(overlay)
-    db.commit()
-
-    # 3. Enqueue Celery task
-    overlay_video_task.apply_async(args=[video.id, filepath,overlay_tasks, req.params, job_id], task_id=job_id)
-
-    return {"job_id": job_id, "video_id": video.id}
+    return {"job_id": job_id, "video_id": video.id, "overlay_ids": overlay_ids}
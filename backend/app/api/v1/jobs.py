@@ -1,36 +1,166 @@
 # app/api/v1/jobs.py
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from fastapi.responses import FileResponse
+import asyncio
+import json
+import time
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import StreamingResponse
 
-from app.db.session import get_db
-from app.repositories.job_repo import JobRepository
+from app.db.session import AsyncSessionLocal, get_async_db
+from app.repositories.job_repo import TERMINAL_STATUSES, AsyncJobRepository
+from app.repositories.pagination import InvalidCursorError
+from app.repositories.video_repo import AsyncVideoRepository
 from app.enums.job_status import JobStatus
-from app.db.models.video import VideoVersion
+from app.schemas.video import JobSummary
+from app.services import file_serving, job_cache
+from app.tasks.celery_app import celery
 
 router = APIRouter(prefix="/jobs", tags=["Jobs"])
 
 
-@router.get("/{job_id}")
-def get_job_status(job_id: str, db: Session = Depends(get_db)):
-    job_repo = JobRepository(db)
-    job = job_repo.find(job_id)  # sync call
+# Seconds between Redis reads while streaming, and between keep-alive comments
+STREAM_POLL_INTERVAL = 1.0
+STREAM_HEARTBEAT = 15.0
+
+
+def _celery_state(job_id: str):
+    """(state, info) of the job's Celery task; a blocking Redis read."""
+    result = celery.AsyncResult(job_id)
+    return result.state, result.info
+
+
+async def _live_progress(job_id: str) -> Optional[dict]:
+    """ffmpeg progress published by the running task (Celery state in Redis), if any."""
+    state, info = await run_in_threadpool(_celery_state, job_id)
+    if state == "PROGRESS" and isinstance(info, dict):
+        return info
+    return None
+
+
+async def _load_job(job_id: str, db: AsyncSession) -> Optional[dict]:
+    """
+    Job snapshot (see job_cache.snapshot) from the Redis status cache, or
+    from Postgres on a miss, which repopulates the cache.
+    """
+    snap = await job_cache.get(job_id)
+    if snap is not None:
+        return snap
+    job = await AsyncJobRepository(db).find(job_id)
     if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
+        return None
+    snap = job_cache.snapshot(job)
+    await job_cache.populate(snap)
+    snap["created_at"] = job.created_at
+    return snap
+
+
+def _job_payload(snap: dict, progress: Optional[dict] = None) -> dict:
     return {
-        "job_id": job.id,
-        "status": job.status,
-        "task": job.task,
-        "meta": job.meta,
-        "created_at": job.created_at,
+        "job_id": snap["job_id"],
+        "status": snap["status"],
+        "task": snap["task"],
+        "meta": snap["meta"],
+        "progress": progress,
+        "created_at": snap["created_at"],
     }
 
 
-@router.get("/result/{job_id}")
-def get_result(job_id: str, db: Session = Depends(get_db)):
-    repo = JobRepository(db)
-    job = repo.find(job_id)  # sync call
+@router.get("/", response_model=list[JobSummary])
+async def list_jobs(
+    request: Request,
+    response: Response,
+    status: Optional[JobStatus] = None,
+    video_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    List jobs newest first, optionally filtered by status and/or video.
+    Cursor-paginated like GET /videos (X-Next-Cursor / Link rel="next").
+    Finished jobs older than JOB_RETENTION_DAYS are archived and not listed.
+    """
+    try:
+        jobs, next_cursor = await AsyncJobRepository(db).list_page(
+            limit=limit, cursor=cursor, status=status, video_id=video_id,
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return jobs
+
+
+@router.get("/{job_id}")
+async def get_job_status(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Served from the Redis status cache; Postgres is only read on a miss."""
+    job = await _load_job(job_id, db)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    progress = await _live_progress(job_id) if job["status"] == JobStatus.RUNNING else None
+    return _job_payload(job, progress)
+
+
+@router.get("/{job_id}/events")
+async def stream_job_status(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Server-Sent Events stream of a job: a "status" event on every change
+    and "progress" events (out_time, fps, speed, percent, eta) while ffmpeg
+    runs. Status is re-read from the job status cache (written through on
+    every change) each poll interval, so jobs that never run as a Celery
+    task of their own (pipelines, skipped steps, failed enqueues) are
+    followed too; the Celery result backend is only read for progress.
+    The database is only queried on a cache miss, each time on a
+    short-lived session so an open stream does not pin a pooled connection.
+    The stream ends after the job reaches SUCCESS or FAILED.
+    """
+    job = await _load_job(job_id, db)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await db.commit()  # release the request session's connection before streaming
+
+    def event(name: str, data) -> str:
+        return f"event: {name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    async def events():
+        current = job
+        yield event("status", _job_payload(current))
+        last_progress = None
+        last_sent = time.monotonic()
+        while current["status"] not in TERMINAL_STATUSES:
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+            async with AsyncSessionLocal() as session:
+                refreshed = await _load_job(job_id, session)
+            if refreshed and (refreshed["status"] != current["status"] or refreshed["meta"] != current["meta"]):
+                current = refreshed
+                yield event("status", _job_payload(current))
+                last_sent = time.monotonic()
+            if current["status"] == JobStatus.RUNNING:
+                progress = await _live_progress(job_id)
+                if progress is not None and progress != last_progress:
+                    last_progress = progress
+                    yield event("progress", last_progress)
+                    last_sent = time.monotonic()
+            if time.monotonic() - last_sent >= STREAM_HEARTBEAT:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.api_route("/result/{job_id}", methods=["GET", "HEAD"])
+async def get_result(job_id: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    repo = AsyncJobRepository(db)
+    job = await repo.find(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
@@ -43,12 +173,16 @@ def get_result(job_id: str, db: Session = Depends(get_db)):
     if not video_version_id:
         raise HTTPException(status_code=500, detail="No result linked to this job")
 
-    vv = db.get(VideoVersion, video_version_id)  # sync get
+    vv = await AsyncVideoRepository(db).get_version_by_id(video_version_id)
     if not vv:
         raise HTTPException(status_code=404, detail="Video version not found")
 
-    return FileResponse(
-        path=vv.filepath,
-        filename=vv.filepath.split("/")[-1]
+    return file_serving.serve_file(
+        request,
+        vv.filepath,
+        size=vv.size,
+        mtime=vv.mtime,
+        media_type="video/mp4",
+        filename=vv.filepath.split("/")[-1],
     )
 
@@ -1,10 +1,11 @@
 from fastapi import APIRouter
-from . import video, editing, jobs
+from . import video, editing, jobs, uploads
 
 router = APIRouter()
 router.include_router(video.router)
 router.include_router(editing.router)
 router.include_router(jobs.router)
+router.include_router(uploads.router)
 
 # ✅ Test endpoint
 @router.get("/ping")
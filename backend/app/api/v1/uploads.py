@@ -0,0 +1,203 @@
+# app/api/v1/uploads.py
+import math
+import uuid
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import async_unit_of_work, get_async_db
+from app.core.config import settings
+from app.services import job_queue, storage
+from app.tasks.routing import route_for
+from app.tasks.video import process_upload_task
+from app.enums.job_status import JobStatus
+from app.enums.task_type import TaskType
+from app.repositories.job_repo import AsyncJobRepository
+from app.repositories.video_repo import AsyncVideoRepository
+from app.repositories.blob_repo import AsyncBlobRepository
+from app.log import logger
+
+router = APIRouter(prefix="/uploads", tags=["Uploads"])
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+async def _get_upload_job(job_repo: AsyncJobRepository, job_id: str):
+    job = await job_repo.find(job_id)
+    if not job or job.task != TaskType.UPLOAD or "upload_path" not in (job.meta or {}):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return job
+
+
+def _upload_state(job) -> dict:
+    meta = job.meta or {}
+    received = sorted(int(n) for n in meta.get("parts", {}))
+    return {
+        "upload_id": job.id,
+        "status": job.status,
+        "filename": meta.get("filename"),
+        "total_size": meta.get("total_size"),
+        "part_size": meta.get("part_size"),
+        "part_count": meta.get("part_count"),
+        "received_parts": received,
+        "missing_parts": [n for n in range(1, meta.get("part_count", 0) + 1) if n not in received],
+        "progress": meta.get("progress", 0.0),
+    }
+
+
+@router.post("")
+async def initiate_upload(filename: str, total_size: int, part_size: int = 8 * 1024 * 1024, db: AsyncSession = Depends(get_async_db)):
+    """
+    Start a multi-part upload. Parts are numbered from 1 and every part but
+    the last must be exactly part_size bytes.
+    """
+    if total_size <= 0:
+        raise HTTPException(status_code=400, detail="total_size must be positive")
+    if total_size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds maximum size of {settings.MAX_UPLOAD_SIZE} bytes")
+    if part_size < MIN_PART_SIZE and part_size < total_size:
+        raise HTTPException(status_code=400, detail=f"part_size must be at least {MIN_PART_SIZE} bytes")
+
+    job_id = str(uuid.uuid4())
+    upload_path = await run_in_threadpool(storage.create_multipart, job_id, total_size)
+    part_count = math.ceil(total_size / part_size)
+
+    job_repo = AsyncJobRepository(db)
+    job = await job_repo.create(
+        job_id=job_id,
+        video_id=None,
+        task=TaskType.UPLOAD.value,
+        status=JobStatus.PENDING.value,
+        meta={
+            "filename": filename,
+            "upload_path": upload_path,
+            "total_size": total_size,
+            "part_size": part_size,
+            "part_count": part_count,
+            "parts": {},
+            "received_bytes": 0,
+            "progress": 0.0,
+        },
+    )
+    logger.info(f"Initiated multipart upload {job_id} for {filename}: {part_count} parts")
+    return _upload_state(job)
+
+
+@router.get("/{job_id}")
+async def get_upload(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Return received/missing parts so a client can resume after a drop."""
+    return _upload_state(await _get_upload_job(AsyncJobRepository(db), job_id))
+
+
+@router.put("/{job_id}/parts/{part_number}")
+async def upload_part(job_id: str, part_number: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Receive one part as the raw request body. The body is streamed straight
+    to its offset in the assembly file, so parts may arrive in parallel and
+    in any order; re-sending a part overwrites it.
+    """
+    job_repo = AsyncJobRepository(db)
+    job = await _get_upload_job(job_repo, job_id)
+    # End the read transaction so no pooled connection is held while the body streams
+    await db.commit()
+    meta = job.meta
+    if job.status != JobStatus.PENDING:
+        raise HTTPException(status_code=409, detail=f"Upload is not accepting parts (status={job.status})")
+    if not 1 <= part_number <= meta["part_count"]:
+        raise HTTPException(status_code=400, detail=f"part_number must be between 1 and {meta['part_count']}")
+
+    offset = (part_number - 1) * meta["part_size"]
+    expected = min(meta["part_size"], meta["total_size"] - offset)
+
+    try:
+        fd = await run_in_threadpool(storage.open_multipart, meta["upload_path"])
+    except storage.UploadClosedError:
+        raise HTTPException(status_code=409, detail="Upload is not accepting parts (already completed or aborted)")
+    received = 0
+    buffer = bytearray()
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > expected:
+                raise HTTPException(status_code=400, detail=f"Part {part_number} exceeds expected size {expected}")
+            buffer += chunk
+            if len(buffer) >= settings.UPLOAD_CHUNK_SIZE:
+                offset = await run_in_threadpool(storage.write_part_chunk, fd, bytes(buffer), offset)
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(storage.write_part_chunk, fd, bytes(buffer), offset)
+    finally:
+        storage.close_multipart(fd)
+
+    if received != expected:
+        raise HTTPException(status_code=400, detail=f"Part {part_number} has {received} bytes, expected {expected}")
+
+    # Re-checked under the row lock: a complete may have started meanwhile
+    job = await job_repo.record_upload_part(job_id, part_number, received)
+    if job is None:
+        raise HTTPException(status_code=409, detail="Upload is not accepting parts (already completed or aborted)")
+    return {"upload_id": job_id, "part_number": part_number, "size": received, "progress": job.meta["progress"]}
+
+
+@router.post("/{job_id}/complete")
+async def complete_upload(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Assemble the upload and hand it to process_upload_task under the same
+    job id. Concurrent completes of one upload: one wins, the others get 409.
+    """
+    job_repo = AsyncJobRepository(db)
+    job = await _get_upload_job(job_repo, job_id)
+    if job.status != JobStatus.PENDING:
+        raise HTTPException(status_code=409, detail=f"Upload already completed (status={job.status})")
+
+    state = _upload_state(job)
+    if state["missing_parts"]:
+        raise HTTPException(status_code=400, detail=f"Missing parts: {state['missing_parts']}")
+
+    # Only the request that moves the job out of PENDING assembles the file;
+    # parts are refused from then on
+    job = await job_repo.transition(job_id, JobStatus.PENDING.value, JobStatus.RUNNING.value)
+    if job is None:
+        raise HTTPException(status_code=409, detail="Upload is already being completed")
+
+    try:
+        filepath, size, sha256 = await run_in_threadpool(storage.complete_multipart, job.meta["upload_path"], job.meta["filename"])
+    except Exception as e:
+        logger.error(f"Could not assemble multipart upload {job_id}: {e}", exc_info=True)
+        await job_repo.update_status(job_id=job_id, status=JobStatus.FAILED.value, meta={"error": f"Could not assemble upload: {e}"})
+        raise HTTPException(status_code=500, detail="Could not assemble upload")
+
+    existing = await AsyncVideoRepository(db).find_by_content_hash(sha256)
+    if existing:
+        await AsyncBlobRepository(db).discard(sha256, size, filepath)
+        logger.info(f"Multipart upload {job_id} duplicates video {existing.id}, skipping processing")
+        await job_repo.update_status(
+            job_id=job_id,
+            status=JobStatus.SUCCESS.value,
+            meta={"filepath": existing.filepath, "video_id": existing.id, "deduplicated": True, "progress": 1.0},
+        )
+        return {"job_id": job_id, "filename": job.meta["filename"], "size": size, "video_id": existing.id}
+
+    async with async_unit_of_work(db):
+        await AsyncBlobRepository(db).acquire(sha256, size)
+        await job_repo.update_status(
+            job_id=job_id,
+            status=JobStatus.RUNNING.value,
+            meta={"filepath": filepath, "sha256": sha256, "progress": 1.0},
+        )
+
+    await job_queue.send(job_repo, job_id, process_upload_task.apply_async, args=[filepath, job.meta["filename"], job_id, sha256], task_id=job_id, **route_for(TaskType.UPLOAD))
+    return {"job_id": job_id, "filename": job.meta["filename"], "size": size}
+
+
+@router.delete("/{job_id}")
+async def abort_upload(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    job_repo = AsyncJobRepository(db)
+    job = await _get_upload_job(job_repo, job_id)
+    if job.status != JobStatus.PENDING:
+        raise HTTPException(status_code=409, detail=f"Upload already completed (status={job.status})")
+
+    if await job_repo.transition(job_id, JobStatus.PENDING.value, JobStatus.FAILED.value) is None:
+        raise HTTPException(status_code=409, detail="Upload is already being completed")
+    await run_in_threadpool(storage.abort_multipart, job.meta["upload_path"])
+    await job_repo.update_status(job_id=job_id, status=JobStatus.FAILED.value, meta={"error": "Upload aborted"})
+    return {"upload_id": job_id, "status": JobStatus.FAILED.value}
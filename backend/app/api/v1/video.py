@@ -1,83 +1,236 @@
 # app/api/v1/videos.py
+import os
 import uuid
-from fastapi import APIRouter, Depends, UploadFile, HTTPException
-from sqlalchemy.orm import Session
-from app.db.session import get_db
-from app.schemas.video import VideoOut
-from app.services import video_service, storage
+from typing import List, Optional, Tuple
+from celery import chain
+from fastapi import APIRouter, Depends, Header, Query, Request, Response, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import async_unit_of_work, get_async_db
+from app.schemas.video import LineageNode, VideoSummary
+from app.services import job_queue, video_service, storage
+from app.tasks.pipeline import STEP_TASK_TYPES, advance_pipeline_task
+from app.tasks.routing import route_for
 from app.tasks.video import add_watermark_task, generate_versions_task, process_upload_task
 from app.enums.job_status import JobStatus
+from app.enums.pipeline_step import PipelineStep
 from app.enums.task_type import TaskType
-from app.repositories.job_repo import JobRepository
-from app.repositories.video_repo import VideoRepository
+from app.repositories.job_repo import AsyncJobRepository, request_key
+from app.repositories.video_repo import AsyncVideoRepository
+from app.repositories.pagination import InvalidCursorError
+from app.repositories.blob_repo import AsyncBlobRepository
 from app.log import logger
 
 router = APIRouter(prefix="/videos", tags=["Videos"])
 
 
+async def _create_pipeline(job_repo: AsyncJobRepository, upload_job_id: str, steps: List[PipelineStep], meta: dict) -> Tuple[str, dict]:
+    """Create the PIPELINE job of an upload and a PENDING job per step (see app.tasks.pipeline)."""
+    pipeline_job_id = str(uuid.uuid4())
+    step_jobs = {PipelineStep.PROBE.value: upload_job_id}
+    for step in steps:
+        step_jobs[step.value] = str(uuid.uuid4())
+        await job_repo.create(
+            job_id=step_jobs[step.value],
+            video_id=None,
+            task=STEP_TASK_TYPES[step].value,
+            status=JobStatus.PENDING.value,
+            meta={"pipeline_job_id": pipeline_job_id}
+        )
+    await job_repo.create(
+        job_id=pipeline_job_id,
+        video_id=None,
+        task=TaskType.PIPELINE.value,
+        status=JobStatus.PENDING.value,
+        meta={"steps": step_jobs, **meta}
+    )
+    return pipeline_job_id, step_jobs
+
+
 @router.post("/upload")
-def upload_video(file: UploadFile, db: Session = Depends(get_db)):
+async def upload_video(
+    file: UploadFile,
+    steps: List[PipelineStep] = Query([]),
+    package: bool = False,
+    watermark: Optional[UploadFile] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Upload a video. steps (repeatable, e.g. ?steps=RENDITIONS&steps=THUMBNAILS)
+    are run as soon as the upload is probed, independent ones in parallel;
+    WATERMARK needs the image in the watermark form field and runs before
+    the others, package=true packages the renditions as HLS + DASH. An
+    upload of already stored content reuses that video, unless it asks for
+    a WATERMARK, which would rewrite the shared video in place. The
+    response then carries pipeline_job_id, a job aggregating the status of
+    every step, and the job id of each step.
+    """
+    steps = [step for step in dict.fromkeys(steps) if step != PipelineStep.PROBE]
+    if PipelineStep.WATERMARK in steps and watermark is None:
+        raise HTTPException(status_code=400, detail="The WATERMARK step needs a watermark file")
+
     try:
         logger.info(f"Received file: {file.filename}, content_type: {file.content_type}")
         
-        # Read bytes from UploadFile (sync read using file.file.read)
-        file_bytes = file.file.read()
+        # 1. Stream file to the blob store in chunks (file I/O off the event loop)
+        filepath, size, sha256 = await run_in_threadpool(storage.save_upload_stream, file.file, file.filename)
+        pipeline_meta, asset_blob = {"package": package}, None
+        if PipelineStep.WATERMARK in steps:
+            asset_path, asset_size, asset_sha256 = await run_in_threadpool(storage.save_upload_stream, watermark.file, watermark.filename)
+            pipeline_meta["watermark_path"] = asset_path
+            asset_blob = (asset_sha256, asset_size)
 
-        if not file_bytes:
-            logger.error(f"Empty file uploaded: {file.filename}")
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
-        
-        # 1. Save file (sync)
-        filepath = storage.save_upload(file_bytes, file.filename)
-
-        # 2. Create Job record immediately
         job_id = str(uuid.uuid4())
-        job_repo = JobRepository(db)
-        job_repo.create(
-            job_id=job_id,
-            video_id=None,
-            task=TaskType.UPLOAD.value,
-            status=JobStatus.PENDING.value,
-            meta={}
-        )
-        db.commit()
+        job_repo = AsyncJobRepository(db)
+        pipeline_job_id = step_jobs = None
 
-        # 3. Enqueue Celery task
-        process_upload_task.apply_async(args=[filepath, file.filename, job_id], task_id=job_id)
+        # 2. Identical content already uploaded: metadata-only, no processing
+        # (requested steps still run, on the existing video). WATERMARK
+        # rewrites its video in place, so such an upload gets a video of its
+        # own instead of editing the existing one.
+        existing = None
+        if PipelineStep.WATERMARK not in steps:
+            existing = await AsyncVideoRepository(db).find_by_content_hash(sha256)
+        if existing:
+            await AsyncBlobRepository(db).discard(sha256, size, filepath)
+            logger.info(f"Upload {file.filename} duplicates video {existing.id}, skipping processing")
+            async with async_unit_of_work(db):
+                await job_repo.create(
+                    job_id=job_id,
+                    video_id=existing.id,
+                    task=TaskType.UPLOAD.value,
+                    status=JobStatus.SUCCESS.value,
+                    meta={"filepath": existing.filepath, "video_id": existing.id, "deduplicated": True}
+                )
+                if steps:
+                    if asset_blob:
+                        await AsyncBlobRepository(db).acquire(*asset_blob)
+                    pipeline_job_id, step_jobs = await _create_pipeline(job_repo, job_id, steps, pipeline_meta)
+            if not steps:
+                return {"job_id": job_id, "filename": file.filename, "video_id": existing.id}
+            # The upload job itself already succeeded
+            await job_queue.send(
+                job_repo, [pipeline_job_id, *(step_jobs[step.value] for step in steps)],
+                advance_pipeline_task.apply_async, args=[pipeline_job_id], **route_for(TaskType.PIPELINE),
+            )
+            return {"job_id": job_id, "filename": file.filename, "video_id": existing.id,
+                    "pipeline_job_id": pipeline_job_id, "steps": step_jobs}
 
-        # 4. Return job_id immediately
-        return {"job_id": job_id, "filename": file.filename}
+        # 3. Take the blob reference and create the Job record(s) in one transaction
+        async with async_unit_of_work(db):
+            await AsyncBlobRepository(db).acquire(sha256, size)
+            await job_repo.create(
+                job_id=job_id,
+                video_id=None,
+                task=TaskType.UPLOAD.value,
+                status=JobStatus.PENDING.value,
+                meta={}
+            )
+            if steps:
+                if asset_blob:
+                    await AsyncBlobRepository(db).acquire(*asset_blob)
+                pipeline_job_id, step_jobs = await _create_pipeline(job_repo, job_id, steps, pipeline_meta)
+
+        # 4. Enqueue Celery task (broker round trip off the event loop); with
+        # steps, the pipeline is chained after it
+        upload = process_upload_task.si(filepath, file.filename, job_id, sha256).set(task_id=job_id, **route_for(TaskType.UPLOAD))
+        if not steps:
+            await job_queue.send(job_repo, job_id, upload.apply_async)
+            # 5. Return job_id immediately
+            return {"job_id": job_id, "filename": file.filename}
+
+        await job_queue.send(
+            job_repo, [pipeline_job_id, *step_jobs.values()],
+            chain(upload, advance_pipeline_task.si(pipeline_job_id)).apply_async,
+        )
+        return {"job_id": job_id, "filename": file.filename, "pipeline_job_id": pipeline_job_id, "steps": step_jobs}
 
+    except HTTPException:
+        raise
+    except storage.EmptyUploadError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    except storage.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/", response_model=list[VideoOut])
-def list_videos(db: Session = Depends(get_db)):
-    v_repo = VideoRepository(db)
-    videos = v_repo.list()  # sync
+@router.get("/", response_model=list[VideoSummary])
+async def list_videos(
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    min_duration: Optional[float] = None,
+    max_duration: Optional[float] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    has_versions: Optional[bool] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    List videos newest first. Pages are cursor-based: pass the X-Next-Cursor
+    header of a response (also in its Link rel="next") as cursor to get the
+    next page; the header is absent on the last page.
+    """
+    v_repo = AsyncVideoRepository(db)
+    try:
+        videos, next_cursor = await v_repo.list_page(
+            limit=limit,
+            cursor=cursor,
+            min_duration=min_duration,
+            max_duration=max_duration,
+            min_size=min_size,
+            max_size=max_size,
+            has_versions=has_versions,
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
     return videos
 
 
 @router.post("/{video_id}/versions")
-def create_versions(video_id: int, db: Session = Depends(get_db)):
+async def create_versions(
+    video_id: int,
+    package: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Encode every rendition (optionally packaged as HLS + DASH). An identical
+    request while one is in flight, or a retry with the same Idempotency-Key
+    header, returns the existing job instead of encoding again.
+    """
     try:
-        logger.info(f"Request to generate versions for video_id: {video_id}")
+        logger.info(f"Request to generate versions for video_id: {video_id} (package={package})")
 
-        # 2. Create Job record immediately
+        # 2. Create Job record immediately (or join the identical in-flight one);
+        # the probed duration picks the queue
+        video = await AsyncVideoRepository(db).get_video(video_id)
         job_id = str(uuid.uuid4())
-        job_repo = JobRepository(db)
-        job_repo.create(
+        job_repo = AsyncJobRepository(db)
+        job, created = await job_repo.create_or_coalesce(
             job_id=job_id,
             video_id=None,
             task=TaskType.TRANSCODE.value,
-            status=JobStatus.PENDING.value,
-            meta={}
+            idempotency_key=request_key(TaskType.TRANSCODE, video_id, {"package": package}, idempotency_key),
+            meta={},
+            reuse_finished=bool(idempotency_key),
         )
-        db.commit()
+        if not created:
+            return {"job_id": job.id, "video_id": video_id, "coalesced": True}
 
         # 3. Enqueue Celery task
-        generate_versions_task.apply_async(args=[video_id, job_id], task_id=job_id)
+        await job_queue.send(
+            job_repo, job_id, generate_versions_task.apply_async, args=[video_id, job_id], kwargs={"package": package}, task_id=job_id,
+            **route_for(TaskType.TRANSCODE, video.duration if video else None),
+        )
 
         # 4. Return job_id immediately
         return {"job_id": job_id, "video_id": video_id}
@@ -87,53 +240,124 @@ def create_versions(video_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/{video_id}/versions")
-def list_versions(video_id: int, db: Session = Depends(get_db)):
-    v_repo = VideoRepository(db)
-    return v_repo.get_video_versions(video_id)  # sync
+async def list_versions(video_id: int, db: AsyncSession = Depends(get_async_db)):
+    v_repo = AsyncVideoRepository(db)
+    return await v_repo.get_video_versions(video_id)
+
+
+@router.get("/{video_id}/lineage", response_model=LineageNode)
+async def get_lineage(video_id: int, from_root: bool = False, db: AsyncSession = Depends(get_async_db)):
+    """
+    Whole derivation tree of a video (trims of trims and every encoding) in a
+    single recursive query. from_root=true starts at the original upload.
+    """
+    v_repo = AsyncVideoRepository(db)
+    tree = await v_repo.get_lineage(video_id, from_root)
+    if tree is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return tree
 
 
-@router.get("/{video_id}/versions/{quality}")
-def download_version(video_id: int, quality: str, db: Session = Depends(get_db)):
+@router.api_route("/{video_id}/versions/{quality}", methods=["GET", "HEAD"])
+async def download_version(video_id: int, quality: str, request: Request, db: AsyncSession = Depends(get_async_db)):
     # try:
     #     # convert "720p" → VideoQuality.P720
     #     quality_enum = VideoQuality(quality)
     # except ValueError:
     #     raise HTTPException(status_code=400, detail=f"Invalid quality: {quality}")
-    return video_service.get_version_file(video_id, quality)  # sync
+    return await video_service.get_version_file(request, db, video_id, quality)
+
+async def _redirect_to_package(request: Request, video_id: int, attr: str, db: AsyncSession) -> RedirectResponse:
+    video = await AsyncVideoRepository(db).get_video(video_id)
+    target = getattr(video, attr, None) if video else None
+    if not target:
+        raise HTTPException(status_code=404, detail="Video has no adaptive package")
+    package_id, path = os.path.relpath(target, video_service.package_dir(video.filepath, video.id)).split(os.sep, 1)
+    # Only this pointer moves when a package is regenerated; the package itself is immutable.
+    return RedirectResponse(
+        url=str(request.url_for("package_file", video_id=video_id, package_id=package_id, path=path)),
+        status_code=307,
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@router.get("/{video_id}/hls")
+async def hls_master(video_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await _redirect_to_package(request, video_id, "hls_path", db)
+
+
+@router.get("/{video_id}/dash")
+async def dash_manifest(video_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await _redirect_to_package(request, video_id, "dash_path", db)
+
+
+@router.api_route("/{video_id}/packages/{package_id}/{path:path}", methods=["GET", "HEAD"])
+async def package_file(video_id: int, package_id: str, path: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    video = await AsyncVideoRepository(db).get_video(video_id)
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return video_service.get_package_file(request, video.filepath, video.id, package_id, path)
+
+
+@router.api_route("/{video_id}/thumbnails/{index}", methods=["GET", "HEAD"])
+async def thumbnail_file(video_id: int, index: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Thumbnail index (0 to THUMBNAIL_COUNT - 1) of a video, made by the THUMBNAILS pipeline step."""
+    video = await AsyncVideoRepository(db).get_video(video_id)
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return video_service.get_thumbnail_file(request, video.filepath, video.id, index)
+
 
 @router.post("/{video_id}/watermark")
-def add_watermark(video_id: int, watermark: UploadFile, db: Session = Depends(get_db)):
+async def add_watermark(
+    video_id: int,
+    watermark: UploadFile,
+    idempotency_key: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Watermark a video in place; identical in-flight requests share one job (see create_versions)."""
     try:
         logger.info(f"Received watermark file: {watermark.filename}, content_type: {watermark.content_type}")
         
-        # Read bytes from UploadFile (sync read using file.file.read)
-        file_bytes = watermark.file.read()
-
-        if not file_bytes:
-            logger.error(f"Empty file uploaded: {watermark.filename}")
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
-        
-        # 1. Save file (sync)
-        filepath = storage.save_upload(file_bytes, watermark.filename)
+        # 1. Stream file to the blob store in chunks (file I/O off the event loop)
+        filepath, size, sha256 = await run_in_threadpool(storage.save_upload_stream, watermark.file, watermark.filename)
 
-        # 2. Create Job record immediately
+        # 2. Take the blob reference and create the Job record in one transaction
+        video = await AsyncVideoRepository(db).get_video(video_id)
         job_id = str(uuid.uuid4())
-        job_repo = JobRepository(db)
-        job_repo.create(
-            job_id=job_id,
-            video_id=None,
-            task=TaskType.WATERMARK.value,
-            status=JobStatus.PENDING.value,
-            meta={}
-        )
-        db.commit()
+        job_repo = AsyncJobRepository(db)
+        async with async_unit_of_work(db):
+            job, created = await job_repo.create_or_coalesce(
+                job_id=job_id,
+                video_id=None,
+                task=TaskType.WATERMARK.value,
+                idempotency_key=request_key(TaskType.WATERMARK, video_id, {"asset": sha256}, idempotency_key),
+                meta={},
+                reuse_finished=bool(idempotency_key),
+            )
+            if created:
+                await AsyncBlobRepository(db).acquire(sha256, size)
+        if not created:
+            # The existing job holds its own reference on the asset
+            await AsyncBlobRepository(db).discard(sha256, size, filepath)
+            return {"job_id": job.id, "video_id": video_id, "coalesced": True}
 
         # 3. Enqueue Celery task
-        add_watermark_task.apply_async(args=[video_id, filepath, job_id], task_id=job_id)
+        await job_queue.send(
+            job_repo, job_id, add_watermark_task.apply_async, args=[video_id, filepath, job_id], task_id=job_id,
+            **route_for(TaskType.WATERMARK, video.duration if video else None),
+        )
 
         # 4. Return job_id immediately
         return {"job_id": job_id, "video_id": video_id}
 
+    except HTTPException:
+        raise
+    except storage.EmptyUploadError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    except storage.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
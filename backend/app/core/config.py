@@ -17,10 +17,81 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = "Video Processing API"
     DEBUG: bool = True
     DATABASE_URL: str = os.getenv("DATABASE_URL", "postgresql+asyncpg://postgres:postgres@db:5432/video_db")
+    # API connection pool (async engine), per process. Keep
+    # pods * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below Postgres max_connections.
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", 20))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", 10))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", 1800))
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://redis:6379/0")
     STORAGE_PATH: str = str(storage_path)
     CELERY_BROKER_URL: str = REDIS_URL
     CELERY_RESULT_BACKEND: str = REDIS_URL
+    # Streaming uploads: copy chunk size and hard cap on accepted bytes
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+    MAX_UPLOAD_SIZE: int = int(os.getenv("MAX_UPLOAD_SIZE", 10 * 1024 ** 3))
+    # Derived-output cache (trim/overlay/watermark/transcode results), LRU-evicted above this size
+    OUTPUT_CACHE_ENABLED: bool = os.getenv("OUTPUT_CACHE_ENABLED", "true").lower() == "true"
+    OUTPUT_CACHE_MAX_BYTES: int = int(os.getenv("OUTPUT_CACHE_MAX_BYTES", 50 * 1024 ** 3))
+    # Trim strategy: "smart" (copy middle GOPs, re-encode boundaries), "accurate" (re-encode) or "copy"
+    TRIM_MODE: str = os.getenv("TRIM_MODE", "smart")
+    # Segment-parallel encoding: sources at least this long are split at keyframes
+    # into ~SEGMENT_DURATION second pieces encoded as parallel Celery subtasks
+    SEGMENT_PARALLEL_MIN_DURATION: float = float(os.getenv("SEGMENT_PARALLEL_MIN_DURATION", 600))
+    SEGMENT_DURATION: float = float(os.getenv("SEGMENT_DURATION", 120))
+    # Child processes (ffmpeg/ffprobe): stderr lines kept for error reports and
+    # wall-clock / CPU-seconds limits (0 = unlimited)
+    PROCESS_STDERR_TAIL_LINES: int = int(os.getenv("PROCESS_STDERR_TAIL_LINES", 200))
+    FFMPEG_TIMEOUT: float = float(os.getenv("FFMPEG_TIMEOUT", 0))
+    FFMPEG_CPU_TIMEOUT: int = int(os.getenv("FFMPEG_CPU_TIMEOUT", 0))
+    # Thread-pool workers: cores shared by the concurrent ffmpeg runs of one worker
+    # process (0 = all CPUs), and -threads of an ffmpeg run when the task does not
+    # declare its own (Celery task option ffmpeg_threads)
+    WORKER_CORE_BUDGET: int = int(os.getenv("WORKER_CORE_BUDGET", 0))
+    FFMPEG_THREADS: int = int(os.getenv("FFMPEG_THREADS", 2))
+    FFMPEG_THREADS_HEAVY: int = int(os.getenv("FFMPEG_THREADS_HEAVY", 4))
+    # Minimum seconds between progress updates published by a running ffmpeg
+    PROGRESS_INTERVAL: float = float(os.getenv("PROGRESS_INTERVAL", 1.0))
+    # Adaptive streaming packages (HLS + DASH): target segment length in seconds,
+    # which is also the forced keyframe interval shared by every rendition, and
+    # the HLS segment container ("fmp4" or "mpegts"; DASH is always fMP4)
+    PACKAGE_SEGMENT_DURATION: float = float(os.getenv("PACKAGE_SEGMENT_DURATION", 4))
+    PACKAGE_HLS_SEGMENT_TYPE: str = os.getenv("PACKAGE_HLS_SEGMENT_TYPE", "fmp4")
+    # Layout of finished MP4 outputs: "faststart" (moov before mdat, for
+    # progressive download), "fragmented" (fMP4) or "off"
+    MP4_FINALIZE: str = os.getenv("MP4_FINALIZE", "faststart")
+    # When set (e.g. "/protected"), file downloads are handed to nginx via
+    # X-Accel-Redirect under this internal location instead of streamed by the app
+    SENDFILE_ACCEL_PREFIX: str = os.getenv("SENDFILE_ACCEL_PREFIX", "")
+    # Worker runs hold a lease on their job, renewed every JOB_LEASE_SECONDS / 3;
+    # a redelivered task only takes over a RUNNING job once the lease expired.
+    # Keep it well below the broker's visibility timeout.
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", 300))
+    # Write-through job status cache in Redis (REDIS_URL): entry TTL of finished
+    # jobs, of in-flight jobs, and the socket timeout after which Redis is skipped
+    JOB_CACHE_ENABLED: bool = os.getenv("JOB_CACHE_ENABLED", "true").lower() == "true"
+    JOB_CACHE_TERMINAL_TTL: int = int(os.getenv("JOB_CACHE_TERMINAL_TTL", 600))
+    JOB_CACHE_TTL: int = int(os.getenv("JOB_CACHE_TTL", 24 * 3600))
+    JOB_CACHE_TIMEOUT: float = float(os.getenv("JOB_CACHE_TIMEOUT", 0.5))
+    # Jobs estimated to run at most this many seconds go to the fast queue
+    # (see app.tasks.routing)
+    FAST_QUEUE_MAX_SECONDS: float = float(os.getenv("FAST_QUEUE_MAX_SECONDS", 60))
+    # Finished (SUCCESS/FAILED) jobs older than this many days are moved to
+    # jobs_archive by the periodic cleanup task, in batches of JOB_ARCHIVE_BATCH_SIZE
+    JOB_RETENTION_DAYS: float = float(os.getenv("JOB_RETENTION_DAYS", 30))
+    JOB_ARCHIVE_BATCH_SIZE: int = int(os.getenv("JOB_ARCHIVE_BATCH_SIZE", 5000))
+    JOB_CLEANUP_INTERVAL: float = float(os.getenv("JOB_CLEANUP_INTERVAL", 3600))
+    # Thumbnails: frames grabbed at evenly spaced points of a video, scaled to this width
+    THUMBNAIL_COUNT: int = int(os.getenv("THUMBNAIL_COUNT", 5))
+    THUMBNAIL_WIDTH: int = int(os.getenv("THUMBNAIL_WIDTH", 320))
+    # Upload pipelines: seconds between checks of a step that outlives its
+    # Celery task (segment-parallel encodes finish in their own chord)
+    PIPELINE_POLL_INTERVAL: float = float(os.getenv("PIPELINE_POLL_INTERVAL", 10))
+    # Seconds after which a pipeline still waiting on a step is failed,
+    # together with the steps still in flight
+    PIPELINE_TIMEOUT: float = float(os.getenv("PIPELINE_TIMEOUT", 6 * 3600))
+    # Max renditions encoded concurrently from a single decode of the source
+    TRANSCODE_MAX_PARALLEL_ENCODERS: int = int(os.getenv("TRANSCODE_MAX_PARALLEL_ENCODERS", 3))
     class Config:
         env_file = ".env"
 
@@ -1,4 +1,6 @@
 from .video import Video, VideoVersion, OverlayConfig
-from .job import Job
+from .job import Job, JobArchive
+from .blob import Blob
+from .derived_output import DerivedOutput
 
-__all__ = ["Video", "VideoVersion", "OverlayConfig", "Job"]
+__all__ = ["Video", "VideoVersion", "OverlayConfig", "Job", "JobArchive", "Blob", "DerivedOutput"]
@@ -0,0 +1,13 @@
+#app/db/models/blob.py
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class Blob(Base):
+    """Content-addressed file in STORAGE_PATH/blobs, shared by every path materialized from it."""
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,21 @@
+#app/db/models/derived_output.py
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, JSON
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class DerivedOutput(Base):
+    """
+    Index of cached ffmpeg outputs, keyed by sha256(source hash, operation,
+    normalized params). Files live in STORAGE_PATH/cache.
+    """
+    __tablename__ = "derived_outputs"
+    cache_key = Column(String(64), primary_key=True)
+    source_hash = Column(String(64), index=True, nullable=False)
+    operation = Column(String, nullable=False)
+    params = Column(JSON, nullable=False)
+    filepath = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_accessed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -1,11 +1,16 @@
 #app/db/models/job.py
-from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, JSON, Enum 
+from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, JSON, Enum, Index, event, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.base import Base
 from app.enums.task_type import TaskType
 from app.enums.job_status import JobStatus
 
+# Predicate of the partial unique index on idempotency_key. Spelled out as
+# SQL so ON CONFLICT inference (JobRepository.create_or_coalesce) can match
+# it against the index textually; keep it identical to the migration.
+ACTIVE_KEY_PREDICATE = "status IN ('PENDING', 'RUNNING')"
+
 class Job(Base):
     __tablename__ = "jobs"
     id = Column(String, primary_key=True)
@@ -14,5 +19,52 @@ class Job(Base):
     status = Column(Enum(JobStatus), default=JobStatus.PENDING)
     meta = Column(JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Fingerprint of the request (or the client's Idempotency-Key): at most
+    # one PENDING/RUNNING job per key, so identical requests share a job.
+    idempotency_key = Column(String, nullable=True)
+    # Lease of the worker run executing the job (see JobRepository.claim)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    # Bumped by every update of the row (see _bump_revision), so cached
+    # snapshots can be ordered (see app.services.job_cache)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
 
     video = relationship("Video", back_populates="jobs")
+
+    # Fetch created_at / revision with INSERT/UPDATE ... RETURNING, so a job
+    # can be cached (see app.services.job_cache) without a second query.
+    __mapper_args__ = {"eager_defaults": True}
+
+    __table_args__ = (
+        # Job listing by status / by video, newest first, and the archival
+        # sweep (terminal status, oldest created_at) are index range scans.
+        Index("ix_jobs_status_created_at", "status", "created_at"),
+        Index("ix_jobs_video_id_created_at", "video_id", "created_at"),
+        Index(
+            "ix_jobs_idempotency_key_active", "idempotency_key", unique=True,
+            postgresql_where=text(ACTIVE_KEY_PREDICATE),
+        ),
+        Index("ix_jobs_idempotency_key", "idempotency_key"),
+    )
+
+
+@event.listens_for(Job, "before_update")
+def _bump_revision(mapper, connection, target):
+    target.revision = Job.revision + 1
+
+
+class JobArchive(Base):
+    """
+    Finished jobs moved out of "jobs" after JOB_RETENTION_DAYS (see
+    JobRepository.archive_finished), so the hot table only holds recent
+    and in-flight work. No foreign key: archived rows outlive their videos.
+    """
+    __tablename__ = "jobs_archive"
+    id = Column(String, primary_key=True)
+    video_id = Column(Integer, nullable=True, index=True)
+    task = Column(Enum(TaskType), nullable=False)
+    status = Column(Enum(JobStatus), nullable=False)
+    meta = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
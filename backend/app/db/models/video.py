@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Enum, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import BigInteger, Column, Enum, Float, Index, Integer, String, DateTime, ForeignKey, JSON
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.base import Base
@@ -7,12 +7,35 @@ from app.enums.video_quality import VideoQuality
 
 class Video(Base):
     __tablename__ = "videos"
+    __table_args__ = (
+        # Keyset pagination of the listing on (upload_time, id), newest first
+        # (scanned backwards). INCLUDE carries the rest of the listing
+        # projection (VideoRepository LIST_COLUMNS) so pages are index-only scans.
+        Index(
+            "ix_videos_upload_time_id", "upload_time", "id",
+            postgresql_include=["filename", "duration", "size", "width", "height", "fps", "video_codec", "audio_codec"],
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)
     filepath = Column(String, nullable=False)
     size = Column(Integer)
-    duration = Column(Integer)
-    upload_time = Column(DateTime(timezone=True), server_default=func.now())
+    duration = Column(Float)
+    # Probe metadata (see app.services.probe), filled when the file is registered
+    width = Column(Integer)
+    height = Column(Integer)
+    fps = Column(Float)
+    video_codec = Column(String)
+    audio_codec = Column(String)
+    bitrate = Column(BigInteger)
+    keyframe_interval = Column(Float)
+    probe_info = Column(JSON)  # raw ffprobe streams/format
+    keyframes = Column(JSON)  # sorted keyframe pts (seconds), drives smart trimming
+    content_hash = Column(String(64), index=True, nullable=True)  # sha256 of the file at filepath
+    mp4_layout = Column(String, nullable=True)  # "faststart" / "fragmented" / "moov_at_end", see finalize_mp4
+    hls_path = Column(String, nullable=True)  # master.m3u8 of the latest adaptive package
+    dash_path = Column(String, nullable=True)  # manifest.mpd of the latest adaptive package
+    upload_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
     versions = relationship("VideoVersion", back_populates="original",cascade="all, delete-orphan")
     jobs = relationship("Job", back_populates="video",cascade="all, delete-orphan")
@@ -20,7 +43,7 @@ class Video(Base):
     # watermark = relationship("Watermark", uselist=False, back_populates="video")
 
     # === Self-referencing relationship for trimmed videos ===
-    trimmed_from_id = Column(Integer, ForeignKey("videos.id"), nullable=True)
+    trimmed_from_id = Column(Integer, ForeignKey("videos.id"), nullable=True, index=True)
     trimmed_videos = relationship(
         "Video",
         backref="original_video",
@@ -33,10 +56,12 @@ class Video(Base):
 class VideoVersion(Base):
     __tablename__ = "video_versions"
     id = Column(Integer, primary_key=True)
-    video_id = Column(Integer, ForeignKey("videos.id",ondelete="CASCADE"))
+    video_id = Column(Integer, ForeignKey("videos.id",ondelete="CASCADE"), index=True)
     quality = Column(Enum(VideoQuality, values_callable=lambda obj: [e.value for e in obj]))  # e.g., 1080p, 720p
     filepath = Column(String, nullable=False)
     size = Column(Integer)
+    mtime = Column(Float)  # file mtime when registered; with size, drives ETag/Last-Modified
+    mp4_layout = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     original = relationship("Video", back_populates="versions")
@@ -48,6 +73,7 @@ class OverlayConfig(Base):
     video_id = Column(Integer, ForeignKey("videos.id",ondelete="CASCADE"))
     kind = Column(Enum(OverlayKind), nullable=False)  # text/image/video
     params = Column(JSON)  # position, start, end, text, font, etc.
+    asset_path = Column(String, nullable=True)  # image/video asset for IMAGE/VIDEO overlays
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     video = relationship("Video", back_populates="overlays")
@@ -1,5 +1,6 @@
 from .task_type import TaskType
 from .job_status import JobStatus
 from .overlay_kind import OverlayKind
+from .pipeline_step import PipelineStep
 
-__all__ = ["TaskType", "JobStatus","OverlayKind"]
+__all__ = ["TaskType", "JobStatus","OverlayKind", "PipelineStep"]
@@ -0,0 +1,7 @@
+from enum import Enum
+
+class PipelineStep(str, Enum):
+    PROBE = "PROBE" # The upload itself (ffprobe + keyframe index); always the first step
+    WATERMARK = "WATERMARK"
+    RENDITIONS = "RENDITIONS"
+    THUMBNAILS = "THUMBNAILS"
@@ -3,8 +3,12 @@ from enum import Enum
 class TaskType(str, Enum):
     UPLOAD = "UPLOAD"
     TRIM = "TRIM"
+    BATCH_TRIM = "BATCH_TRIM" # Many clips cut from one source in a single pass
     TRANSCODE = "TRANSCODE" # Task to change video format or resolution
     TEXT_OVERLAY = "TEXT_OVERLAY"
     IMAGE_OVERLAY = "IMAGE_OVERLAY"
     VIDEO_OVERLAY = "VIDEO_OVERLAY"
+    COMPOSITE_OVERLAY = "COMPOSITE_OVERLAY" # Several overlays rendered in one encode
     WATERMARK = "WATERMARK"
+    THUMBNAILS = "THUMBNAILS"
+    PIPELINE = "PIPELINE" # Parent job of an upload's post-processing steps
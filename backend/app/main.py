@@ -2,7 +2,7 @@
 from fastapi import FastAPI
 from app.api.v1.router import router as v1_router
 from app.db import base
-from app.db.session import engine  # synchronous engine
+from app.db.session import async_engine, engine  # sync engine for DDL, async engine for requests
 from app.core.config import settings
 from app.log import logger
 
@@ -13,4 +13,9 @@ logger.info("Tables created successfully.")
 
 # 2️⃣ Create FastAPI app normally
 app = FastAPI(title=settings.PROJECT_NAME, debug=settings.DEBUG)
-app.include_router(v1_router, prefix="/api/v1")  
\ No newline at end of file
+app.include_router(v1_router, prefix="/api/v1")  
+
+
+@app.on_event("shutdown")
+async def dispose_db_pool():
+    await async_engine.dispose()
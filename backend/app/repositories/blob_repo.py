@@ -0,0 +1,124 @@
+# app/repositories/blob_repo.py
+import os
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import update, delete
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.models import Blob
+from app.services import storage
+from app.db.session import async_commit_or_flush, commit_or_flush
+from app.log import logger
+
+
+def _acquire_stmt(sha256: str, size: int):
+    # Single upsert so concurrent uploads of the same content don't race.
+    return (
+        insert(Blob)
+        .values(sha256=sha256, size=size, refcount=1)
+        .on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={"refcount": Blob.refcount + 1},
+        )
+        .returning(Blob.refcount)
+    )
+
+
+def _release_stmt(sha256: str):
+    return (
+        update(Blob)
+        .where(Blob.sha256 == sha256)
+        .values(refcount=Blob.refcount - 1)
+        .returning(Blob.refcount)
+    )
+
+
+def _delete_unreferenced_stmt(sha256: str):
+    return delete(Blob).where(Blob.sha256 == sha256, Blob.refcount <= 0)
+
+
+class BlobRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def acquire(self, sha256: str, size: int) -> int:
+        """
+        Take a reference on a blob, creating its row on first use.
+        Returns the new refcount.
+        """
+        try:
+            refcount = self.db.execute(_acquire_stmt(sha256, size)).scalar_one()
+            commit_or_flush(self.db)
+            return refcount
+        except SQLAlchemyError:
+            logger.error(f"Error acquiring blob {sha256}", exc_info=True)
+            self.db.rollback()
+            raise
+
+    def release(self, sha256: str) -> Optional[int]:
+        """
+        Drop a reference; the row and the blob file are deleted when the
+        last reference goes away. Returns the remaining refcount.
+        """
+        try:
+            refcount = self.db.execute(_release_stmt(sha256)).scalar_one_or_none()
+            if refcount is not None and refcount <= 0:
+                self.db.execute(_delete_unreferenced_stmt(sha256))
+            commit_or_flush(self.db)
+        except SQLAlchemyError:
+            logger.error(f"Error releasing blob {sha256}", exc_info=True)
+            self.db.rollback()
+            raise
+
+        if refcount is not None and refcount <= 0:
+            storage.remove_blob(sha256)
+        return refcount
+
+
+class AsyncBlobRepository:
+    """BlobRepository for the API's AsyncSession."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def acquire(self, sha256: str, size: int) -> int:
+        """Take a reference on a blob, creating its row on first use. Returns the new refcount."""
+        try:
+            refcount = (await self.db.execute(_acquire_stmt(sha256, size))).scalar_one()
+            await async_commit_or_flush(self.db)
+            return refcount
+        except SQLAlchemyError:
+            logger.error(f"Error acquiring blob {sha256}", exc_info=True)
+            await self.db.rollback()
+            raise
+
+    async def release(self, sha256: str) -> Optional[int]:
+        """See BlobRepository.release."""
+        try:
+            refcount = (await self.db.execute(_release_stmt(sha256))).scalar_one_or_none()
+            if refcount is not None and refcount <= 0:
+                await self.db.execute(_delete_unreferenced_stmt(sha256))
+            await async_commit_or_flush(self.db)
+        except SQLAlchemyError:
+            logger.error(f"Error releasing blob {sha256}", exc_info=True)
+            await self.db.rollback()
+            raise
+
+        if refcount is not None and refcount <= 0:
+            storage.remove_blob(sha256)
+        return refcount
+
+    async def discard(self, sha256: str, size: int, path: str):
+        """
+        Drop a freshly stored upload that is not kept (duplicate content, or a
+        request coalesced onto an existing job): its materialized path is
+        removed and a reference is taken and released, so the blob goes away
+        with its row unless something else references it.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        await self.acquire(sha256, size)
+        await self.release(sha256)
@@ -0,0 +1,80 @@
+# app/repositories/derived_output_repo.py
+from typing import Optional, List, Dict, Any
+
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import select, func, delete
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.models import DerivedOutput
+from app.db.session import commit_or_flush
+from app.log import logger
+
+
+class DerivedOutputRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get(self, cache_key: str) -> Optional[DerivedOutput]:
+        try:
+            return self.db.get(DerivedOutput, cache_key)
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching cached output {cache_key}: {e}", exc_info=True)
+            return None
+
+    def touch(self, entry: DerivedOutput) -> None:
+        """Record a cache hit (bumps the entry to most-recently-used)."""
+        try:
+            entry.hits = (entry.hits or 0) + 1
+            entry.last_accessed_at = func.now()
+            commit_or_flush(self.db)
+        except SQLAlchemyError:
+            self.db.rollback()
+            raise
+
+    def upsert(
+        self,
+        cache_key: str,
+        source_hash: str,
+        operation: str,
+        params: Dict[str, Any],
+        filepath: str,
+        size: int,
+    ) -> None:
+        try:
+            stmt = insert(DerivedOutput).values(
+                cache_key=cache_key,
+                source_hash=source_hash,
+                operation=operation,
+                params=params,
+                filepath=filepath,
+                size=size,
+                hits=0,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DerivedOutput.cache_key],
+                set_={"filepath": filepath, "size": size, "last_accessed_at": func.now()},
+            )
+            self.db.execute(stmt)
+            commit_or_flush(self.db)
+        except SQLAlchemyError:
+            logger.error(f"Error storing cached output {cache_key}", exc_info=True)
+            self.db.rollback()
+            raise
+
+    def total_size(self) -> int:
+        return self.db.execute(select(func.coalesce(func.sum(DerivedOutput.size), 0))).scalar_one()
+
+    def least_recently_used(self, limit: int = 100) -> List[DerivedOutput]:
+        res = self.db.execute(
+            select(DerivedOutput).order_by(DerivedOutput.last_accessed_at.asc()).limit(limit)
+        )
+        return res.scalars().all()
+
+    def delete(self, cache_key: str) -> None:
+        try:
+            self.db.execute(delete(DerivedOutput).where(DerivedOutput.cache_key == cache_key))
+            commit_or_flush(self.db)
+        except SQLAlchemyError:
+            self.db.rollback()
+            raise
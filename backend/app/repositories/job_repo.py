@@ -1,13 +1,75 @@
 # app/repositories/job_repo.py
-from typing import Optional, Dict, Any
+import hashlib
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import and_, delete, func, insert, or_, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import json
 
-from app.db.models import Job
+from app.db.models import Job, JobArchive
+from app.db.models.job import ACTIVE_KEY_PREDICATE
+from app.db.session import async_commit_or_flush, commit_or_flush
+from app.enums.job_status import JobStatus
+from app.services import job_cache
+from app.services.output_cache import normalize_params
+from app.repositories.pagination import decode_cursor, encode_cursor
 from app.log import logger
 
 
+TERMINAL_STATUSES = (JobStatus.SUCCESS, JobStatus.FAILED)
+ACTIVE_STATUSES = (JobStatus.PENDING, JobStatus.RUNNING)
+
+# Columns returned by the job listing (no meta blobs)
+LIST_COLUMNS = (Job.id, Job.video_id, Job.task, Job.status, Job.created_at)
+
+
+def _merge_meta(existing, meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Shallow-merge meta into a job's existing meta (which may be a JSON string)."""
+    existing = existing or {}
+    if isinstance(existing, str):
+        try:
+            existing = json.loads(existing)
+        except Exception:
+            existing = {}
+    return {**existing, **meta}
+
+
+def request_key(task: str, video_id: Optional[int], params: Dict[str, Any], client_key: Optional[str] = None) -> str:
+    """
+    Idempotency key of a job request: the client's Idempotency-Key when
+    given, else a fingerprint of the task, video and normalized params, so
+    identical requests map to the same key.
+    """
+    task = getattr(task, "value", task)
+    if client_key:
+        raw = json.dumps(["client", task, client_key])
+    else:
+        raw = json.dumps([task, video_id, normalize_params(params)], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _claimable(now):
+    """PENDING, or RUNNING without a live lease (its worker died or never took it)."""
+    return or_(
+        Job.status == JobStatus.PENDING,
+        and_(Job.status == JobStatus.RUNNING, or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < now)),
+    )
+
+
+def _upload_part_mutation(part_number: int, size: int) -> Callable[[Dict[str, Any]], None]:
+    def mutate(meta):
+        parts = dict(meta.get("parts", {}))
+        parts[str(part_number)] = size
+        received = sum(parts.values())
+        meta["parts"] = parts
+        meta["received_bytes"] = received
+        meta["progress"] = round(received / meta["total_size"], 4) if meta.get("total_size") else 0.0
+    return mutate
+
+
 class JobRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -33,8 +95,9 @@ class JobRepository:
                 meta=meta or {}
             )
             self.db.add(job)
-            self.db.commit()
-            self.db.refresh(job)
+            self.db.flush()
+            job_cache.stage(self.db, job)
+            commit_or_flush(self.db)
             return job
         except SQLAlchemyError:
             self.db.rollback()
@@ -48,9 +111,11 @@ class JobRepository:
         job_id: str,
         status: str,
         meta: Optional[Dict[str, Any]] = None,
+        video_id: Optional[int] = None,
     ) -> Optional[Job]:
         """
-        Update status/meta for a job. Returns updated job or None if not found.
+        Update status/meta (and, when given, the linked video) for a job.
+        Returns updated job or None if not found.
         """
         job = self.db.get(Job, job_id)
         if not job:
@@ -59,17 +124,13 @@ class JobRepository:
         try:
             job.status = status
             if meta is not None:
-                # Merge meta dictionaries (shallow merge)
-                existing = job.meta or {}
-                if isinstance(existing, str):
-                    try:
-                        existing = json.loads(existing)
-                    except Exception:
-                        existing = {}
-                job.meta = {**existing, **meta}
-
-            self.db.commit()
-            self.db.refresh(job)
+                job.meta = _merge_meta(job.meta, meta)
+            if video_id is not None:
+                job.video_id = video_id
+
+            self.db.flush()
+            job_cache.stage(self.db, job)
+            commit_or_flush(self.db)
             return job
         except SQLAlchemyError:
             self.db.rollback()
@@ -78,6 +139,68 @@ class JobRepository:
             self.db.rollback()
             raise
 
+    def _update_meta_locked(self, job_id: str, mutate: Callable[[Dict[str, Any]], None],
+                            status: Optional[str] = None) -> Optional[Job]:
+        """
+        Apply mutate() to a copy of the job's meta while holding a row lock
+        (SELECT ... FOR UPDATE), so concurrent writers (parallel upload
+        parts, segment subtasks) don't lose each other's updates. With
+        status, nothing is changed (and None returned) unless the job is
+        still in that status under the lock.
+        """
+        try:
+            job = self.db.execute(
+                select(Job).where(Job.id == job_id).with_for_update()
+            ).scalars().first()
+            if not job or (status is not None and job.status != status):
+                return None
+
+            meta = dict(job.meta or {})
+            mutate(meta)
+            job.meta = meta
+
+            self.db.flush()
+            job_cache.stage(self.db, job)
+            commit_or_flush(self.db)
+            return job
+        except SQLAlchemyError:
+            self.db.rollback()
+            raise
+
+    def record_upload_part(self, job_id: str, part_number: int, size: int) -> Optional[Job]:
+        """
+        Mark a multi-part upload part as received and refresh progress.
+        Returns None, recording nothing, once the upload left PENDING.
+        """
+        return self._update_meta_locked(job_id, _upload_part_mutation(part_number, size), status=JobStatus.PENDING)
+
+    def record_segment(self, job_id: str, index: int, status: str, **info) -> Optional[Job]:
+        """Update one entry of meta["segments"] for a segment-parallel job and refresh progress."""
+        def mutate(meta):
+            segments = [dict(seg) for seg in meta.get("segments", [])]
+            segments[index].update(status=status, **info)
+            meta["segments"] = segments
+            done = sum(seg["status"] == "SUCCESS" for seg in segments)
+            meta["progress"] = round(done / len(segments), 4) if segments else 0.0
+
+        return self._update_meta_locked(job_id, mutate)
+
+    def record_dispatch(self, job_id: str, steps: List[str]) -> List[str]:
+        """
+        Add steps to meta["dispatched"] of a pipeline job and return the ones
+        not dispatched before, so a redelivered pipeline task never sends a
+        step twice.
+        """
+        sent = []
+
+        def mutate(meta):
+            dispatched = list(meta.get("dispatched", []))
+            sent.extend(step for step in steps if step not in dispatched)
+            meta["dispatched"] = dispatched + sent
+
+        self._update_meta_locked(job_id, mutate)
+        return sent
+
     def find(self, job_id: str) -> Optional[Job]:
         """
         Fetch a job by ID.
@@ -87,3 +210,296 @@ class JobRepository:
         except SQLAlchemyError:
             logger.error(f"Error fetching job {job_id}", exc_info=True)
             return None
+
+    def claim(self, job_id: str, owner: str, lease_seconds: float) -> Optional[Job]:
+        """
+        Atomically move a claimable job (see _claimable) to RUNNING under a
+        lease held by owner, in one conditional UPDATE ... RETURNING.
+        Returns None when the job is finished or leased by another live run,
+        e.g. a task redelivered after a worker crash or a deploy.
+        """
+        now = func.now()
+        stmt = (
+            update(Job)
+            .where(Job.id == job_id, _claimable(now))
+            .values(
+                status=JobStatus.RUNNING,
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=Job.attempts + 1,
+                revision=Job.revision + 1,
+            )
+            .returning(Job)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        try:
+            job = self.db.scalars(stmt).first()
+            if job:
+                job_cache.stage(self.db, job)
+            commit_or_flush(self.db)
+            return job
+        except SQLAlchemyError:
+            self.db.rollback()
+            raise
+
+    def renew_lease(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Extend owner's lease on a RUNNING job. False if the lease was lost."""
+        stmt = (
+            update(Job)
+            .where(Job.id == job_id, Job.status == JobStatus.RUNNING, Job.lease_owner == owner)
+            .values(lease_expires_at=func.now() + timedelta(seconds=lease_seconds))
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            renewed = self.db.execute(stmt).rowcount > 0
+            commit_or_flush(self.db)
+            return renewed
+        except SQLAlchemyError:
+            self.db.rollback()
+            raise
+
+    def archive_finished(self, older_than: datetime, batch_size: int) -> int:
+        """
+        Move up to batch_size SUCCESS/FAILED jobs created before older_than
+        into jobs_archive, oldest first, in one statement
+        (WITH moved AS (DELETE ... RETURNING) INSERT ... SELECT FROM moved).
+        Rows locked by a concurrent writer are skipped. Returns rows moved.
+        """
+        candidates = (
+            select(Job.id)
+            .where(Job.status.in_(TERMINAL_STATUSES), Job.created_at < older_than)
+            .order_by(Job.created_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        moved = (
+            delete(Job)
+            .where(Job.id.in_(candidates.scalar_subquery()))
+            .returning(Job.id, Job.video_id, Job.task, Job.status, Job.meta, Job.created_at)
+            .cte("moved")
+        )
+        stmt = insert(JobArchive).from_select(
+            ["id", "video_id", "task", "status", "meta", "created_at"],
+            select(moved.c.id, moved.c.video_id, moved.c.task, moved.c.status, moved.c.meta, moved.c.created_at),
+        )
+        try:
+            count = self.db.execute(stmt).rowcount
+            commit_or_flush(self.db)
+            return count
+        except SQLAlchemyError:
+            self.db.rollback()
+            raise
+
+
+class AsyncJobRepository:
+    """JobRepository for the API's AsyncSession (see app.db.session.get_async_db)."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def create(
+        self,
+        job_id: str,
+        video_id: Optional[int],
+        task: str,
+        status: str = "PENDING",
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> Job:
+        """
+        Create a Job row (maps to Celery task id).
+        """
+        try:
+            logger.info(f"Creating job record: {job_id} for task: {task}")
+            job = Job(
+                id=job_id,
+                video_id=video_id,
+                task=task,
+                status=status,
+                meta=meta or {}
+            )
+            self.db.add(job)
+            await self.db.flush()
+            job_cache.stage(self.db, job)
+            await async_commit_or_flush(self.db)
+            return job
+        except Exception:
+            await self.db.rollback()
+            raise
+
+    async def update_status(
+        self,
+        job_id: str,
+        status: str,
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> Optional[Job]:
+        """
+        Update status/meta for a job. Returns updated job or None if not found.
+        """
+        job = await self.db.get(Job, job_id)
+        if not job:
+            return None
+
+        try:
+            job.status = status
+            if meta is not None:
+                job.meta = _merge_meta(job.meta, meta)
+
+            await self.db.flush()
+            job_cache.stage(self.db, job)
+            await async_commit_or_flush(self.db)
+            return job
+        except Exception:
+            await self.db.rollback()
+            raise
+
+    async def create_or_coalesce(
+        self,
+        job_id: str,
+        video_id: Optional[int],
+        task: str,
+        idempotency_key: str,
+        meta: Optional[Dict[str, Any]] = None,
+        reuse_finished: bool = False,
+    ) -> Tuple[Job, bool]:
+        """
+        Create a PENDING job unless one with the same idempotency key is
+        already PENDING/RUNNING, in which case that job is returned instead
+        (INSERT ... ON CONFLICT DO NOTHING on ix_jobs_idempotency_key_active,
+        so concurrent identical requests cannot both insert). With
+        reuse_finished (client-supplied keys) a finished job with the key is
+        returned too. Returns (job, created).
+        """
+        if reuse_finished:
+            existing = (await self.db.execute(
+                select(Job).where(Job.idempotency_key == idempotency_key).order_by(Job.created_at.desc()).limit(1)
+            )).scalars().first()
+            if existing:
+                return existing, False
+
+        insert_stmt = (
+            pg_insert(Job)
+            .values(
+                id=job_id,
+                video_id=video_id,
+                task=task,
+                status=JobStatus.PENDING,
+                meta=meta or {},
+                idempotency_key=idempotency_key,
+            )
+            .on_conflict_do_nothing(
+                index_elements=[Job.idempotency_key],
+                index_where=text(ACTIVE_KEY_PREDICATE),
+            )
+            .returning(Job.id)
+        )
+        active = select(Job).where(Job.idempotency_key == idempotency_key, Job.status.in_(ACTIVE_STATUSES))
+        try:
+            # The conflicting job may finish between the two statements; then insert again.
+            for _ in range(3):
+                if (await self.db.execute(insert_stmt)).scalar() is not None:
+                    job = await self.db.get(Job, job_id)
+                    job_cache.stage(self.db, job)
+                    await async_commit_or_flush(self.db)
+                    logger.info(f"Created job {job_id} for task {task}")
+                    return job, True
+                existing = (await self.db.execute(active)).scalars().first()
+                if existing:
+                    logger.info(f"Coalesced {task} request into in-flight job {existing.id}")
+                    return existing, False
+            raise RuntimeError(f"Could not create or find a job for key {idempotency_key}")
+        except Exception:
+            await self.db.rollback()
+            raise
+
+    async def _update_meta_locked(self, job_id: str, mutate: Callable[[Dict[str, Any]], None],
+                                  status: Optional[str] = None) -> Optional[Job]:
+        """See JobRepository._update_meta_locked."""
+        try:
+            job = (await self.db.execute(
+                select(Job).where(Job.id == job_id).with_for_update()
+            )).scalars().first()
+            if not job or (status is not None and job.status != status):
+                return None
+
+            meta = dict(job.meta or {})
+            mutate(meta)
+            job.meta = meta
+
+            await self.db.flush()
+            job_cache.stage(self.db, job)
+            await async_commit_or_flush(self.db)
+            return job
+        except SQLAlchemyError:
+            await self.db.rollback()
+            raise
+
+    async def record_upload_part(self, job_id: str, part_number: int, size: int) -> Optional[Job]:
+        """See JobRepository.record_upload_part."""
+        return await self._update_meta_locked(job_id, _upload_part_mutation(part_number, size), status=JobStatus.PENDING)
+
+    async def transition(self, job_id: str, from_status: str, to_status: str) -> Optional[Job]:
+        """
+        Move a job from from_status to to_status in one conditional
+        UPDATE ... RETURNING. Returns None when the job is not in
+        from_status, e.g. a concurrent request already moved it.
+        """
+        stmt = (
+            update(Job)
+            .where(Job.id == job_id, Job.status == from_status)
+            .values(status=to_status, revision=Job.revision + 1)
+            .returning(Job)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        try:
+            job = (await self.db.scalars(stmt)).first()
+            if job:
+                job_cache.stage(self.db, job)
+            await async_commit_or_flush(self.db)
+            return job
+        except SQLAlchemyError:
+            await self.db.rollback()
+            raise
+
+    async def find(self, job_id: str) -> Optional[Job]:
+        """
+        Fetch a job by ID.
+        """
+        try:
+            return await self.db.get(Job, job_id)
+        except SQLAlchemyError:
+            logger.error(f"Error fetching job {job_id}", exc_info=True)
+            return None
+
+    async def list_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        status: Optional[JobStatus] = None,
+        video_id: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        One page of jobs, newest first, as LIST_COLUMNS rows. Keyset
+        pagination on (created_at, id); filtering by status or video_id reads
+        ix_jobs_status_created_at / ix_jobs_video_id_created_at in order.
+        Returns the rows and the cursor of the next page (None on the last).
+        """
+        stmt = select(*LIST_COLUMNS)
+        if cursor:
+            after_time, after_id = decode_cursor(cursor, str)
+            stmt = stmt.where(tuple_(Job.created_at, Job.id) < tuple_(after_time, after_id))
+        if status is not None:
+            stmt = stmt.where(Job.status == status)
+        if video_id is not None:
+            stmt = stmt.where(Job.video_id == video_id)
+        stmt = stmt.order_by(Job.created_at.desc(), Job.id.desc()).limit(limit + 1)
+
+        try:
+            rows = [dict(r) for r in (await self.db.execute(stmt)).mappings().all()]
+        except SQLAlchemyError:
+            logger.error("Error listing jobs", exc_info=True)
+            return [], None
+
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
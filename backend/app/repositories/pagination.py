@@ -0,0 +1,25 @@
+# app/repositories/pagination.py
+"""Opaque keyset cursors shared by the listing endpoints (videos, jobs)."""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Tuple
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: datetime, key: Any) -> str:
+    """Opaque keyset cursor pointing just past the (timestamp, key) of a row."""
+    raw = json.dumps([timestamp.isoformat(), key]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, key_type: type = int) -> Tuple[datetime, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, key = json.loads(raw)
+        return datetime.fromisoformat(timestamp), key_type(key)
+    except (ValueError, TypeError):
+        raise InvalidCursorError(f"Invalid cursor: {cursor!r}")
@@ -1,15 +1,110 @@
 # app/repositories/video_repo.py
 import os
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import select
+from sqlalchemy import exists, insert, literal, select, tuple_
 from app.db.models.video import Video, VideoVersion
+from app.db.session import commit_or_flush
+from app.repositories.pagination import decode_cursor, encode_cursor
 from app.log import logger
 
 
+# Columns returned by the video listing: plain rows, no ORM objects or JSON
+# blobs. Keep in sync with the INCLUDE list of ix_videos_upload_time_id.
+LIST_COLUMNS = (
+    Video.id, Video.filename, Video.duration, Video.size, Video.width, Video.height,
+    Video.fps, Video.video_codec, Video.audio_codec, Video.upload_time,
+)
+
+
+# Guards the recursive CTE against a corrupt (cyclic) trimmed_from_id chain.
+MAX_LINEAGE_DEPTH = 64
+
+
+def lineage_stmt(video_id: int, from_root: bool = False):
+    """
+    One statement returning a video's whole derivation tree: the video, its
+    trims (and trims of trims, via trimmed_from_id) and every VideoVersion
+    encoding of each of them, one row per (video, version) with the video's
+    depth. With from_root the tree starts at the original the video was
+    ultimately derived from.
+    """
+    start = video_id
+    if from_root:
+        up = (
+            select(Video.id, Video.trimmed_from_id, literal(0).label("depth"))
+            .where(Video.id == video_id)
+            .cte("ancestors", recursive=True)
+        )
+        up = up.union_all(
+            select(Video.id, Video.trimmed_from_id, up.c.depth + 1)
+            .where(Video.id == up.c.trimmed_from_id, up.c.depth < MAX_LINEAGE_DEPTH)
+        )
+        start = select(up.c.id).where(up.c.trimmed_from_id.is_(None)).limit(1).scalar_subquery()
+
+    tree = (
+        select(Video.id, literal(0).label("depth"))
+        .where(Video.id == start)
+        .cte("lineage", recursive=True)
+    )
+    tree = tree.union_all(
+        select(Video.id, tree.c.depth + 1)
+        .where(Video.trimmed_from_id == tree.c.id, tree.c.depth < MAX_LINEAGE_DEPTH)
+    )
+    return (
+        select(
+            Video.id, Video.filename, Video.filepath, Video.duration, Video.size,
+            Video.trimmed_from_id, Video.upload_time, tree.c.depth,
+            VideoVersion.id.label("version_id"),
+            VideoVersion.quality,
+            VideoVersion.filepath.label("version_filepath"),
+            VideoVersion.size.label("version_size"),
+        )
+        .join(tree, tree.c.id == Video.id)
+        .outerjoin(VideoVersion, VideoVersion.video_id == Video.id)
+        .order_by(tree.c.depth, Video.id, VideoVersion.id)
+    )
+
+
+def build_lineage(rows) -> Optional[dict]:
+    """Assemble lineage_stmt rows into nested {..., versions, children} nodes; returns the root."""
+    nodes: dict = {}
+    root = None
+    for r in rows:
+        node = nodes.get(r["id"])
+        if node is None:
+            node = nodes[r["id"]] = {
+                "id": r["id"],
+                "filename": r["filename"],
+                "filepath": r["filepath"],
+                "duration": r["duration"],
+                "size": r["size"],
+                "upload_time": r["upload_time"],
+                "depth": r["depth"],
+                "versions": [],
+                "children": [],
+            }
+            # Rows come ordered by depth, so a parent is always seen first.
+            parent = nodes.get(r["trimmed_from_id"]) if r["depth"] else None
+            if parent is not None:
+                parent["children"].append(node)
+            elif root is None:
+                root = node
+        if r["version_id"] is not None:
+            quality = r["quality"]
+            node["versions"].append({
+                "id": r["version_id"],
+                "quality": getattr(quality, "value", quality),
+                "filepath": r["version_filepath"],
+                "size": r["version_size"],
+            })
+    return root
+
+
 class VideoRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -23,6 +118,20 @@ class VideoRepository:
             logger.error(f"Error fetching video {video_id}: {e}", exc_info=True)
             return None
     
+    def find_by_content_hash(self, content_hash: str) -> Optional[Video]:
+        """Fetch the oldest original (non-trimmed) video whose file has this sha256."""
+        try:
+            res = self.db.execute(
+                select(Video)
+                .where(Video.content_hash == content_hash, Video.trimmed_from_id.is_(None))
+                .order_by(Video.id)
+                .limit(1)
+            )
+            return res.scalars().first()
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching video by hash {content_hash}: {e}", exc_info=True)
+            return None
+
     # 1️⃣ Get encodings only (VideoVersion table)
     def get_video_versions(self, video_id: int) -> List[VideoVersion]:
         """Fetch only VideoVersion encodings for a video."""
@@ -54,44 +163,38 @@ class VideoRepository:
           - Original video
           - Its VideoVersion encodings
           - Its trimmed videos (recursively, with their encodings)
-        Returns a flat list of dicts for easy API use.
+        Returns a flat list of dicts for easy API use (depth-first order).
+        The whole tree comes from one recursive CTE query (see lineage_stmt).
         """
-        def collect(video: Video, collected: List[dict]):
-            if not video:
-                return
+        try:
+            rows = self.db.execute(lineage_stmt(video_id)).mappings().all()
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching all versions for video {video_id}: {e}", exc_info=True)
+            return []
+
+        collected: List[dict] = []
+
+        def collect(node: dict):
             collected.append({
                 "type": "video",
-                "id": video.id,
-                "filename": video.filename,
-                "filepath": video.filepath,
+                "id": node["id"],
+                "filename": node["filename"],
+                "filepath": node["filepath"],
             })
-            for v in video.versions:
+            for v in node["versions"]:
                 collected.append({
                     "type": "video_version",
-                    "id": v.id,
-                    "quality": v.quality,
-                    "filepath": v.filepath,
+                    "id": v["id"],
+                    "quality": v["quality"],
+                    "filepath": v["filepath"],
                 })
-            for trimmed in video.trimmed_videos:
-                collect(trimmed, collected)
+            for child in node["children"]:
+                collect(child)
 
-        try:
-            res = self.db.execute(
-                select(Video)
-                .options(
-                    joinedload(Video.versions),
-                    joinedload(Video.trimmed_videos).joinedload(Video.versions),
-                )
-                .where(Video.id == video_id)
-            )
-            video = res.scalars().first()
-
-            collected: List[dict] = []
-            collect(video, collected)
-            return collected
-        except SQLAlchemyError as e:
-            logger.error(f"Error fetching all versions for video {video_id}: {e}", exc_info=True)
-            return []
+        root = build_lineage(rows)
+        if root:
+            collect(root)
+        return collected
 
     def create(
         self,
@@ -99,7 +202,8 @@ class VideoRepository:
         filepath: str,
         size: Optional[int] = None,
         duration: Optional[float] = None,
-        trimmed_from_id: Optional[int] = None
+        trimmed_from_id: Optional[int] = None,
+        content_hash: Optional[str] = None
     ) -> Video:
         """Create a Video DB record and return it."""
         try:
@@ -110,11 +214,11 @@ class VideoRepository:
                 filepath=filepath,
                 size=size,
                 duration=duration,
-                trimmed_from_id=trimmed_from_id
+                trimmed_from_id=trimmed_from_id,
+                content_hash=content_hash
             )
             self.db.add(v)
-            self.db.commit()
-            self.db.refresh(v)
+            commit_or_flush(self.db)
             return v
         except SQLAlchemyError:
             logger.error("Error creating video record", exc_info=True)
@@ -124,6 +228,53 @@ class VideoRepository:
             logger.error("Unexpected error creating video record", exc_info=True)
             raise
 
+    def update_metadata(self, video: Video, info: dict) -> Video:
+        """Persist probe results (see app.services.probe) on a Video row."""
+        try:
+            video.size = info.get("size") or video.size
+            video.duration = info.get("duration")
+            video.width = info.get("width")
+            video.height = info.get("height")
+            video.fps = info.get("fps")
+            video.video_codec = info.get("video_codec")
+            video.audio_codec = info.get("audio_codec")
+            video.bitrate = info.get("bitrate")
+            video.keyframe_interval = info.get("keyframe_interval")
+            video.mp4_layout = info.get("mp4_layout")
+            video.probe_info = {"streams": info.get("streams", []), "format": info.get("format", {})}
+            commit_or_flush(self.db)
+            return video
+        except SQLAlchemyError:
+            logger.error(f"Error updating metadata for video {video.id}", exc_info=True)
+            self.db.rollback()
+            raise
+
+    def set_keyframes(self, video: Video, keyframes: List[float]) -> Video:
+        """Store the keyframe index and the exact GOP length derived from it."""
+        try:
+            video.keyframes = keyframes
+            gaps = sorted(b - a for a, b in zip(keyframes, keyframes[1:]) if b > a)
+            if gaps:
+                video.keyframe_interval = round(gaps[len(gaps) // 2], 3)
+            commit_or_flush(self.db)
+            return video
+        except SQLAlchemyError:
+            logger.error(f"Error storing keyframes for video {video.id}", exc_info=True)
+            self.db.rollback()
+            raise
+
+    def set_packages(self, video: Video, hls_path: str, dash_path: str) -> Video:
+        """Point the video at its latest adaptive (HLS/DASH) package."""
+        try:
+            video.hls_path = hls_path
+            video.dash_path = dash_path
+            commit_or_flush(self.db)
+            return video
+        except SQLAlchemyError:
+            logger.error(f"Error storing packages for video {video.id}", exc_info=True)
+            self.db.rollback()
+            raise
+
     def list(self, limit: int = 100, offset: int = 0) -> List[Video]:
         """List videos with pagination."""
         try:
@@ -135,28 +286,176 @@ class VideoRepository:
             logger.error("Error listing videos", exc_info=True)
             return []
 
+    def create_video_versions(self, video_id: int, versions: List[dict]) -> List[VideoVersion]:
+        """
+        Insert VideoVersion rows for many renditions in one INSERT ... RETURNING.
+        versions: dicts with quality, filepath and optionally mp4_layout.
+        """
+        rows = []
+        for v in versions:
+            st = os.stat(v["filepath"])
+            rows.append({
+                "video_id": video_id,
+                "quality": v["quality"],
+                "filepath": v["filepath"],
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "mp4_layout": v.get("mp4_layout"),
+            })
+        if not rows:
+            return []
+        try:
+            # Executemany with RETURNING ("insertmanyvalues"): SQLAlchemy 2.0+
+            created = self.db.scalars(insert(VideoVersion).returning(VideoVersion), rows).all()
+            commit_or_flush(self.db)
+            return created
+        except SQLAlchemyError:
+            logger.error(f"Error creating versions for video {video_id}", exc_info=True)
+            self.db.rollback()
+            raise
+
     def create_video_version(
         self,
         video_id: int,
         quality: str,
         filepath: str,
-        size: Optional[int] = None
+        size: Optional[int] = None,
+        mp4_layout: Optional[str] = None
     ) -> VideoVersion:
         """Insert a VideoVersion for a derived output (e.g., 1080p, 720p)."""
         try:
-            if size is None and os.path.exists(filepath):
-                size = os.path.getsize(filepath)
+            mtime = None
+            if os.path.exists(filepath):
+                st = os.stat(filepath)
+                size, mtime = st.st_size, st.st_mtime
             vv = VideoVersion(
                 video_id=video_id,
                 quality=quality,
                 filepath=filepath,
-                size=size
+                size=size,
+                mtime=mtime,
+                mp4_layout=mp4_layout
             )
             self.db.add(vv)
-            self.db.commit()
-            self.db.refresh(vv)
+            commit_or_flush(self.db)
             return vv
         except SQLAlchemyError:
             logger.error("Error creating video version", exc_info=True)
             self.db.rollback()
             raise
+
+
+class AsyncVideoRepository:
+    """Read side of VideoRepository for the API's AsyncSession; writes happen in the workers."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_video(self, video_id: int) -> Optional[Video]:
+        """Fetch a video by ID."""
+        try:
+            res = await self.db.execute(select(Video).where(Video.id == video_id))
+            return res.scalars().first()
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching video {video_id}: {e}", exc_info=True)
+            return None
+
+    async def find_by_content_hash(self, content_hash: str) -> Optional[Video]:
+        """Fetch the oldest original (non-trimmed) video whose file has this sha256."""
+        try:
+            res = await self.db.execute(
+                select(Video)
+                .where(Video.content_hash == content_hash, Video.trimmed_from_id.is_(None))
+                .order_by(Video.id)
+                .limit(1)
+            )
+            return res.scalars().first()
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching video by hash {content_hash}: {e}", exc_info=True)
+            return None
+
+    async def get_video_versions(self, video_id: int) -> List[VideoVersion]:
+        """Fetch only VideoVersion encodings for a video."""
+        try:
+            res = await self.db.execute(
+                select(VideoVersion).where(VideoVersion.video_id == video_id)
+            )
+            return res.scalars().all()
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching video versions for {video_id}: {e}", exc_info=True)
+            return []
+
+    async def get_lineage(self, video_id: int, from_root: bool = False) -> Optional[dict]:
+        """Derivation tree of a video (see lineage_stmt / build_lineage), in one query."""
+        try:
+            rows = (await self.db.execute(lineage_stmt(video_id, from_root))).mappings().all()
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching lineage of video {video_id}: {e}", exc_info=True)
+            return None
+        return build_lineage(rows)
+
+    async def get_version(self, video_id: int, quality: str) -> Optional[VideoVersion]:
+        """Newest VideoVersion of a video in the given quality."""
+        try:
+            res = await self.db.execute(
+                select(VideoVersion)
+                .where(VideoVersion.video_id == video_id, VideoVersion.quality == quality)
+                .order_by(VideoVersion.id.desc())
+                .limit(1)
+            )
+            return res.scalars().first()
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching {quality} version of video {video_id}: {e}", exc_info=True)
+            return None
+
+    async def get_version_by_id(self, version_id: int) -> Optional[VideoVersion]:
+        try:
+            return await self.db.get(VideoVersion, version_id)
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching video version {version_id}: {e}", exc_info=True)
+            return None
+
+    async def list_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        min_duration: Optional[float] = None,
+        max_duration: Optional[float] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        has_versions: Optional[bool] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        One page of the video listing, newest first, as LIST_COLUMNS rows.
+        Keyset pagination on (upload_time, id): every page is an index range
+        scan on ix_videos_upload_time_id however deep it is (upload_time is
+        NOT NULL, so no row falls outside the cursor comparison). Returns the rows
+        and the cursor of the next page (None on the last page).
+        """
+        stmt = select(*LIST_COLUMNS)
+        if cursor:
+            after_time, after_id = decode_cursor(cursor)
+            stmt = stmt.where(tuple_(Video.upload_time, Video.id) < tuple_(after_time, after_id))
+        if min_duration is not None:
+            stmt = stmt.where(Video.duration >= min_duration)
+        if max_duration is not None:
+            stmt = stmt.where(Video.duration <= max_duration)
+        if min_size is not None:
+            stmt = stmt.where(Video.size >= min_size)
+        if max_size is not None:
+            stmt = stmt.where(Video.size <= max_size)
+        if has_versions is not None:
+            versions = exists().where(VideoVersion.video_id == Video.id)
+            stmt = stmt.where(versions if has_versions else ~versions)
+        stmt = stmt.order_by(Video.upload_time.desc(), Video.id.desc()).limit(limit + 1)
+
+        try:
+            rows = [dict(r) for r in (await self.db.execute(stmt)).mappings().all()]
+        except SQLAlchemyError:
+            logger.error("Error listing videos", exc_info=True)
+            return [], None
+
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1]["upload_time"], rows[-1]["id"])
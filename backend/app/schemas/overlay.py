@@ -1,6 +1,6 @@
 
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 from app.enums.overlay_kind import OverlayKind
 from app.schemas.overlay_params import ImageOverlayParams, TextOverlayParams, VideoOverlayParams
@@ -17,6 +17,10 @@ class OverlayConfigCreate(BaseModel):
     kind: OverlayKind
     params: OverlayParams  # will be validated before save
 
+class CompositeRequest(BaseModel):
+    video_id: int
+    overlay_ids: Optional[List[int]] = None  # stacking order; all of the video's overlays if omitted
+
 class OverlayConfigRead(BaseModel):
     id: int
     video_id: int
@@ -9,15 +9,74 @@ class VideoOut(BaseModel):
     filepath: str
     duration: float | None = None
     size: int | None = None
+    width: int | None = None
+    height: int | None = None
+    fps: float | None = None
+    video_codec: str | None = None
+    audio_codec: str | None = None
+    bitrate: int | None = None
+    keyframe_interval: float | None = None
+    mp4_layout: str | None = None
     upload_time: datetime
     job_id: str | None = None
 
     class Config:
         from_attributes  = True
 
+class VideoSummary(BaseModel):
+    """Row of the video listing (see VideoRepository LIST_COLUMNS)."""
+    id: int
+    filename: str
+    duration: float | None = None
+    size: int | None = None
+    width: int | None = None
+    height: int | None = None
+    fps: float | None = None
+    video_codec: str | None = None
+    audio_codec: str | None = None
+    upload_time: datetime
+
+
+class LineageVersion(BaseModel):
+    id: int
+    quality: str
+    filepath: str
+    size: int | None = None
+
+
+class LineageNode(BaseModel):
+    """A video in a derivation tree: its encodings and the trims made from it."""
+    id: int
+    filename: str
+    filepath: str
+    duration: float | None = None
+    size: int | None = None
+    upload_time: datetime
+    depth: int
+    versions: List[LineageVersion] = []
+    children: List["LineageNode"] = []
+
+
+class JobSummary(BaseModel):
+    """Row of the job listing (see JobRepository LIST_COLUMNS)."""
+    id: str
+    video_id: int | None = None
+    task: str
+    status: str
+    created_at: datetime
+
+
 class TrimRequest(BaseModel):
     video_id: int
     start: float
     end: float
 
 
+class TrimRange(BaseModel):
+    start: float
+    end: float
+
+
+class BatchTrimRequest(BaseModel):
+    video_id: int
+    ranges: List[TrimRange]
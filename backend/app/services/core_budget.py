@@ -0,0 +1,47 @@
+# app/services/core_budget.py
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from app.core.config import settings
+from app.log import logger
+
+
+class CoreBudget:
+    """
+    Weighted semaphore over the CPU cores of this worker process. Every
+    ffmpeg run reserves as many cores as the threads it is allowed to use
+    (see ffmpeg_utils.run_ffmpeg) and waits until that many are free, so
+    concurrent tasks of a thread-pool worker fill the machine without
+    oversubscribing it. Waiters are admitted in arrival order, so a wide
+    encode is not starved by a stream of narrow trims.
+    """
+
+    def __init__(self, cores: int):
+        self.total = max(1, cores)
+        self.free = self.total
+        self._cond = threading.Condition()
+        self._waiting = deque()
+
+    @contextmanager
+    def reserve(self, cores: int):
+        cores = max(1, min(cores, self.total))
+        ticket = object()
+        with self._cond:
+            self._waiting.append(ticket)
+            if self._waiting[0] is not ticket or self.free < cores:
+                logger.info(f"Waiting for {cores} core(s) ({self.free}/{self.total} free)")
+            self._cond.wait_for(lambda: self._waiting[0] is ticket and self.free >= cores)
+            self._waiting.popleft()
+            self.free -= cores
+            self._cond.notify_all()
+        try:
+            yield cores
+        finally:
+            with self._cond:
+                self.free += cores
+                self._cond.notify_all()
+
+
+budget = CoreBudget(settings.WORKER_CORE_BUDGET or os.cpu_count() or 1)
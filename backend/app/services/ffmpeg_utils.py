@@ -1,11 +1,24 @@
 # app/services/ffmpeg_utils.py
 import shlex
-import subprocess
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 import tempfile
 import os
 
+from app.core.config import settings
+from app.log import logger
+from app.services import probe, process_runner
+from app.services.core_budget import budget
+
+MOVFLAGS = {
+    "faststart": "+faststart",
+    "fragmented": "+frag_keyframe+empty_moov+default_base_moof",
+}
+MP4_EXTENSIONS = {".mp4", ".m4v", ".mov"}
+
 def _pos_to_xy(position: str, overlay_w: int = 0, overlay_h: int = 0):
     """
     Convert simple position keywords to x,y expressions for ffmpeg overlay/drawtext.
@@ -29,24 +42,171 @@ def _pos_to_xy(position: str, overlay_w: int = 0, overlay_h: int = 0):
     # default
     return "10", f"main_h - {overlay_h} - 10"
 
+# Progress sink for the ffmpeg runs of the current task (see progress_reporter)
+_progress: ContextVar[Optional[Tuple[Callable[[Dict], None], Optional[float]]]] = ContextVar("ffmpeg_progress", default=None)
+
+
+@contextmanager
+def progress_reporter(callback: Callable[[Dict], None], duration: Optional[float] = None):
+    """
+    Report progress of every ffmpeg run inside the block to callback, at
+    most once per settings.PROGRESS_INTERVAL seconds. duration is the
+    expected output length, used for percent and ETA.
+    callback receives: out_time, fps, speed, percent, eta (None if unknown)
+    """
+    token = _progress.set((callback, duration))
+    try:
+        yield
+    finally:
+        _progress.reset(token)
+
+
+# -threads of the ffmpeg runs of the current task (see set_task_threads)
+_threads: ContextVar[Optional[int]] = ContextVar("ffmpeg_threads", default=None)
+
+
+def set_task_threads(threads: Optional[int]):
+    """Declare how many threads (and budgeted cores) each ffmpeg run of the current task uses."""
+    _threads.set(threads)
+
+
+def task_threads() -> int:
+    return _threads.get() or settings.FFMPEG_THREADS
+
+
+def _with_threads(args: list, threads: int) -> list:
+    """
+    Cap the filter graphs (simple and -filter_complex, which otherwise get
+    a thread per core each), the decoder (before the first -i) and, unless
+    the command already sets per-output -threads, the encoder of the last
+    output.
+    """
+    n = str(threads)
+    head = [args[0], "-filter_threads", n, "-filter_complex_threads", n, "-threads", n]
+    if "-threads" in args:
+        return [*head, *args[1:]]
+    return [*head, *args[1:-1], "-threads", n, args[-1]]
+
+
+def _parse_progress_block(block: Dict[str, str], duration: Optional[float]) -> Dict:
+    out_time = None
+    if block.get("out_time_us", "N/A") != "N/A":
+        out_time = int(block["out_time_us"]) / 1_000_000
+    fps = float(block["fps"]) if block.get("fps", "N/A") != "N/A" else None
+    speed = block.get("speed", "N/A").rstrip("x").strip()
+    speed = float(speed) if speed not in ("", "N/A") else None
+
+    percent = eta = None
+    if duration and out_time is not None:
+        percent = round(min(out_time / duration, 1.0) * 100, 1)
+        if speed:
+            eta = round(max(duration - out_time, 0) / speed, 1)
+    return {
+        "out_time": round(out_time, 3) if out_time is not None else None,
+        "fps": fps,
+        "speed": speed,
+        "percent": percent,
+        "eta": eta,
+    }
+
+
 def run_ffmpeg(args: list):
     """
     Run FFmpeg command (list form). Raise CalledProcessError on failure.
+    Runs through process_runner (bounded stderr tail, FFMPEG_TIMEOUT /
+    FFMPEG_CPU_TIMEOUT, rusage). Inside progress_reporter(), ffmpeg's
+    -progress output is read incrementally and forwarded (throttled) to the
+    reporter. The run is limited to task_threads() threads and waits for
+    that many cores of the worker's core budget.
+    """
+    threads = task_threads()
+    args = _with_threads(args, threads)
+    with budget.reserve(threads):
+        return _run_ffmpeg(args)
+
+
+def _run_ffmpeg(args: list):
+    limits = {
+        "timeout": settings.FFMPEG_TIMEOUT or None,
+        "cpu_timeout": settings.FFMPEG_CPU_TIMEOUT or None,
+    }
+    sink = _progress.get()
+    if sink is None:
+        return process_runner.run(args, **limits)
+
+    callback, duration = sink
+    block: Dict[str, str] = {}
+    last_sent = [0.0]
+
+    def on_line(line: str):
+        key, _, value = line.strip().partition("=")
+        if key != "progress":
+            block[key] = value
+            return
+        now = time.monotonic()
+        if value == "end" or now - last_sent[0] >= settings.PROGRESS_INTERVAL:
+            try:
+                callback(_parse_progress_block(block, duration))
+            except Exception:
+                logger.warning("Progress callback failed", exc_info=True)
+            last_sent[0] = now
+        block.clear()
+
+    args = [args[0], "-progress", "pipe:1", "-nostats", *args[1:]]
+    return process_runner.run(args, on_stdout_line=on_line, **limits)
+
+
+def mp4_output_args(output_path: str) -> List[str]:
+    """
+    -movflags for a final MP4/MOV output so it is written in the configured
+    layout (settings.MP4_FINALIZE) directly; finalize_mp4 then only verifies.
     """
-    completed = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if completed.returncode != 0:
-        raise subprocess.CalledProcessError(
-            returncode=completed.returncode,
-            cmd=args,
-            output=completed.stdout,
-            stderr=completed.stderr
-        )
-    return completed
+    flags = MOVFLAGS.get(settings.MP4_FINALIZE)
+    if not flags or os.path.splitext(str(output_path))[1].lower() not in MP4_EXTENSIONS:
+        return []
+    return ["-movflags", flags]
+
+
+def finalize_mp4(path: str, mode: Optional[str] = None) -> Optional[str]:
+    """
+    Finalization stage shared by every task that produces an output file:
+    make sure the moov atom is at the front ("faststart") or the file is
+    fragmented ("fragmented"), per settings.MP4_FINALIZE.
+    Files already in that layout are left untouched (only box headers are
+    read); others are remuxed with stream copy and replaced atomically after
+    the new layout is verified. Returns the file's layout, or None for
+    non-MP4 containers, which are left as they are.
+    """
+    mode = mode or settings.MP4_FINALIZE
+    layout = probe.mp4_layout(path)
+    if mode not in MOVFLAGS or layout is None or layout == mode:
+        return layout
+
+    base, ext = os.path.splitext(path)
+    tmp = f"{base}.finalize{ext}"
+    try:
+        run_ffmpeg([
+            "ffmpeg", "-y", "-i", path,
+            "-map", "0:v?", "-map", "0:a?",
+            "-c", "copy",
+            "-movflags", MOVFLAGS[mode],
+            tmp,
+        ])
+        result = probe.mp4_layout(tmp)
+        if result != mode:
+            raise RuntimeError(f"Finalized {path} has layout {result}, expected {mode}")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    logger.info(f"Finalized {path}: {layout} -> {result}")
+    return result
 
 def add_text_overlay(input_path: str,  text: str,
                      position: str = "bottom-right",
                      start: Optional[float] = 0.0,
-                     end: Optional[float] = None):
+                     end: Optional[float] = None,
+                     output_path: Optional[str] = None):
     """
     Add drawtext overlay between start and end seconds.
     """
@@ -65,7 +225,7 @@ def add_text_overlay(input_path: str,  text: str,
         f"enable='{enable}'"
     ]
     drawtext = ",".join([p for p in drawtext_parts if p])
-    temp_path = input_path + "_text_overlay_temp.mp4"
+    temp_path = output_path or input_path + "_text_overlay_temp.mp4"
     args = [
         "ffmpeg", "-y", "-i", str(input_path),
         "-vf", drawtext,
@@ -74,15 +234,17 @@ def add_text_overlay(input_path: str,  text: str,
     ]
     result = run_ffmpeg(args)
 
-    # Replace original file with new file
-    os.replace(temp_path, input_path)
+    # Replace original file with new file, unless the caller takes the output
+    if output_path is None:
+        os.replace(temp_path, input_path)
 
     return 
 
 def add_image_overlay(input_path: str, overlay_asset_path: str,
                       position: str = "top-right",
                       start: Optional[float] = 0.0,
-                      end: Optional[float] = None,):
+                      end: Optional[float] = None,
+                      output_path: Optional[str] = None):
     """
     Overlay an image on video for time range [start,end). If end is None, overlay till end.
     Supports optional scaling and opacity.
@@ -101,7 +263,7 @@ def add_image_overlay(input_path: str, overlay_asset_path: str,
 
     # filter_complex: [1]... [ov]; [0][ov]overlay=...
     filter_complex = f"[1]{ov_filter_str}[ov];[0][ov]overlay=x={x_expr}:y={y_expr}:enable='{enable}'"
-    temp_path = input_path + "_text_overlay_temp.mp4"
+    temp_path = output_path or input_path + "_text_overlay_temp.mp4"
     args = [
         "ffmpeg", "-y", "-i", str(input_path), "-i", str(overlay_asset_path),
         "-filter_complex", filter_complex,
@@ -109,14 +271,16 @@ def add_image_overlay(input_path: str, overlay_asset_path: str,
         str(temp_path)
     ]
     result = run_ffmpeg(args)
-    # Replace original file with new file
-    os.replace(temp_path, input_path)
+    # Replace original file with new file, unless the caller takes the output
+    if output_path is None:
+        os.replace(temp_path, input_path)
     return 
 
 def add_video_overlay(input_path: str, overlay_asset_path: str,
                       position: str = "center",
                       start: Optional[float] = 0.0,
-                      end: Optional[float] = None,):
+                      end: Optional[float] = None,
+                      output_path: Optional[str] = None):
     """
     Overlay a video (overlay_video) on top of input video between start and end.
     overlay_video will loop or be cut depending on shortest settings — we set shortest=1 to stop when overlay ends
@@ -131,7 +295,7 @@ def add_video_overlay(input_path: str, overlay_asset_path: str,
     # Use setpts to align overlay timing, use enable in overlay filter
     # We will use -stream_loop -1 for overlay looping if shorter than main (optional)
     filter_complex = f"[1]{ov_filter_str}[ov];[0][ov]overlay=x={x_expr}:y={y_expr}:enable='{enable}':shortest=1"
-    temp_path = input_path + "_text_overlay_temp.mp4"
+    temp_path = output_path or input_path + "_text_overlay_temp.mp4"
     args = [
         "ffmpeg", "-y", "-i", str(input_path), "-i", str(overlay_asset_path),
         "-filter_complex", filter_complex,
@@ -139,6 +303,77 @@ def add_video_overlay(input_path: str, overlay_asset_path: str,
         str(temp_path)
     ]
     result = run_ffmpeg(args)
-    # Replace original file with new file
-    os.replace(temp_path, input_path)
+    # Replace original file with new file, unless the caller takes the output
+    if output_path is None:
+        os.replace(temp_path, input_path)
     return 
+
+
+def _enable_expr(start: Optional[float], end: Optional[float]) -> str:
+    start = start or 0.0
+    return f"between(t,{start},{end})" if end is not None else f"gte(t,{start})"
+
+
+def build_composite_graph(layers: List[Dict]) -> Tuple[List[str], str, str]:
+    """
+    Build one filter_complex that draws every layer, in order, on top of
+    input 0. layers: dicts with kind (TEXT/IMAGE/VIDEO), params (text,
+    position, start_time, end_time) and asset_path for IMAGE/VIDEO.
+    Returns (extra input paths, filter_complex, label of the final video).
+    """
+    inputs: List[str] = []
+    graph: List[str] = []
+    current = "[0:v]"
+    for i, layer in enumerate(layers):
+        kind = layer["kind"]
+        params = layer.get("params") or {}
+        position = params.get("position")
+        enable = _enable_expr(params.get("start_time"), params.get("end_time"))
+        out = f"[v{i}]"
+
+        if kind == "TEXT":
+            text = params.get("text") or "Sample Text"
+            safe_text = text.replace(":", r"\:").replace("'", r"\'")
+            x_expr, y_expr = _pos_to_xy(position, overlay_w="text_w", overlay_h="text_h")
+            graph.append(f"{current}drawtext=text='{safe_text}':x={x_expr}:y={y_expr}:enable='{enable}'{out}")
+        elif kind in ("IMAGE", "VIDEO"):
+            if not layer.get("asset_path"):
+                raise ValueError(f"{kind} overlay layer {i} has no asset")
+            inputs.append(layer["asset_path"])
+            ov = f"[ov{i}]"
+            x_expr, y_expr = _pos_to_xy(position, overlay_w="overlay_w", overlay_h="overlay_h")
+            graph.append(f"[{len(inputs)}:v]format=rgba{ov}")
+            # eof_action=pass lets a short overlay clip disappear when it ends; an
+            # image is a single frame, kept on screen by overlay's default (repeat)
+            eof = ":eof_action=pass" if kind == "VIDEO" else ""
+            graph.append(f"{current}{ov}overlay=x={x_expr}:y={y_expr}:enable='{enable}'{eof}{out}")
+        else:
+            raise ValueError(f"Unsupported overlay kind: {kind}")
+        current = out
+
+    return inputs, ";".join(graph), current
+
+
+def compose_overlays(input_path: str, output_path: str, layers: List[Dict],
+                     start: Optional[float] = None, end: Optional[float] = None):
+    """
+    Apply all layers to input_path in a single decode/encode and write the
+    result to output_path (the source is never modified).
+    With start/end only that segment is rendered, video only, keeping source
+    timestamps (-copyts) so layer enable windows stay on the global timeline.
+    """
+    inputs, filter_complex, final = build_composite_graph(layers)
+    segment = start is not None
+    args = ["ffmpeg", "-y"]
+    if segment:
+        args += ["-copyts", "-ss", f"{start:.6f}", "-to", f"{end:.6f}"]
+    args += ["-i", str(input_path)]
+    for asset in inputs:
+        args += ["-i", str(asset)]
+    args += ["-filter_complex", filter_complex, "-map", final]
+    args += ["-an"] if segment else ["-map", "0:a?", "-c:a", "copy", *mp4_output_args(output_path)]
+    args += [
+        "-c:v", "libx264", "-preset", "fast",
+        str(output_path),
+    ]
+    return run_ffmpeg(args)
@@ -0,0 +1,234 @@
+# app/services/file_serving.py
+"""
+Conditional and byte-range file responses for large media files.
+
+Validators (ETag / Last-Modified) come from the size and mtime stored with
+the row being served, so a revalidation (If-None-Match / If-Modified-Since)
+is answered with a 304 after a single DB lookup, without touching the file.
+Bodies support single ranges (206), multiple ranges (multipart/byteranges)
+and are sent zero-copy through the ASGI "http.response.zerocopy" extension
+(os.sendfile) when the server offers it, or handed to nginx with
+X-Accel-Redirect when SENDFILE_ACCEL_PREFIX is configured.
+"""
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request, Response
+
+from app.core.config import settings
+
+# Ranges beyond this many are ignored and the full body is sent instead
+# (RFC 9110 allows it), so a request cannot fan out into thousands of parts.
+MAX_RANGES = 16
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def make_etag(size: int, mtime: float) -> str:
+    return f'"{size:x}-{int(mtime * 1_000_000):x}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    if header.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _etag_matches(inm, etag)
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _if_range_holds(request: Request, etag: str, mtime: float) -> bool:
+    """A Range is only honoured if If-Range (when present) still matches."""
+    value = request.headers.get("if-range")
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith("W/"):
+        return value == etag  # strong comparison
+    try:
+        return int(mtime) == int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a "bytes=" Range header into sorted, merged (start, end) inclusive
+    pairs. Returns None when the header should be ignored (not bytes, malformed
+    or too many ranges) and [] when no range is satisfiable (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if not first:  # suffix: last N bytes
+                n = int(last)
+                if n <= 0:
+                    continue
+                start, end = max(0, size - n), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """
+    Stream ranges of a file. ranges=None sends the whole file (200); one
+    range is a plain 206, several are a multipart/byteranges 206.
+    """
+
+    def __init__(self, path: str, size: int, ranges: Optional[List[Tuple[int, int]]],
+                 media_type: str, headers: dict):
+        self.path = path
+        self.size = size
+        self.parts: List[Tuple[bytes, int, int]] = []  # (preamble, start, end)
+        self.epilogue = b""
+        headers = dict(headers)
+        headers["accept-ranges"] = "bytes"
+
+        if ranges is None:
+            status = 200
+            self.parts = [(b"", 0, size - 1)] if size else []
+            length = size
+        elif len(ranges) == 1:
+            status = 206
+            start, end = ranges[0]
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.parts = [(b"", start, end)]
+            length = end - start + 1
+        else:
+            status = 206
+            boundary = secrets.token_hex(12)
+            for i, (start, end) in enumerate(ranges):
+                preamble = (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("latin-1")
+                self.parts.append(((b"\r\n" if i else b"") + preamble, start, end))
+            self.epilogue = f"\r\n--{boundary}--\r\n".encode("latin-1")
+            media_type = f"multipart/byteranges; boundary={boundary}"
+            length = sum(len(p) + e - s + 1 for p, s, e in self.parts) + len(self.epilogue)
+
+        super().__init__(status_code=status, headers=headers, media_type=media_type)
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zerocopy = "http.response.zerocopy" in scope.get("extensions", {})
+        with open(self.path, "rb") as f:
+            for preamble, start, end in self.parts:
+                if preamble:
+                    await send({"type": "http.response.body", "body": preamble, "more_body": True})
+                if zerocopy:
+                    await send({
+                        "type": "http.response.zerocopy",
+                        "file": f,
+                        "offset": start,
+                        "count": end - start + 1,
+                        "more_body": True,
+                    })
+                    continue
+                offset = start
+                while offset <= end:
+                    n = min(READ_CHUNK_SIZE, end - offset + 1)
+                    chunk = await anyio.to_thread.run_sync(os.pread, f.fileno(), n, offset)
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": self.epilogue, "more_body": False})
+
+
+def serve_file(request: Request, path: str, size: Optional[int] = None, mtime: Optional[float] = None,
+               media_type: str = "application/octet-stream", filename: Optional[str] = None,
+               headers: Optional[dict] = None) -> Response:
+    """
+    Build the response for GET/HEAD of a file: 304, 416, 200 or 206.
+    size/mtime are the values stored alongside the file; when missing the
+    file is stat'ed instead.
+    """
+    if size is None or mtime is None:
+        st = os.stat(path)
+        size, mtime = st.st_size, st.st_mtime
+
+    etag = make_etag(size, mtime)
+    headers = {
+        **(headers or {}),
+        "etag": etag,
+        "last-modified": formatdate(mtime, usegmt=True),
+    }
+    if filename:
+        headers["content-disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+
+    if _not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+
+    # Sending a body needs the real length; if the file changed behind the
+    # stored values, describe the file as it is now.
+    st = os.stat(path)
+    if (st.st_size, st.st_mtime) != (size, mtime):
+        size, mtime = st.st_size, st.st_mtime
+        etag = make_etag(size, mtime)
+        headers["etag"] = etag
+        headers["last-modified"] = formatdate(mtime, usegmt=True)
+
+    accel = settings.SENDFILE_ACCEL_PREFIX
+    storage_root = os.path.realpath(settings.STORAGE_PATH)
+    real = os.path.realpath(path)
+    if accel and real.startswith(storage_root + os.sep):
+        # nginx serves the bytes itself (sendfile, ranges) from an internal location.
+        headers["x-accel-redirect"] = quote(f"{accel.rstrip('/')}/{os.path.relpath(real, storage_root)}")
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header and _if_range_holds(request, etag, mtime):
+        ranges = parse_range(range_header, size)
+        if ranges == []:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+
+    return RangeFileResponse(path, size, ranges, media_type, headers)
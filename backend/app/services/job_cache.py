@@ -0,0 +1,162 @@
+# app/services/job_cache.py
+"""
+Write-through cache of job status in Redis (the Celery broker).
+
+Repositories stage a snapshot of every job they write (stage()); the
+snapshot is written to Redis only once the transaction commits (a
+rolled-back transition never becomes visible) by the Session after_commit
+hook below, from workers and from the API alike.
+GET /jobs/{id} reads the cache first and falls back to Postgres on a miss,
+repopulating the entry. Every write is a compare-and-set on the job's
+revision (bumped by each update of the row): a snapshot only replaces an
+older one, so neither a late API write nor a repopulation from a read that
+raced a commit can overwrite a newer state. Entries of finished jobs
+expire after JOB_CACHE_TERMINAL_TTL, in-flight ones after JOB_CACHE_TTL
+as a safety net. Redis errors are logged and treated as misses: the
+database stays the source of truth.
+"""
+import asyncio
+import json
+from datetime import datetime
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.enums.job_status import JobStatus
+from app.log import logger
+
+KEY_PREFIX = "job:"
+TERMINAL_STATUSES = (JobStatus.SUCCESS.value, JobStatus.FAILED.value)
+
+_client: Optional[redis.Redis] = None
+_async_client: Optional[aioredis.Redis] = None
+# Strong references to in-flight async writes (see _after_commit)
+_pending_writes: set = set()
+
+# SET KEYS[1] = ARGV[1] (revision ARGV[2], TTL ARGV[3]) unless the cached
+# snapshot is at least as recent. Returns 1 if written.
+_SET_IF_NEWER = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ok, snap = pcall(cjson.decode, current)
+    if ok and type(snap) == 'table' and tonumber(snap['revision'] or -1) >= tonumber(ARGV[2]) then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+
+def _sync_redis() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=settings.JOB_CACHE_TIMEOUT)
+    return _client
+
+
+def _async_redis() -> aioredis.Redis:
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.Redis.from_url(settings.REDIS_URL, socket_timeout=settings.JOB_CACHE_TIMEOUT)
+    return _async_client
+
+
+def _value(v):
+    return getattr(v, "value", v)
+
+
+def snapshot(job) -> dict:
+    """The cached (and served) view of a Job row."""
+    return {
+        "job_id": job.id,
+        "video_id": job.video_id,
+        "status": _value(job.status),
+        "task": _value(job.task),
+        "meta": job.meta,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "revision": job.revision or 0,
+    }
+
+
+def _entry(snap: dict):
+    """(keys, args) of _SET_IF_NEWER for a snapshot."""
+    ttl = settings.JOB_CACHE_TERMINAL_TTL if snap["status"] in TERMINAL_STATUSES else settings.JOB_CACHE_TTL
+    return [KEY_PREFIX + snap["job_id"]], [json.dumps(snap, default=str), snap.get("revision", 0), int(ttl)]
+
+
+def _decode(raw) -> dict:
+    snap = json.loads(raw)
+    if snap.get("created_at"):
+        snap["created_at"] = datetime.fromisoformat(snap["created_at"])
+    return snap
+
+
+def stage(db, job):
+    """Queue a flushed job's current state to be cached when db commits."""
+    if settings.JOB_CACHE_ENABLED:
+        db.info.setdefault("job_cache", {})[job.id] = snapshot(job)
+
+
+def store(snap: dict):
+    try:
+        keys, args = _entry(snap)
+        _sync_redis().eval(_SET_IF_NEWER, len(keys), *keys, *args)
+    except redis.RedisError as e:
+        logger.warning(f"Job cache write failed for {snap['job_id']}: {e}")
+
+
+async def populate(snap: dict):
+    """Cache a snapshot (read from the database, or committed by the API), unless a newer one is cached."""
+    if not settings.JOB_CACHE_ENABLED:
+        return
+    try:
+        keys, args = _entry(snap)
+        await _async_redis().eval(_SET_IF_NEWER, len(keys), *keys, *args)
+    except redis.RedisError as e:
+        logger.warning(f"Job cache write failed for {snap['job_id']}: {e}")
+
+
+async def _store_all(snaps):
+    for snap in snaps:
+        await populate(snap)
+
+
+async def get(job_id: str) -> Optional[dict]:
+    """Cached snapshot of a job, or None (miss, disabled or Redis down)."""
+    if not settings.JOB_CACHE_ENABLED:
+        return None
+    try:
+        raw = await _async_redis().get(KEY_PREFIX + job_id)
+    except redis.RedisError as e:
+        logger.warning(f"Job cache read failed for {job_id}: {e}")
+        return None
+    return _decode(raw) if raw else None
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    snaps = session.info.pop("job_cache", None)
+    if not snaps:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None:  # Celery worker (sync session)
+        for snap in snaps.values():
+            store(snap)
+        return
+    # AsyncSession inside the API: don't block the event loop on Redis.
+    task = loop.create_task(_store_all(list(snaps.values())))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("job_cache", None)
@@ -0,0 +1,35 @@
+# app/services/job_queue.py
+"""
+Publishing jobs to the broker from the API.
+
+Job rows are committed before their task is sent, so a failed publish
+(broker down, timeout) would leave a PENDING job that never runs and keeps
+holding its idempotency key: every identical request after it would be
+coalesced onto a job that never completes. send() marks the jobs FAILED
+when the publish raises.
+"""
+from typing import Callable, Iterable, Union
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.enums.job_status import JobStatus
+from app.log import logger
+
+
+async def send(job_repo, job_ids: Union[str, Iterable[str]], publish: Callable, *args, **kwargs):
+    """
+    Run publish(*args, **kwargs) (e.g. task.apply_async) off the event loop.
+    If it raises, job_ids are marked FAILED and the error is re-raised.
+    """
+    try:
+        return await run_in_threadpool(publish, *args, **kwargs)
+    except Exception as e:
+        job_ids = [job_ids] if isinstance(job_ids, str) else list(job_ids)
+        logger.error(f"Could not enqueue jobs {job_ids}: {e}", exc_info=True)
+        for job_id in job_ids:
+            await job_repo.update_status(
+                job_id=job_id,
+                status=JobStatus.FAILED.value,
+                meta={"error": f"Could not enqueue job: {e}"},
+            )
+        raise
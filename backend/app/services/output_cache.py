@@ -0,0 +1,133 @@
+# app/services/output_cache.py
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.session import unit_of_work
+from app.log import logger
+from app.repositories.derived_output_repo import DerivedOutputRepository
+from app.services import storage
+
+CACHE_DIR = Path(settings.STORAGE_PATH) / "cache"
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def normalize_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Canonical form of operation params: None values dropped, floats rounded
+    to milliseconds, so 10 and 10.0000001 hit the same entry.
+    """
+    def norm(value):
+        if isinstance(value, float):
+            return round(value, 3)
+        if isinstance(value, dict):
+            return {k: norm(v) for k, v in value.items() if v is not None}
+        if isinstance(value, (list, tuple)):
+            return [norm(v) for v in value]
+        if hasattr(value, "value"):  # enums
+            return value.value
+        return value
+
+    return norm(params or {})
+
+
+def make_key(source_hash: str, operation: str, params: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        [source_hash, operation, normalize_params(params)],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def lookup(db: Session, source_hash: str, operation: str, params: Dict[str, Any]) -> Optional[str]:
+    """Return the cached output path for this (source, operation, params), or None."""
+    if not settings.OUTPUT_CACHE_ENABLED or not source_hash:
+        return None
+
+    repo = DerivedOutputRepository(db)
+    key = make_key(source_hash, operation, params)
+    entry = repo.get(key)
+    if not entry:
+        return None
+    if not os.path.exists(entry.filepath):
+        logger.warning(f"Cached output {key} missing on disk, dropping entry")
+        repo.delete(key)
+        return None
+
+    repo.touch(entry)
+    logger.info(f"Output cache hit for {operation} on {source_hash[:12]}: {entry.filepath}")
+    return entry.filepath
+
+
+def store(db: Session, source_hash: str, operation: str, params: Dict[str, Any], output_path: str) -> Optional[str]:
+    """
+    Add a freshly produced output to the cache. The cache keeps its own
+    link to the file, so callers may keep, move or replace output_path.
+    """
+    if not settings.OUTPUT_CACHE_ENABLED or not source_hash:
+        return None
+
+    key = make_key(source_hash, operation, params)
+    ext = os.path.splitext(output_path)[1]
+    cached_path = str(CACHE_DIR / key[:2] / f"{key}{ext}")
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    if os.path.exists(cached_path):
+        os.remove(cached_path)
+    storage.link_or_copy(output_path, cached_path)
+
+    with unit_of_work(db):
+        DerivedOutputRepository(db).upsert(
+            cache_key=key,
+            source_hash=source_hash,
+            operation=operation,
+            params=normalize_params(params),
+            filepath=cached_path,
+            size=os.path.getsize(cached_path),
+        )
+        evict(db)
+    return cached_path
+
+
+def materialize(cached_path: str, dest: str) -> str:
+    """
+    Expose a cached output at dest. Linked to a temp name first and renamed
+    over dest, so an existing file at dest is replaced atomically.
+    """
+    temp_path = f"{dest}.{uuid.uuid4().hex[:8]}.tmp"
+    storage.link_or_copy(cached_path, temp_path)
+    os.replace(temp_path, dest)
+    return dest
+
+
+def evict(db: Session) -> int:
+    """
+    Drop least-recently-used entries until the cache fits in
+    OUTPUT_CACHE_MAX_BYTES. Only the cache's own link is removed; outputs
+    already materialized for videos keep their data. Returns bytes freed.
+    """
+    repo = DerivedOutputRepository(db)
+    excess = repo.total_size() - settings.OUTPUT_CACHE_MAX_BYTES
+    freed = 0
+    with unit_of_work(db):
+        while excess > 0:
+            batch = repo.least_recently_used()
+            if not batch:
+                break
+            for entry in batch:
+                if excess <= 0:
+                    break
+                if os.path.exists(entry.filepath):
+                    os.remove(entry.filepath)
+                repo.delete(entry.cache_key)
+                excess -= entry.size
+                freed += entry.size
+    if freed:
+        logger.info(f"Output cache evicted {freed} bytes")
+    return freed
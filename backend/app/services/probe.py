@@ -0,0 +1,200 @@
+# app/services/probe.py
+import json
+import os
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+from app.log import logger
+from app.services import process_runner
+
+# In-process cache keyed by (path, mtime_ns, size): a rewritten file gets a new key.
+_CACHE_SIZE = 256
+_cache: "OrderedDict[Tuple[str, int, int], Dict]" = OrderedDict()
+_lock = threading.Lock()
+
+# Only this much of the file is scanned for keyframes when estimating the GOP length.
+KEYFRAME_SCAN_SECONDS = 30
+
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+    """Parse an ffprobe rational like "30000/1001"."""
+    if not rate or rate == "0/0":
+        return None
+    num, _, den = rate.partition("/")
+    try:
+        return round(float(num) / float(den or 1), 3)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _run_ffprobe(path: str) -> Dict:
+    """
+    One ffprobe run returning streams, format and the video packets of the
+    first KEYFRAME_SCAN_SECONDS (packets only, nothing is decoded).
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_streams",
+        "-show_format",
+        "-show_entries", "packet=stream_index,pts_time,flags",
+        "-read_intervals", f"%+{KEYFRAME_SCAN_SECONDS}",
+        "-of", "json",
+        path,
+    ]
+    result = process_runner.run(cmd, capture_stdout=True)
+    return json.loads(result.stdout)
+
+
+def mp4_layout(path: str) -> Optional[str]:
+    """
+    Classify an MP4/MOV file by the order of its top-level boxes, reading
+    only box headers: "faststart" (moov before mdat), "fragmented" (moov
+    then moof fragments), "moov_at_end", or None if it is not an ISO BMFF file.
+    """
+    seen = []
+    try:
+        with open(path, "rb") as f:
+            end = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + 8 <= end and len(seen) < 64:
+                f.seek(offset)
+                size, box = struct.unpack(">I4s", f.read(8))
+                if size == 1:
+                    size = struct.unpack(">Q", f.read(8))[0]
+                elif size == 0:
+                    size = end - offset
+                if size < 8:
+                    return None
+                box = box.decode("latin-1")
+                seen.append(box)
+                if box == "moov" and ("mdat" in seen or "moof" in seen):
+                    break
+                if box in ("mdat", "moof") and "moov" in seen:
+                    break
+                offset += size
+    except (OSError, struct.error):
+        return None
+
+    if "moov" not in seen:
+        return None
+    if "moof" in seen:
+        return "fragmented"
+    if "mdat" in seen and seen.index("mdat") < seen.index("moov"):
+        return "moov_at_end"
+    return "faststart"
+
+
+def _summarize(path: str, data: Dict) -> Dict:
+    streams = data.get("streams", [])
+    fmt = data.get("format", {})
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+
+    keyframe_interval = None
+    if video:
+        keyframes = sorted(
+            float(p["pts_time"])
+            for p in data.get("packets", [])
+            if p.get("stream_index") == video.get("index")
+            and "K" in p.get("flags", "")
+            and p.get("pts_time") not in (None, "N/A")
+        )
+        gaps = [b - a for a, b in zip(keyframes, keyframes[1:]) if b > a]
+        if gaps:
+            keyframe_interval = round(median(gaps), 3)
+
+    return {
+        "size": _to_int(fmt.get("size")) or os.path.getsize(path),
+        "duration": _to_float(fmt.get("duration")),
+        "bitrate": _to_int(fmt.get("bit_rate")),
+        "format_name": fmt.get("format_name"),
+        "width": _to_int(video.get("width")),
+        "height": _to_int(video.get("height")),
+        "fps": _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+        "video_codec": video.get("codec_name"),
+        "pix_fmt": video.get("pix_fmt"),
+        "video_profile": video.get("profile"),
+        "video_level": _to_int(video.get("level")),
+        "video_time_base": video.get("time_base"),
+        "audio_codec": audio.get("codec_name"),
+        "keyframe_interval": keyframe_interval,
+        "mp4_layout": mp4_layout(path),
+        "streams": streams,
+        "format": fmt,
+    }
+
+
+def probe(path: str) -> Dict:
+    """
+    Return stream/format metadata for a media file.
+    Results are cached per (path, mtime, size), so repeated calls for an
+    unchanged file don't spawn ffprobe again.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    logger.info(f"Probing {path}")
+    try:
+        info = _summarize(path, _run_ffprobe(path))
+    except subprocess.CalledProcessError as e:
+        logger.error(f"ffprobe failed for {path}: {e.stderr}")
+        raise
+    except FileNotFoundError:
+        logger.error("ffprobe executable not found. Make sure ffmpeg is installed and in PATH.")
+        raise
+
+    with _lock:
+        _cache[key] = info
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+
+def keyframe_index(path: str) -> List[float]:
+    """
+    Presentation times (seconds) of every video keyframe, read from packet
+    flags so nothing is decoded. Output is consumed line by line.
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        path,
+    ]
+    logger.info(f"Building keyframe index for {path}")
+    keyframes = []
+
+    def on_line(line: str):
+        pts_time, _, flags = line.strip().partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+
+    try:
+        process_runner.run(cmd, on_stdout_line=on_line)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"ffprobe failed for {path}: {e.stderr}")
+        raise
+    return sorted(keyframes)
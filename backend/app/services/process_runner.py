@@ -0,0 +1,146 @@
+# app/services/process_runner.py
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.log import logger
+
+# Process groups of children currently running in this process, so they can
+# all be killed when the task is revoked or the worker child is terminated.
+_active_groups = set()
+_active_lock = threading.Lock()
+
+
+class ProcessResult(subprocess.CompletedProcess):
+    """CompletedProcess plus resource usage of the child."""
+
+    def __init__(self, args, returncode, stdout=None, stderr=None, rusage: Optional[Dict] = None):
+        super().__init__(args, returncode, stdout, stderr)
+        self.rusage = rusage or {}
+
+
+def kill_active(sig: int = signal.SIGKILL) -> int:
+    """Kill the whole process group of every running child. Returns how many were signalled."""
+    with _active_lock:
+        groups = list(_active_groups)
+    for pgid in groups:
+        try:
+            os.killpg(pgid, sig)
+        except ProcessLookupError:
+            pass
+    if groups:
+        logger.warning(f"Killed {len(groups)} child process group(s) with signal {sig}")
+    return len(groups)
+
+
+def _rusage(ru, elapsed: float) -> Dict:
+    return {
+        "wall_seconds": round(elapsed, 3),
+        "cpu_user_seconds": round(ru.ru_utime, 3),
+        "cpu_system_seconds": round(ru.ru_stime, 3),
+        "max_rss_kb": ru.ru_maxrss,
+    }
+
+
+def run(
+    args: List[str],
+    on_stdout_line: Optional[Callable[[str], None]] = None,
+    capture_stdout: bool = False,
+    timeout: Optional[float] = None,
+    cpu_timeout: Optional[int] = None,
+    stderr_lines: Optional[int] = None,
+) -> ProcessResult:
+    """
+    Run a child process with bounded memory use.
+
+    - stderr is consumed line by line; only the last stderr_lines lines
+      (settings.PROCESS_STDERR_TAIL_LINES) are kept for error reports.
+    - stdout is discarded unless on_stdout_line (called per line) or
+      capture_stdout (returned in full, for small outputs like ffprobe JSON).
+    - timeout is a wall-clock limit, cpu_timeout a CPU-seconds limit
+      (RLIMIT_CPU); either kills the child's whole process group.
+    - the child runs in its own session so kill_active() reaches anything
+      it spawned.
+    Raises CalledProcessError (stderr = tail) on a non-zero exit and
+    TimeoutExpired on a wall-clock timeout.
+    """
+    tail = deque(maxlen=stderr_lines or settings.PROCESS_STDERR_TAIL_LINES)
+    want_stdout = on_stdout_line is not None or capture_stdout
+    started = time.monotonic()
+
+    proc = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE if want_stdout else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+    )
+    with _active_lock:
+        _active_groups.add(proc.pid)
+
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    timer = threading.Timer(timeout, on_timeout) if timeout else None
+    try:
+        if cpu_timeout:
+            resource.prlimit(proc.pid, resource.RLIMIT_CPU, (cpu_timeout, cpu_timeout + 5))
+        if timer:
+            timer.start()
+
+        drain = threading.Thread(target=lambda: tail.extend(proc.stderr), daemon=True)
+        drain.start()
+
+        stdout_chunks = []
+        if want_stdout:
+            for line in proc.stdout:
+                if on_stdout_line is not None:
+                    on_stdout_line(line)
+                if capture_stdout:
+                    stdout_chunks.append(line)
+
+        _, status, ru = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        drain.join()
+    finally:
+        if timer:
+            timer.cancel()
+        with _active_lock:
+            _active_groups.discard(proc.pid)
+        if proc.returncode is None:
+            # Interrupted (e.g. the task is being torn down): don't leave the child behind
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            proc.wait()
+        for stream in (proc.stdout, proc.stderr):
+            if stream:
+                stream.close()
+
+    usage = _rusage(ru, time.monotonic() - started)
+    stderr = "".join(tail)
+    logger.info(
+        f"{os.path.basename(args[0])} exited {proc.returncode}: wall={usage['wall_seconds']}s "
+        f"cpu={usage['cpu_user_seconds'] + usage['cpu_system_seconds']:.3f}s max_rss={usage['max_rss_kb']}KB"
+    )
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(args, timeout, stderr=stderr)
+    if proc.returncode != 0:
+        error = subprocess.CalledProcessError(proc.returncode, args, output="".join(stdout_chunks), stderr=stderr)
+        error.rusage = usage
+        raise error
+    return ProcessResult(args, proc.returncode, "".join(stdout_chunks), stderr, usage)
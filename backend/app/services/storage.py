@@ -1,10 +1,33 @@
+import fcntl
+import hashlib
 import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
 from pathlib import Path
+from typing import BinaryIO, Tuple
 from app.core.config import settings
 from app.log import logger
 
 Path(settings.STORAGE_PATH).mkdir(parents=True, exist_ok=True)
 
+
+BLOB_DIR = Path(settings.STORAGE_PATH) / "blobs"
+BLOB_DIR.mkdir(parents=True, exist_ok=True)
+
+# Linux ioctl to share extents between files (btrfs/xfs reflink)
+FICLONE = 0x40049409
+
+
+class UploadTooLargeError(Exception):
+    """Raised when a streamed upload exceeds settings.MAX_UPLOAD_SIZE."""
+
+
+class EmptyUploadError(Exception):
+    """Raised when a streamed upload has no content."""
+
+
 def save_upload(file_bytes: bytes, filename: str) -> str:
     logger.info(f"Saving file to storage {settings.STORAGE_PATH}: {filename}")
     path = str((Path(settings.STORAGE_PATH) / filename).resolve())  # Path object
@@ -18,3 +41,226 @@ def save_upload(file_bytes: bytes, filename: str) -> str:
         raise
     return path
 
+
+def save_upload_stream(fileobj: BinaryIO, filename: str) -> Tuple[str, int, str]:
+    """
+    Copy a file-like object to storage in UPLOAD_CHUNK_SIZE chunks.
+    Size and sha256 are computed while copying, so the body is never held in
+    memory. Data goes to a temp file that is moved into the blob store only
+    once the copy completes; on any error (including UploadTooLargeError)
+    the temp file is removed.
+    Returns (materialized path, size, sha256 hexdigest); the caller owns one
+    reference on the blob (see BlobRepository.acquire).
+    """
+    logger.info(f"Streaming upload to storage {settings.STORAGE_PATH}: {filename}")
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=settings.STORAGE_PATH, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = fileobj.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > settings.MAX_UPLOAD_SIZE:
+                    raise UploadTooLargeError(
+                        f"Upload exceeds maximum size of {settings.MAX_UPLOAD_SIZE} bytes"
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+        if not size:
+            raise EmptyUploadError(f"Empty file uploaded: {filename}")
+        sha256 = digest.hexdigest()
+        ingest_blob(temp_path, sha256)
+    except Exception as e:
+        logger.error(f"Failed to save file: {e}", exc_info=True)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    path = materialize(sha256, filename)
+    logger.info(f"File saved successfully: {path}, size={size} bytes")
+    return path, size, sha256
+
+
+# === Content-addressed blob store ===
+def blob_path(sha256: str) -> Path:
+    """Blobs are sharded by the first two byte pairs of their hash: blobs/ab/cd/abcd..."""
+    return BLOB_DIR / sha256[:2] / sha256[2:4] / sha256
+
+
+def ingest_blob(temp_path: str, sha256: str) -> bool:
+    """
+    Move a fully written temp file into the blob store under its hash.
+    If the blob already exists the temp file is simply dropped.
+    Returns True if a new blob was stored.
+    """
+    dest = blob_path(sha256)
+    if dest.exists():
+        os.remove(temp_path)
+        logger.info(f"Blob {sha256} already stored, skipping write")
+        return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temp_path, dest)
+    return True
+
+
+def _reflink(src: Path, dest: str) -> None:
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def link_or_copy(src, dest: str) -> str:
+    """
+    Create dest as a hardlink of src, then try a reflink, and fall back to a
+    full copy (e.g. across filesystems).
+    """
+    try:
+        os.link(src, dest)
+    except OSError:
+        try:
+            _reflink(src, dest)
+        except OSError:
+            if os.path.exists(dest):
+                os.remove(dest)
+            shutil.copyfile(src, dest)
+    return dest
+
+
+def part_path(path: str) -> str:
+    """Unique temp name next to path, keeping its extension so ffmpeg picks the same muxer."""
+    base, ext = os.path.splitext(path)
+    return f"{base}.part-{uuid.uuid4().hex[:8]}{ext}"
+
+
+@contextmanager
+def atomic_output(path: str):
+    """
+    Yield a temp path to produce an output at; it is renamed over path when
+    the block completes and removed if it raises, so path never holds a
+    partial file, even when a task is killed or redelivered mid-write.
+    """
+    temp_path = part_path(path)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def materialize(sha256: str, filename: str) -> str:
+    """
+    Expose a blob under a unique, human-readable path in STORAGE_PATH.
+    Each materialized path is an independent name, so tasks that
+    os.replace() it never touch the shared blob.
+    """
+    dest = str((Path(settings.STORAGE_PATH) / f"{uuid.uuid4().hex[:8]}_{filename}").resolve())
+    return link_or_copy(blob_path(sha256), dest)
+
+
+def remove_blob(sha256: str) -> None:
+    """Delete a blob whose refcount has dropped to zero."""
+    path = blob_path(sha256)
+    if path.exists():
+        os.remove(path)
+        logger.info(f"Removed unreferenced blob {sha256}")
+
+
+# === Multi-part (resumable) uploads ===
+MULTIPART_DIR = Path(settings.STORAGE_PATH) / ".multipart"
+MULTIPART_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def create_multipart(upload_id: str, total_size: int) -> str:
+    """
+    Pre-size the assembly file for a multi-part upload so parts can be
+    written at their offsets in any order (the file is sparse until filled).
+    """
+    path = str((MULTIPART_DIR / upload_id).resolve())
+    with open(path, "wb") as f:
+        f.truncate(total_size)
+    logger.info(f"Created multipart upload file {path}, size={total_size} bytes")
+    return path
+
+
+class UploadClosedError(Exception):
+    """The multi-part upload was completed or aborted; no more parts can be written."""
+
+
+def open_multipart(path: str) -> int:
+    """
+    Open the assembly file for positional writes; caller closes the fd.
+    The fd holds a shared lock until closed, so complete_multipart waits
+    for parts being written. Raises UploadClosedError once the file has
+    been moved away (completed) or removed (aborted). Blocks while a
+    completion holds the file.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY)
+    except FileNotFoundError:
+        raise UploadClosedError(path)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        # A completion may have renamed the inode into the blob store while
+        # this waited for the lock: never write through to it
+        if not os.path.exists(path) or os.stat(path).st_ino != os.fstat(fd).st_ino:
+            raise UploadClosedError(path)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def write_part_chunk(fd: int, chunk: bytes, offset: int) -> int:
+    """Write a chunk at an absolute offset (pwrite, no seek shared between parts)."""
+    view = memoryview(chunk)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+    return offset
+
+
+def close_multipart(fd: int) -> None:
+    os.close(fd)
+
+
+def hash_file(path: str) -> Tuple[int, str]:
+    """Return (size, sha256 hexdigest) of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            digest.update(chunk)
+    return size, digest.hexdigest()
+
+
+def complete_multipart(path: str, filename: str) -> Tuple[str, int, str]:
+    """
+    Move a fully assembled multi-part upload into the blob store.
+    Returns (path, size, sha256 hexdigest) like save_upload_stream.
+    The file is locked exclusively while hashed and moved, so parts still
+    being written finish first and later ones are refused (see open_multipart).
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        size, sha256 = hash_file(path)
+        ingest_blob(path, sha256)
+    finally:
+        os.close(fd)
+    final_path = materialize(sha256, filename)
+    logger.info(f"Multipart upload assembled at {final_path}, size={size} bytes")
+    return final_path, size, sha256
+
+
+def abort_multipart(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,40 +1,48 @@
 # app/services/video_service.py
-import json
+import bisect
 import subprocess
 import os
-from typing import Dict, List, Tuple
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import HTTPException
-from fastapi.responses import FileResponse
+from fastapi import HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.log import logger
-from app.db.session import SessionLocal
-from app.db.models.video import  VideoVersion
+from app.core.config import settings
+from app.repositories.video_repo import AsyncVideoRepository
 from app.schemas.overlay import  OverlayParams, validate_overlay
 from app.enums.overlay_kind import OverlayKind
-from app.services.ffmpeg_utils import add_image_overlay, add_text_overlay, add_video_overlay
+from app.services import file_serving, probe, storage
+from app.services.ffmpeg_utils import add_image_overlay, add_text_overlay, add_video_overlay, mp4_output_args, run_ffmpeg, task_threads
 
-def trim_video_ffmpeg(input_path: str, output_path: str, start: float, end: float):
-    """
-    Trim video using ffmpeg and log output.
-    """
-    cmd = [
-        "ffmpeg",  # or full path to ffmpeg.exe
-        "-y",
-        "-i", input_path,
-        "-ss", str(start),
-        "-to", str(end),
-        "-c", "copy",
-        output_path
-    ]
-    
+# Source codecs the smart trim can splice re-encoded boundary GOPs into
+SMART_TRIM_VIDEO_CODECS = {"h264"}
+SMART_TRIM_AUDIO_CODECS = {"aac", None}
+# ffprobe H.264 profile -> libx264 -profile:v; sources in any other profile
+# (e.g. 4:4:4) are re-encoded whole instead of spliced
+SMART_TRIM_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+}
+# Keyframe times in the index are ffprobe's 6-decimal pts_time, which may sit
+# just below the real PTS. Cuts are nudged by this much (far less than a
+# frame) towards the side that keeps the keyframe in the intended piece.
+KEYFRAME_EPSILON = 1e-5
+
+
+def _run_ffmpeg_logged(cmd: List[str]):
     logger.info(f"Running ffmpeg command: {' '.join(cmd)}")
-    
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        logger.info(f"FFmpeg stdout: {result.stdout}")
+        result = run_ffmpeg(cmd)
         if result.stderr:
-            logger.warning(f"FFmpeg stderr: {result.stderr}")
-        logger.info(f"Video trimmed successfully: {output_path}")
+            logger.debug(f"FFmpeg stderr: {result.stderr}")
+        return result
     except subprocess.CalledProcessError as e:
         logger.error(f"FFmpeg failed with return code {e.returncode}")
         logger.error(f"FFmpeg stdout: {e.stdout}")
@@ -44,24 +52,216 @@ def trim_video_ffmpeg(input_path: str, output_path: str, start: float, end: floa
         logger.error("FFmpeg executable not found. Make sure ffmpeg is installed and in PATH.")
         raise
 
-def get_video_metadata(filepath: str) -> Tuple[int, float]:
+
+def _ts(seconds: float) -> str:
+    """A timestamp argument, without rounding it (repr is the shortest exact form)."""
+    return repr(float(seconds))
+
+
+def _video_encode_args(info: Dict) -> List[str]:
     """
-    Return file size in bytes and duration in seconds using ffprobe
+    libx264 settings matching the source stream (profile, level, pix_fmt), so
+    re-encoded boundary GOPs decode with the same decoder configuration as
+    the stream-copied middle they are spliced to.
     """
-    import subprocess, json
-    size = os.path.getsize(filepath)
+    args = ["-c:v", "libx264", "-preset", "fast", "-pix_fmt", info.get("pix_fmt") or "yuv420p"]
+    profile = SMART_TRIM_PROFILES.get(info.get("video_profile"))
+    if profile:
+        args += ["-profile:v", profile]
+    level = info.get("video_level")
+    if level and level > 0:
+        args += ["-level:v", f"{level / 10:g}"]  # ffprobe reports 4.1 as 41
+    return args
+
+
+def _track_timescale_args(info: Dict) -> List[str]:
+    """Keep the source's video timebase in an MP4 output."""
+    num, _, den = (info.get("video_time_base") or "").partition("/")
+    return ["-video_track_timescale", den] if num == "1" and den.isdigit() else []
+
 
-    cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "json",
-        filepath
+def _encode_range_cmd(input_path: str, output_path: str, start: float, duration: float, info: Dict,
+                      output_args: Optional[List[str]] = None) -> List[str]:
+    """Frame-accurate re-encode of [start, start+duration) using fast input seeking."""
+    return [
+        "ffmpeg", "-y",
+        "-ss", _ts(start),
+        "-i", input_path,
+        "-t", _ts(duration),
+        *_video_encode_args(info),
+        "-c:a", "aac",
+        *(output_args or _track_timescale_args(info)),
+        output_path,
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    data = json.loads(result.stdout)
-    duration = float(data["format"]["duration"])
-    return size, duration
+
+
+def _smart_trim(input_path: str, output_path: str, start: float, end: float,
+                keyframes: List[float], info: Dict):
+    """
+    Stream-copy the GOP-aligned middle of [start, end) and re-encode only the
+    partial GOPs before the first and after the last keyframe in range, then
+    join the pieces with the concat demuxer.
+
+    The pieces are MPEG-TS (Annex B), which carries SPS/PPS in-band before
+    every IDR, so each piece brings its own parameter sets through the
+    splice; the boundary encodes also match the source's profile and level.
+    """
+    inner = [k for k in keyframes if start <= k <= end]
+    first_kf, last_kf = (inner[0], inner[-1]) if inner else (None, None)
+    if first_kf is None or last_kf <= first_kf:
+        # Clip shorter than a GOP: nothing to copy, re-encode it all
+        _run_ffmpeg_logged(_encode_range_cmd(input_path, output_path, start, end - start, info))
+        return
+
+    ts_args = ["-f", "mpegts"]
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(output_path), prefix=".trim-")
+    try:
+        pieces = []
+        if first_kf - start > 0.001:
+            head = os.path.join(work_dir, "head.ts")
+            # Stops short of the keyframe, which opens the copied middle
+            _run_ffmpeg_logged(_encode_range_cmd(input_path, head, start, first_kf - start - KEYFRAME_EPSILON, info, ts_args))
+            pieces.append(head)
+
+        middle = os.path.join(work_dir, "middle.ts")
+        # A copy seek lands on the keyframe at or before the seek point: seek
+        # just past first_kf so it is that keyframe, not the one a GOP earlier,
+        # and stop just before last_kf, which opens the tail.
+        _run_ffmpeg_logged([
+            "ffmpeg", "-y",
+            "-ss", _ts(first_kf + KEYFRAME_EPSILON),
+            "-i", input_path,
+            "-t", _ts(last_kf - first_kf - 2 * KEYFRAME_EPSILON),
+            "-c", "copy",
+            "-bsf:v", "h264_mp4toannexb",
+            "-avoid_negative_ts", "make_zero",
+            *ts_args,
+            middle,
+        ])
+        pieces.append(middle)
+
+        if end - last_kf > 0.001:
+            tail = os.path.join(work_dir, "tail.ts")
+            # Decoding seek keeps the first frame at or after the seek point: last_kf
+            _run_ffmpeg_logged(_encode_range_cmd(input_path, tail, last_kf - KEYFRAME_EPSILON,
+                                                 end - last_kf + KEYFRAME_EPSILON, info, ts_args))
+            pieces.append(tail)
+
+        concat_list = os.path.join(work_dir, "pieces.txt")
+        with open(concat_list, "w") as f:
+            f.writelines(f"file '{p}'\n" for p in pieces)
+        _run_ffmpeg_logged([
+            "ffmpeg", "-y",
+            "-f", "concat", "-safe", "0",
+            "-i", concat_list,
+            "-c", "copy",
+            "-bsf:a", "aac_adtstoasc",
+            *_track_timescale_args(info),
+            output_path,
+        ])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def trim_video_ffmpeg(input_path: str, output_path: str, start: float, end: float,
+                      keyframes: Optional[List[float]] = None, info: Optional[Dict] = None):
+    """
+    Trim video using ffmpeg and log output.
+
+    Seeks on the input side, so the cost is proportional to the clip, not to
+    its position in the source. With settings.TRIM_MODE == "smart" and a
+    keyframe index for an h264 source (in a profile libx264 can match), cuts are frame-accurate while only the
+    boundary GOPs are re-encoded; "accurate" re-encodes the whole clip and
+    "copy" stream-copies from the keyframe at or before start.
+    info: probe metadata of the source (codecs, pix_fmt, profile, level,
+    timebase), probed if missing.
+    """
+    mode = settings.TRIM_MODE
+    if mode == "smart":
+        info = info or probe.probe(input_path)
+        if not keyframes or info.get("video_codec") not in SMART_TRIM_VIDEO_CODECS \
+                or info.get("audio_codec") not in SMART_TRIM_AUDIO_CODECS \
+                or info.get("video_profile") not in SMART_TRIM_PROFILES:
+            logger.info(f"Smart trim unavailable for {input_path}, re-encoding clip")
+            mode = "accurate"
+
+    if mode == "smart":
+        _smart_trim(input_path, output_path, start, end, keyframes, info)
+    elif mode == "accurate":
+        _run_ffmpeg_logged(_encode_range_cmd(input_path, output_path, start, end - start, info or {}))
+    else:
+        _run_ffmpeg_logged([
+            "ffmpeg", "-y",
+            "-ss", str(start),
+            "-i", input_path,
+            "-t", str(end - start),
+            "-c", "copy",
+            output_path,
+        ])
+    logger.info(f"Video trimmed successfully ({mode}): {output_path}")
+
+
+def _keyframe_at_or_before(keyframes: List[float], t: float) -> float:
+    i = bisect.bisect_right(keyframes, t + KEYFRAME_EPSILON)
+    return keyframes[i - 1] if i else 0.0
+
+
+def _demux_windows(clips: List[Tuple[float, float, str]]) -> List[List[Tuple[float, float, str]]]:
+    """
+    Group clips sorted by start into windows of overlapping or touching
+    ranges; each window is demuxed once. Disjoint windows get their own
+    seek, so the gap between them is never read.
+    """
+    windows = []
+    for clip in sorted(clips):
+        if windows and clip[0] <= max(end for _, end, _ in windows[-1]):
+            windows[-1].append(clip)
+        else:
+            windows.append([clip])
+    return windows
+
+
+def batch_trim_ffmpeg(input_path: str, clips: List[Tuple[float, float, str]],
+                      keyframes: Optional[List[float]] = None):
+    """
+    Cut several clips from one source: overlapping clips share one ffmpeg
+    run, seeked once to their earliest start and demuxed up to their latest
+    end, where every clip is a separate output with its own -ss/-to window.
+    clips: list of (start, end, output_path), one output per clip.
+    With TRIM_MODE=copy and a keyframe index, clips are stream-copied from
+    the keyframe at or before their start (like a single copy trim);
+    otherwise each clip window is re-encoded for frame-accurate cuts.
+    """
+    copy = settings.TRIM_MODE == "copy" and bool(keyframes)
+    if copy:
+        clips = [(_keyframe_at_or_before(keyframes, start), end, path) for start, end, path in clips]
+    for window in _demux_windows(clips):
+        # A copy seek is nudged past ffprobe's rounding so it lands on the
+        # keyframe at the window start, and so are the keyframe cuts after it
+        nudge = KEYFRAME_EPSILON if copy else 0.0
+        base = window[0][0] + nudge
+        threads = str(max(1, task_threads() // len(window)))
+        cmd = ["ffmpeg", "-y", "-ss", _ts(base), "-i", input_path]
+        for start, end, output_path in window:
+            cmd += ["-map", "0:v?", "-map", "0:a?"]
+            if start - base - nudge > 0:
+                cmd += ["-ss", _ts(start - base - nudge)]
+            cmd += ["-to", _ts(end - base)]
+            if copy:
+                cmd += ["-c", "copy"]
+            else:
+                cmd += ["-c:v", "libx264", "-preset", "fast", "-threads", threads, "-c:a", "aac"]
+            cmd.append(output_path)
+        _run_ffmpeg_logged(cmd)
+    logger.info(f"Batch trimmed {len(clips)} clips from {input_path}")
+
+
+def get_video_metadata(filepath: str) -> Tuple[int, float]:
+    """
+    Return file size in bytes and duration in seconds (cached ffprobe)
+    """
+    info = probe.probe(filepath)
+    return info["size"], info["duration"]
 
 
 RESOLUTIONS = {
@@ -70,99 +270,348 @@ RESOLUTIONS = {
     "480p": "854x480",
 }
 
-def generate_multi_quality_videos(input_path: str, output_dir: str) -> List[Dict]:
+def _gop_args(gop: Optional[float]) -> List[str]:
     """
-    Generate multiple resolutions of the input video using FFmpeg.
-    Returns a list of dicts with filepath and resolution.
+    Force a keyframe every gop seconds and disable scene-cut keyframes, so
+    every rendition has IDR frames at the same timestamps and adaptive
+    packages can be cut at identical segment boundaries.
     """
-    os.makedirs(output_dir, exist_ok=True)
-    tasks = []
-
-    for quality, res in RESOLUTIONS.items():
-        filename = os.path.splitext(os.path.basename(input_path))[0]
-        output_path = os.path.join(output_dir, f"{filename}_{quality}.mp4")
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-i", input_path,
-            "-vf", f"scale={res}",
-            "-c:a", "aac",
+    if not gop:
+        return []
+    return ["-force_key_frames", f"expr:gte(t,n_forced*{gop:g})", "-sc_threshold", "0"]
+
+
+def _build_ladder_cmd(input_path: str, renditions: List[Tuple[str, str, str]],
+                      input_args: Optional[List[str]] = None, audio: bool = True,
+                      gop: Optional[float] = None) -> List[str]:
+    """
+    Build a single ffmpeg command that decodes the input once and fans the
+    decoded frames out to every rendition via split + scale.
+    renditions: list of (quality, "WxH", output_path)
+    input_args: extra options placed before -i (e.g. -ss/-t for a segment)
+    audio: encode audio too; segments are video-only and get audio at concat
+    gop: align keyframes across renditions every gop seconds (see _gop_args)
+    """
+    labels = "".join(f"[v{i}]" for i in range(len(renditions)))
+    graph = [f"[0:v]split={len(renditions)}{labels}"]
+    for i, (_, res, _) in enumerate(renditions):
+        graph.append(f"[v{i}]scale={res.replace('x', ':')}[out{i}]")
+
+    # The task's thread allowance is shared by the encoders running side by side
+    threads = str(max(1, task_threads() // len(renditions)))
+    cmd = ["ffmpeg", "-y", *(input_args or []), "-i", input_path, "-filter_complex", ";".join(graph)]
+    for i, (_, _, output_path) in enumerate(renditions):
+        cmd += ["-map", f"[out{i}]"]
+        # Full renditions are written in the final MP4 layout directly; segments
+        # are intermediate and only the concatenated result needs it.
+        cmd += ["-map", "0:a?", "-c:a", "aac", *mp4_output_args(output_path)] if audio else ["-an"]
+        cmd += [
             "-c:v", "libx264",
             "-preset", "fast",
-            output_path
+            "-threads", threads,
+            *_gop_args(gop),
+            output_path,
         ]
-        # Run asynchronously in thread
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            logger.info(f"FFmpeg stdout: {result.stdout}")
-            if result.stderr:
-                logger.warning(f"FFmpeg stderr: {result.stderr}")
-            logger.info(f"Video trimmed successfully: {output_path}")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFmpeg failed with return code {e.returncode}")
-            logger.error(f"FFmpeg stdout: {e.stdout}")
-            logger.error(f"FFmpeg stderr: {e.stderr}")
-            raise
-        except FileNotFoundError:
-            logger.error("FFmpeg executable not found. Make sure ffmpeg is installed and in PATH.")
-            raise
-        # tasks.append(asyncio.to_thread(subprocess.run, cmd, check=True))
-    
-    # Wait for all tasks
-    # await asyncio.gather(*tasks)
-
-    # Collect results
+    return cmd
+
+
+def generate_multi_quality_videos(input_path: str, output_dir: str, resolutions: Dict[str, str] = None,
+                                  gop: Optional[float] = None) -> List[Dict]:
+    """
+    Generate multiple resolutions of the input video using FFmpeg.
+    resolutions defaults to RESOLUTIONS (quality -> "WxH").
+    gop: force aligned keyframes every gop seconds (needed for packaging).
+
+    The source is decoded once per batch and split into every rendition of
+    that batch inside one filter graph; at most
+    settings.TRANSCODE_MAX_PARALLEL_ENCODERS encoders run at the same time.
+    Returns a list of dicts with quality, filepath, size and elapsed
+    (wall-clock seconds spent producing the rendition).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    filename = os.path.splitext(os.path.basename(input_path))[0]
+    renditions = [
+        (quality, res, os.path.join(output_dir, f"{filename}_{quality}.mp4"))
+        for quality, res in (RESOLUTIONS if resolutions is None else resolutions).items()
+    ]
+
+    cap = max(1, settings.TRANSCODE_MAX_PARALLEL_ENCODERS)
     results = []
-    for quality in RESOLUTIONS.keys():
-        output_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(input_path))[0]}_{quality}.mp4")
-        size = os.path.getsize(output_path)
-        results.append({"quality": quality, "filepath": output_path, "size": size})
+    for i in range(0, len(renditions), cap):
+        batch = renditions[i:i + cap]
+        cmd = _build_ladder_cmd(input_path, batch, gop=gop)
+
+        started = time.monotonic()
+        _run_ffmpeg_logged(cmd)
+        elapsed = round(time.monotonic() - started, 3)
+
+        # All encoders of a batch run in lockstep off the same decode, so they
+        # share the batch's wall-clock time.
+        for quality, _, output_path in batch:
+            size = os.path.getsize(output_path)
+            logger.info(f"Rendition {quality} generated in {elapsed}s: {output_path}")
+            results.append({"quality": quality, "filepath": output_path, "size": size, "elapsed": elapsed})
     return results
 
 
-def get_version_file(video_id: int, quality: str) -> FileResponse:
+def plan_segments(keyframes: List[float], duration: float, target: float) -> List[Tuple[float, float]]:
     """
-    Return the requested video version file if it exists.
+    Split [0, duration) into ~target second segments whose boundaries fall on
+    keyframes, so each segment can be decoded independently.
     """
-    db = SessionLocal()
-    version = (
-        db.query(VideoVersion)
-        .filter(VideoVersion.video_id == video_id, VideoVersion.quality == quality)
-        .first()
-    )
+    bounds = [0.0]
+    for kf in keyframes:
+        if kf - bounds[-1] >= target and duration - kf >= target / 2:
+            bounds.append(kf)
+    bounds.append(duration)
+    return list(zip(bounds, bounds[1:]))
+
+
+def segment_input_args(start: float, end: float) -> List[str]:
+    return ["-ss", f"{start:.6f}", "-t", f"{end - start:.6f}"]
+
+
+def encode_ladder_segment(input_path: str, start: float, end: float, renditions: List[Tuple[str, str, str]],
+                          gop: Optional[float] = None):
+    """Encode [start, end) of the source to every rendition (video only)."""
+    _run_ffmpeg_logged(_build_ladder_cmd(input_path, renditions, input_args=segment_input_args(start, end),
+                                         audio=False, gop=gop))
+
+
+def concat_segments(pieces: List[str], source_path: str, output_path: str, audio_codec: str = "aac"):
+    """
+    Join video-only segments with the concat demuxer (no re-encode) and mux
+    the source's audio track back in, encoded once over the full length.
+    """
+    concat_list = f"{output_path}.segments.txt"
+    with open(concat_list, "w") as f:
+        f.writelines(f"file '{p}'\n" for p in pieces)
+    try:
+        _run_ffmpeg_logged([
+            "ffmpeg", "-y",
+            "-f", "concat", "-safe", "0", "-i", concat_list,
+            "-i", source_path,
+            "-map", "0:v", "-map", "1:a?",
+            "-c:v", "copy", "-c:a", audio_codec,
+            *mp4_output_args(output_path),
+            output_path,
+        ])
+    finally:
+        os.remove(concat_list)
+
+
+def package_adaptive(renditions: List[Tuple[str, str]], output_dir: str,
+                     segment_duration: float, hls_segment_type: str = "fmp4") -> Dict[str, str]:
+    """
+    Package already-encoded MP4 renditions for adaptive streaming, stream copy
+    only (no re-encode). The renditions must share keyframe timestamps
+    (encode them with gop=segment_duration) so every variant is cut at the
+    same boundaries and players can switch quality between any two segments.
+    renditions: list of (quality, filepath), highest quality first
+
+    Layout under output_dir:
+      hls/master.m3u8, hls/<quality>/index.m3u8 + segments, hls/audio/...
+      dash/manifest.mpd + init/chunk segments per representation
+    Returns {"hls": master playlist path, "dash": manifest path}.
+    """
+    has_audio = probe.probe(renditions[0][1])["audio_codec"] is not None
+    inputs = []
+    for _, path in renditions:
+        inputs += ["-i", path]
+
+    # HLS: one variant playlist per rendition, audio muxed once as a shared
+    # rendition group instead of being duplicated into every variant.
+    hls_dir = os.path.join(output_dir, "hls")
+    os.makedirs(hls_dir, exist_ok=True)
+    maps, stream_map = [], []
+    if has_audio:
+        maps += ["-map", "0:a"]
+        stream_map.append("a:0,agroup:audio,name:audio")
+    for i, (quality, _) in enumerate(renditions):
+        maps += ["-map", f"{i}:v"]
+        stream_map.append(f"v:{i},{'agroup:audio,' if has_audio else ''}name:{quality}")
+    if hls_segment_type == "fmp4":
+        segment_args = ["-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4"]
+        segment_name = "seg_%05d.m4s"
+    else:
+        segment_args = ["-hls_segment_type", "mpegts"]
+        segment_name = "seg_%05d.ts"
+    for quality, _ in renditions:
+        os.makedirs(os.path.join(hls_dir, quality), exist_ok=True)
+    if has_audio:
+        os.makedirs(os.path.join(hls_dir, "audio"), exist_ok=True)
+    _run_ffmpeg_logged([
+        "ffmpeg", "-y", *inputs, *maps,
+        "-c", "copy",
+        "-f", "hls",
+        "-hls_time", f"{segment_duration:g}",
+        "-hls_playlist_type", "vod",
+        "-hls_flags", "independent_segments",
+        *segment_args,
+        "-hls_segment_filename", os.path.join(hls_dir, "%v", segment_name),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", " ".join(stream_map),
+        os.path.join(hls_dir, "%v", "index.m3u8"),
+    ])
+
+    # DASH: video representations in one adaptation set, audio in another.
+    dash_dir = os.path.join(output_dir, "dash")
+    os.makedirs(dash_dir, exist_ok=True)
+    maps = []
+    for i in range(len(renditions)):
+        maps += ["-map", f"{i}:v"]
+    if has_audio:
+        maps += ["-map", "0:a"]
+    manifest = os.path.join(dash_dir, "manifest.mpd")
+    _run_ffmpeg_logged([
+        "ffmpeg", "-y", *inputs, *maps,
+        "-c", "copy",
+        "-f", "dash",
+        "-seg_duration", f"{segment_duration:g}",
+        "-use_template", "1",
+        "-use_timeline", "1",
+        "-adaptation_sets", "id=0,streams=v id=1,streams=a" if has_audio else "id=0,streams=v",
+        "-init_seg_name", "init-$RepresentationID$.m4s",
+        "-media_seg_name", "chunk-$RepresentationID$-$Number%05d$.m4s",
+        manifest,
+    ])
+
+    logger.info(f"Packaged {len(renditions)} renditions as HLS + DASH under {output_dir}")
+    return {"hls": os.path.join(hls_dir, "master.m3u8"), "dash": manifest}
+
+
+async def get_version_file(request: Request, db: AsyncSession, video_id: int, quality: str) -> Response:
+    """
+    Return the requested video version file if it exists, with range and
+    conditional request support (see app.services.file_serving).
+    """
+    version = await AsyncVideoRepository(db).get_version(video_id, quality)
 
     if not version:
         raise HTTPException(status_code=404, detail="Video version not found")
 
-    return FileResponse(
-        path=version.filepath,
+    return file_serving.serve_file(
+        request,
+        version.filepath,
+        size=version.size,
+        mtime=version.mtime,
+        media_type="video/mp4",
         filename=f"{quality}_{video_id}.mp4",
-        media_type="video/mp4"
+    )
+
+# Adaptive packages live in a directory per generation, so everything under
+# one package id is immutable and can be cached forever by clients and CDNs.
+PACKAGE_MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mpd": "application/dash+xml",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".ts": "video/mp2t",
+}
+PACKAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def package_dir(video_filepath: str, video_id: int, package_id: str = "") -> str:
+    """Directory holding the adaptive packages of a video (or one of them)."""
+    return os.path.join(os.path.dirname(video_filepath), "packages", str(video_id), package_id)
+
+
+def get_package_file(request: Request, video_filepath: str, video_id: int, package_id: str, path: str) -> Response:
+    """
+    Serve a playlist, manifest or segment of an adaptive package. path is
+    relative to the package directory and may not escape it.
+    """
+    root = os.path.realpath(package_dir(video_filepath, video_id, package_id))
+    target = os.path.realpath(os.path.join(root, path))
+    media_type = PACKAGE_MEDIA_TYPES.get(os.path.splitext(target)[1])
+    if (not package_id.replace("-", "").isalnum() or not target.startswith(root + os.sep)
+            or media_type is None or not os.path.isfile(target)):
+        raise HTTPException(status_code=404, detail="Package file not found")
+
+    return file_serving.serve_file(
+        request,
+        target,
+        media_type=media_type,
+        headers={"Cache-Control": PACKAGE_CACHE_CONTROL},
+    )
+
+
+# Thumbnails are regenerated in place under the same names, so they are
+# only cached briefly.
+THUMBNAIL_CACHE_CONTROL = "public, max-age=300"
+
+
+def thumbnail_dir(video_filepath: str, video_id: int) -> str:
+    """Directory holding the thumbnails of a video (thumb_00.jpg, thumb_01.jpg, ...)."""
+    return os.path.join(os.path.dirname(video_filepath), "thumbnails", str(video_id))
+
+
+def thumbnail_times(duration: Optional[float], count: int) -> List[float]:
+    """count evenly spaced timestamps, centred in equal slices so none falls on the first or last frame."""
+    if not duration or duration <= 0:
+        return [0.0]
+    return [round(duration * (i + 0.5) / count, 3) for i in range(count)]
+
+
+def generate_thumbnails(input_path: str, output_dir: str, duration: Optional[float],
+                        count: int = None, width: int = None) -> List[Dict]:
+    """
+    Grab one JPEG frame at each of thumbnail_times(), scaled to width.
+    Input seeking (-ss before -i) decodes only from the nearest keyframe,
+    so each grab costs a fraction of a second whatever the video length.
+    """
+    count = count or settings.THUMBNAIL_COUNT
+    width = width or settings.THUMBNAIL_WIDTH
+    os.makedirs(output_dir, exist_ok=True)
+
+    thumbnails = []
+    for index, ts in enumerate(thumbnail_times(duration, count)):
+        path = os.path.join(output_dir, f"thumb_{index:02d}.jpg")
+        with storage.atomic_output(path) as temp_path:
+            _run_ffmpeg_logged([
+                "ffmpeg", "-y",
+                "-ss", f"{ts:.3f}",
+                "-i", input_path,
+                "-frames:v", "1",
+                "-vf", f"scale={width}:-2",
+                "-q:v", "3",
+                temp_path,
+            ])
+        thumbnails.append({"index": index, "time": ts, "filepath": path, "size": os.path.getsize(path)})
+
+    logger.info(f"Generated {len(thumbnails)} thumbnails under {output_dir}")
+    return thumbnails
+
+
+def get_thumbnail_file(request: Request, video_filepath: str, video_id: int, index: int) -> Response:
+    """Serve one thumbnail of a video (404 until the thumbnails step has run)."""
+    path = os.path.join(thumbnail_dir(video_filepath, video_id), f"thumb_{index:02d}.jpg")
+    if index < 0 or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+
+    return file_serving.serve_file(
+        request,
+        path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": THUMBNAIL_CACHE_CONTROL},
     )
 
 def get_video_aspect(video_path):
-    """Return aspect ratio (width/height) of video using ffprobe"""
-    cmd = [
-        "ffprobe", "-v", "error",
-        "-select_streams", "v:0",
-        "-show_entries", "stream=width,height",
-        "-of", "json",
-        video_path
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    info = json.loads(result.stdout)
-    width = info["streams"][0]["width"]
-    height = info["streams"][0]["height"]
-    return width / height
+    """Return aspect ratio (width/height) of video (cached ffprobe)"""
+    info = probe.probe(video_path)
+    return info["width"] / info["height"]
 
 
 
-def add_image_watermark(video_path:str, watermark_path:str, position="top-right"):
+def add_image_watermark(video_path:str, watermark_path:str, position="top-right", aspect_ratio: float = None,
+                        output_path: str = None):
     """
     Add a PNG watermark to a video with dynamic scaling and positioning.
 
     position: "top-left", "top-right", "bottom-left", "bottom-right"
     scale_ratio: proportion of video width (0.3 = 30%, 0.5 = 50%)
+    aspect_ratio: width/height if already known (e.g. from the Video row); probed otherwise
+    output_path: write the result there instead of replacing video_path
     """
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"Video not found: {video_path}")
@@ -170,8 +619,9 @@ def add_image_watermark(video_path:str, watermark_path:str, position="top-right"
         raise FileNotFoundError(f"Watermark not found: {watermark_path}")
     try:
         # Decide scale ratio dynamically
-        logger.info(f"Calculating aspect ratio for {video_path}")
-        aspect_ratio = get_video_aspect(video_path)
+        if aspect_ratio is None:
+            logger.info(f"Calculating aspect ratio for {video_path}")
+            aspect_ratio = get_video_aspect(video_path)
         if aspect_ratio >= 1:  # Landscape (width >= height)
             scale_ratio = 0.4
         else:  # Portrait / reel format
@@ -187,7 +637,7 @@ def add_image_watermark(video_path:str, watermark_path:str, position="top-right"
         if position not in pos_map:
             raise ValueError(f"Invalid position '{position}', choose from {list(pos_map.keys())}")
 
-        temp_output = os.path.splitext(video_path)[0] + "_watermarked.mp4"
+        temp_output = output_path or os.path.splitext(video_path)[0] + "_watermarked.mp4"
         ffmpeg_cmd = [
             "ffmpeg", "-y",
             "-i", video_path,
@@ -200,9 +650,10 @@ def add_image_watermark(video_path:str, watermark_path:str, position="top-right"
             temp_output
         ]
 
-        subprocess.run(ffmpeg_cmd, check=True)
-        os.replace(temp_output, video_path)  # Overwrite original
-        print(f"✅ Watermarked video saved to {video_path}")
+        run_ffmpeg(ffmpeg_cmd)
+        if output_path is None:
+            os.replace(temp_output, video_path)  # Overwrite original
+        logger.info(f"Watermarked video saved to {output_path or video_path}")
     except subprocess.CalledProcessError as e:
         logger.error(f"❌ FFmpeg error: {e.stderr}",exc_info=True)
         raise
@@ -211,9 +662,11 @@ def add_image_watermark(video_path:str, watermark_path:str, position="top-right"
         raise
 
 
-def apply_overlays(kind: OverlayKind, overlay_params: OverlayParams, input_video_path: str, overlay_asset_path: str):
+def apply_overlays(kind: OverlayKind, overlay_params: OverlayParams, input_video_path: str, overlay_asset_path: str,
+                   output_path: str = None):
     """
     Validate -> save OverlayConfig row -> schedule background ffmpeg processing (or run sync)
+    output_path: write the result there instead of replacing input_video_path
     """
 
     try:
@@ -223,20 +676,24 @@ def apply_overlays(kind: OverlayKind, overlay_params: OverlayParams, input_video
                                 position=overlay_params.position,
                                 start=overlay_params.start_time,
                                 end=overlay_params.end_time,
+                                output_path=output_path,
                                 )
         elif kind == OverlayKind.IMAGE:
             add_image_overlay(str(input_video_path), str(overlay_asset_path),
                                 position=overlay_params.position,
                                 start=overlay_params.start_time,
-                                end=overlay_params.end_time)
+                                end=overlay_params.end_time,
+                                output_path=output_path)
         elif kind == OverlayKind.VIDEO:
             add_video_overlay(str(input_video_path), str(overlay_asset_path),
                                 position=overlay_params.position,
                                 start=overlay_params.start_time,
-                                end=overlay_params.end_time,)
+                                end=overlay_params.end_time,
+                                output_path=output_path)
         # here you may want to create a VideoVersion entry that points to this output_path
         # or do something like move it to final storage / create DB row
         # e.g., create VideoVersion(...) and save
     except Exception as exc:
         # TODO: update overlay row with error or logging
-        logger.error(f"Overlay job failed:{exc}", exc_info=True)
\ No newline at end of file
+        logger.error(f"Overlay job failed:{exc}", exc_info=True)
+        raise
\ No newline at end of file
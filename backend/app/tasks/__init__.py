@@ -1 +1 @@
-from . import video
+from . import video, maintenance, pipeline
@@ -1,6 +1,13 @@
+import os
+import signal
+
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_process_init, worker_shutdown
 from kombu import Queue
 from app.core.config import settings
+from app.services import process_runner
+from app.services.ffmpeg_utils import set_task_threads
+from app.tasks.routing import PRIORITY_NORMAL, QUEUES, QUEUE_FAST, TASK_ROUTES
 
 
 celery = Celery(
@@ -18,17 +25,67 @@ celery.conf.update(
     enable_utc=True,
     task_acks_late=True,
     worker_prefetch_multiplier=1,
+    # Per-message priorities on the Redis broker (0 = first, 9 = last)
+    broker_transport_options={"queue_order_strategy": "priority", "priority_steps": list(range(10))},
+    task_default_priority=PRIORITY_NORMAL,
 )
 
-# Define queues
-celery.conf.task_queues = (
-    Queue("video_jobs"),
-)
+# Define queues (cost classes, see app.tasks.routing)
+celery.conf.task_queues = tuple(Queue(name) for name in QUEUES)
+celery.conf.task_default_queue = QUEUE_FAST
+
+# Route tasks to queues; API enqueues pass an explicit queue from route_for()
+celery.conf.task_routes = TASK_ROUTES
 
-# Route tasks to queues
-celery.conf.task_routes = {
-    "app.tasks.*": {"queue": "video_jobs"},
+# Periodic tasks (run `celery beat` alongside the workers)
+celery.conf.beat_schedule = {
+    "archive-finished-jobs": {
+        "task": "app.tasks.maintenance.archive_jobs",
+        "schedule": settings.JOB_CLEANUP_INTERVAL,
+    },
 }
 
+@worker_process_init.connect
+def _kill_children_on_terminate(**kwargs):
+    """
+    revoke(terminate=True) SIGTERMs the pool process running the task.
+    ffmpeg children run in their own session and would outlive it, so kill
+    their process groups first, then die with the default handler.
+    """
+    def handler(signum, frame):
+        process_runner.kill_active()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+@worker_shutdown.connect
+def _kill_children_on_shutdown(**kwargs):
+    """
+    worker_process_init never fires under --pool=threads: ffmpeg children
+    are then started by the worker process itself, and a cold shutdown
+    leaves the tasks running them behind. Kill what is left on the way out.
+    """
+    process_runner.kill_active()
+
+
+@task_prerun.connect
+def _declare_ffmpeg_threads(task=None, **kwargs):
+    """
+    Tasks declare their ffmpeg thread count with the ffmpeg_threads task
+    option (default FFMPEG_THREADS); each ffmpeg run of the task is capped
+    to it and reserves that many cores of the worker's core budget. With
+    --pool=threads this admits concurrent tasks until the cores are used
+    up (see app.services.core_budget).
+    """
+    set_task_threads(getattr(task, "ffmpeg_threads", None))
+
+
+@task_postrun.connect
+def _clear_ffmpeg_threads(**kwargs):
+    set_task_threads(None)
+
+
 # Autodiscover tasks inside app.tasks
 celery.autodiscover_tasks(["app.tasks"], force=True)
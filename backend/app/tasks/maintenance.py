@@ -0,0 +1,37 @@
+# app/tasks/maintenance.py
+from datetime import datetime, timedelta, timezone
+
+from app.tasks.celery_app import celery
+from app.db.session import SessionLocal
+from app.core.config import settings
+from app.repositories.job_repo import JobRepository
+from app.log import logger
+
+
+@celery.task(name="app.tasks.maintenance.archive_jobs")
+def archive_jobs_task(retention_days: float = None, batch_size: int = None) -> int:
+    """
+    Periodic (celery beat) cleanup: move finished jobs older than
+    JOB_RETENTION_DAYS to jobs_archive, one short transaction per batch so
+    the sweep never holds many row locks at once. Returns rows moved.
+    """
+    retention_days = settings.JOB_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or settings.JOB_ARCHIVE_BATCH_SIZE
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+
+    db = SessionLocal()
+    total = 0
+    try:
+        repo = JobRepository(db)
+        while True:
+            moved = repo.archive_finished(cutoff, batch_size)
+            total += moved
+            if moved < batch_size:
+                break
+    except Exception as e:
+        logger.error(f"Error archiving jobs: {e}", exc_info=True)
+    finally:
+        db.close()
+
+    logger.info(f"Archived {total} jobs created before {cutoff.isoformat()}")
+    return total
@@ -0,0 +1,183 @@
+# app/tasks/pipeline.py
+"""
+Upload pipelines: post-processing steps requested with an upload and run
+as a Celery canvas, without a client round trip (and queue wait) between
+steps.
+
+A pipeline is a PIPELINE job whose meta["steps"] maps each PipelineStep to
+the job running it; PROBE is the upload job itself. STEP_DEPENDENCIES is
+the DAG: a step is sent once every step it depends on that is part of the
+pipeline succeeded, and is failed as skipped when one of them failed.
+
+advance_pipeline_task steers it. It is chained after the upload and runs
+again after every stage: it sends the steps that became ready (several at
+once as a chord, so independent steps run in parallel on their own
+queues, with advance_pipeline_task as the callback) and, once every step
+has finished, completes the pipeline job. Each step's result stays on its
+own job; the pipeline job mirrors their statuses in meta["step_status"].
+A pipeline still waiting on a step PIPELINE_TIMEOUT seconds after it was
+created is failed along with the steps still in flight.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from celery import chain, chord
+from celery.exceptions import Retry
+
+from app.tasks.celery_app import celery
+from app.db.session import SessionLocal
+from app.core.config import settings
+from app.enums.job_status import JobStatus
+from app.enums.pipeline_step import PipelineStep
+from app.enums.task_type import TaskType
+from app.repositories.job_repo import JobRepository
+from app.repositories.video_repo import VideoRepository
+from app.tasks.routing import route_for
+from app.tasks.video import add_watermark_task, generate_thumbnails_task, generate_versions_task
+from app.log import logger
+
+# Steps each step waits for, in a valid execution order
+STEP_DEPENDENCIES = {
+    PipelineStep.PROBE: (),
+    # Rewrites the file in place, so it runs alone, before every step reading it
+    PipelineStep.WATERMARK: (PipelineStep.PROBE,),
+    PipelineStep.RENDITIONS: (PipelineStep.PROBE, PipelineStep.WATERMARK),
+    PipelineStep.THUMBNAILS: (PipelineStep.PROBE, PipelineStep.WATERMARK),
+}
+
+# Task type of the job running each step
+STEP_TASK_TYPES = {
+    PipelineStep.PROBE: TaskType.UPLOAD,
+    PipelineStep.WATERMARK: TaskType.WATERMARK,
+    PipelineStep.RENDITIONS: TaskType.TRANSCODE,
+    PipelineStep.THUMBNAILS: TaskType.THUMBNAILS,
+}
+
+IN_FLIGHT = (JobStatus.PENDING.value, JobStatus.RUNNING.value)
+
+
+def _value(v):
+    return getattr(v, "value", v)
+
+
+def _timed_out(pipeline) -> bool:
+    if not pipeline.created_at:
+        return False
+    return (datetime.now(timezone.utc) - pipeline.created_at).total_seconds() > settings.PIPELINE_TIMEOUT
+
+
+def plan_next(statuses: Dict[PipelineStep, str]) -> Tuple[List[PipelineStep], Dict[PipelineStep, PipelineStep]]:
+    """
+    Given the status of every step of a pipeline, return the PENDING steps
+    whose dependencies all succeeded, and the PENDING steps to skip mapped
+    to the failed step they depend on (directly or through a skipped one).
+    """
+    statuses = dict(statuses)
+    ready, skipped = [], {}
+    for step, deps in STEP_DEPENDENCIES.items():
+        if statuses.get(step) != JobStatus.PENDING.value:
+            continue
+        deps = [dep for dep in deps if dep in statuses]
+        failed = next((dep for dep in deps if statuses[dep] == JobStatus.FAILED.value), None)
+        if failed is not None:
+            skipped[step] = skipped.get(failed, failed)
+            statuses[step] = JobStatus.FAILED.value
+        elif all(statuses[dep] == JobStatus.SUCCESS.value for dep in deps):
+            ready.append(step)
+    return ready, skipped
+
+
+def _step_signature(step: PipelineStep, video, job_id: str, meta: dict):
+    if step == PipelineStep.WATERMARK:
+        sig = add_watermark_task.si(video.id, meta["watermark_path"], job_id)
+    elif step == PipelineStep.RENDITIONS:
+        sig = generate_versions_task.si(video.id, job_id, package=meta.get("package", False))
+    elif step == PipelineStep.THUMBNAILS:
+        sig = generate_thumbnails_task.si(video.id, job_id)
+    else:
+        raise ValueError(f"Pipeline step {step.value} cannot be dispatched")
+    return sig.set(task_id=job_id, **route_for(STEP_TASK_TYPES[step], video.duration))
+
+
+@celery.task(bind=True, name="app.tasks.pipeline.advance", max_retries=None)
+def advance_pipeline_task(self, pipeline_job_id: str):
+    db = SessionLocal()
+    j_repo = JobRepository(db)
+    v_repo = VideoRepository(db)
+
+    try:
+        pipeline = j_repo.find(pipeline_job_id)
+        if not pipeline or _value(pipeline.status) not in IN_FLIGHT:
+            return
+        meta = pipeline.meta or {}
+        step_jobs = {PipelineStep(step): j_repo.find(job_id) for step, job_id in meta["steps"].items()}
+        statuses = {step: _value(job.status) if job else JobStatus.FAILED.value for step, job in step_jobs.items()}
+
+        ready, skipped = plan_next(statuses)
+        for step, failed in skipped.items():
+            j_repo.update_status(
+                job_id=step_jobs[step].id,
+                status=JobStatus.FAILED.value,
+                meta={"error": f"Skipped: pipeline step {failed.value} failed"}
+            )
+            statuses[step] = JobStatus.FAILED.value
+
+        sent = j_repo.record_dispatch(pipeline_job_id, [step.value for step in ready])
+        if sent:
+            video_id = (step_jobs[PipelineStep.PROBE].meta or {})["video_id"]
+            video = v_repo.get_video(video_id)
+            if not video:
+                raise ValueError(f"Video {video_id} not found")
+            for step in sent:
+                j_repo.update_status(step_jobs[PipelineStep(step)].id, JobStatus.PENDING.value, video_id=video.id)
+            j_repo.update_status(
+                job_id=pipeline_job_id,
+                status=JobStatus.RUNNING.value,
+                meta={"video_id": video.id, "step_status": {s.value: st for s, st in statuses.items()}},
+                video_id=video.id,
+            )
+
+            header = [_step_signature(PipelineStep(step), video, step_jobs[PipelineStep(step)].id, meta) for step in sent]
+            callback = advance_pipeline_task.si(pipeline_job_id)
+            if len(header) == 1:
+                chain(header[0], callback).apply_async()
+            else:
+                chord(header)(callback)
+            logger.info(f"Pipeline {pipeline_job_id}: dispatched {', '.join(sent)} for video {video.id}")
+            return
+
+        step_status = {s.value: st for s, st in statuses.items()}
+        if any(st in IN_FLIGHT for st in statuses.values()):
+            if not _timed_out(pipeline):
+                # A step outlived its task (a segment-parallel encode finishes in
+                # its own chord) or was redelivered: look again later.
+                j_repo.update_status(pipeline_job_id, JobStatus.RUNNING.value, meta={"step_status": step_status})
+                raise self.retry(countdown=settings.PIPELINE_POLL_INTERVAL)
+            for step, st in statuses.items():
+                if st in IN_FLIGHT:
+                    j_repo.update_status(
+                        job_id=step_jobs[step].id,
+                        status=JobStatus.FAILED.value,
+                        meta={"error": f"Timed out: pipeline still waiting after {settings.PIPELINE_TIMEOUT:g}s"}
+                    )
+                    statuses[step] = JobStatus.FAILED.value
+            step_status = {s.value: st for s, st in statuses.items()}
+
+        failed = [s.value for s, st in statuses.items() if st == JobStatus.FAILED.value]
+        j_repo.update_status(
+            job_id=pipeline_job_id,
+            status=JobStatus.FAILED.value if failed else JobStatus.SUCCESS.value,
+            meta={"step_status": step_status, "failed_steps": failed}
+        )
+        logger.info(f"Pipeline {pipeline_job_id} finished" + (f", failed steps: {', '.join(failed)}" if failed else ""))
+    except Retry:
+        raise
+    except Exception as e:
+        logger.error(f"Error advancing pipeline {pipeline_job_id}: {e}", exc_info=True)
+        j_repo.update_status(
+            job_id=pipeline_job_id,
+            status=JobStatus.FAILED.value,
+            meta={"error": str(e)}
+        )
+    finally:
+        db.close()
@@ -0,0 +1,98 @@
+# app/tasks/routing.py
+"""
+Queues by cost class and the routing of jobs onto them.
+
+Every job is sent with an explicit queue and priority from route_for(),
+chosen from its TaskType and an estimate of how long it will run (media
+seconds to process x a per-task cost factor), so short jobs never wait
+behind long encodes:
+
+  video_fast   short trims and short encodes, high priority
+  video_heavy  long transcodes / overlays / segment encodes
+  video_io     upload probing, segment concatenation, pipeline steering,
+               housekeeping
+
+Tasks sent without an explicit route (chord parts, beat) go by name
+through TASK_ROUTES. Priorities use the Redis transport's ordering:
+0 is served first, 9 last.
+"""
+from typing import Optional
+
+from app.core.config import settings
+from app.enums.task_type import TaskType
+
+QUEUE_FAST = "video_fast"
+QUEUE_HEAVY = "video_heavy"
+QUEUE_IO = "video_io"
+QUEUES = (QUEUE_FAST, QUEUE_HEAVY, QUEUE_IO)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+# Rough wall-clock seconds of work per second of media
+TASK_COST = {
+    TaskType.TRIM: 0.05,  # smart/copy trims only re-encode the boundary GOPs
+    TaskType.BATCH_TRIM: 0.05,
+    TaskType.TRANSCODE: 1.5,  # whole ladder
+    TaskType.TEXT_OVERLAY: 0.5,
+    TaskType.IMAGE_OVERLAY: 0.5,
+    TaskType.VIDEO_OVERLAY: 0.7,
+    TaskType.COMPOSITE_OVERLAY: 0.8,
+    TaskType.WATERMARK: 0.5,
+    TaskType.THUMBNAILS: 0.01,  # a few keyframe-seeked single-frame grabs
+}
+
+# Queue of each task type when its duration is unknown
+DEFAULT_QUEUES = {
+    TaskType.UPLOAD: QUEUE_IO,
+    TaskType.TRIM: QUEUE_FAST,
+    TaskType.BATCH_TRIM: QUEUE_FAST,
+    TaskType.THUMBNAILS: QUEUE_FAST,
+}
+
+TASK_ROUTES = {
+    "app.tasks.video.process_upload": {"queue": QUEUE_IO},
+    "app.tasks.video.trim_video": {"queue": QUEUE_FAST},
+    "app.tasks.video.batch_trim": {"queue": QUEUE_FAST},
+    "app.tasks.video.segments_failed": {"queue": QUEUE_FAST},
+    "app.tasks.video.concat_segments": {"queue": QUEUE_IO},
+    "app.tasks.video.generate_thumbnails": {"queue": QUEUE_FAST},
+    "app.tasks.pipeline.*": {"queue": QUEUE_IO},
+    "app.tasks.maintenance.*": {"queue": QUEUE_IO},
+    "app.tasks.*": {"queue": QUEUE_HEAVY},
+}
+
+
+def estimate_seconds(task_type: TaskType, media_seconds: Optional[float]) -> Optional[float]:
+    if not media_seconds or task_type not in TASK_COST:
+        return None
+    return media_seconds * TASK_COST[task_type]
+
+
+def _priority(estimate: Optional[float]) -> int:
+    if estimate is None:
+        return PRIORITY_NORMAL
+    if estimate <= 30:
+        return PRIORITY_HIGH
+    if estimate <= 300:
+        return 3
+    if estimate <= 1800:
+        return 6
+    return PRIORITY_LOW
+
+
+def route_for(task_type: TaskType, media_seconds: Optional[float] = None) -> dict:
+    """
+    apply_async() routing options (queue, priority) for a job of task_type
+    over media_seconds of media (the clip for trims, the source otherwise).
+    """
+    task_type = TaskType(task_type)
+    estimate = estimate_seconds(task_type, media_seconds)
+    if task_type in (TaskType.UPLOAD, TaskType.PIPELINE):
+        return {"queue": QUEUE_IO, "priority": PRIORITY_HIGH}
+    if estimate is None:
+        queue = DEFAULT_QUEUES.get(task_type, QUEUE_HEAVY)
+    else:
+        queue = QUEUE_FAST if estimate <= settings.FAST_QUEUE_MAX_SECONDS else QUEUE_HEAVY
+    return {"queue": queue, "priority": _priority(estimate)}
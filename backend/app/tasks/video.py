@@ -1,37 +1,183 @@
 # app/tasks/video.py
 import os
+import shutil
+import threading
+import time
+import uuid
+from celery import chord
 from app.tasks.celery_app import celery
-from app.db.session import SessionLocal
-from app.services import video_service
+from app.db.session import SessionLocal, unit_of_work
+from app.core.config import settings
+from app.services import video_service, storage, output_cache, probe
 from app.enums.job_status import JobStatus
+from app.enums.task_type import TaskType
 from app.repositories.video_repo import VideoRepository
 from app.repositories.job_repo import JobRepository
+from app.repositories.blob_repo import BlobRepository
 from app.log import logger
 from app.enums.overlay_kind import OverlayKind
 from app.schemas.overlay import OverlayParams
+from app.db.models.video import OverlayConfig
+from app.services.ffmpeg_utils import compose_overlays, finalize_mp4, progress_reporter
+from sqlalchemy import select
+
+
+def _source_hash(db, video) -> str:
+    """Content hash of a video's file, computed and saved on first use."""
+    if not video.content_hash:
+        video.content_hash = storage.hash_file(video.filepath)[1]
+        db.commit()
+    return video.content_hash
+
+
+def _drop_blob_reference(db, sha256: str, path: str = None):
+    """
+    Release a reference on an upload blob, removing path (a materialized
+    link to it) first. Failing only leaks the blob, so it is logged, not raised.
+    """
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+        BlobRepository(db).release(sha256)
+    except Exception as e:
+        logger.error(f"Could not release blob {sha256}: {e}", exc_info=True)
+
+
+def _keyframes(v_repo, video) -> list:
+    """Keyframe index of a video, built and saved on first use."""
+    if video.keyframes is None:
+        v_repo.set_keyframes(video, probe.keyframe_index(video.filepath))
+    return video.keyframes
+
+
+def _reprobe_in_place(v_repo, video):
+    """
+    Refresh everything derived from a video's file after an in-place
+    re-encode: probe metadata (size, duration, codec, profile), the keyframe
+    index (the new GOPs drive smart trims and segment plans) and the content
+    hash. Call inside the unit of work that completes the job.
+    """
+    v_repo.update_metadata(video, probe.probe(video.filepath))
+    v_repo.set_keyframes(video, probe.keyframe_index(video.filepath))
+    video.content_hash = storage.hash_file(video.filepath)[1]
+
+
+def _stored_probe(video) -> dict:
+    """Probe fields needed by ffmpeg helpers, read from the Video row (None if never probed)."""
+    if not video.probe_info:
+        return None
+    stream = next((s for s in video.probe_info.get("streams", []) if s.get("codec_type") == "video"), {})
+    return {
+        "video_codec": video.video_codec,
+        "audio_codec": video.audio_codec,
+        "pix_fmt": stream.get("pix_fmt"),
+        "video_profile": stream.get("profile"),
+        "video_level": stream.get("level"),
+        "video_time_base": stream.get("time_base"),
+    }
+
+
+# Lease heartbeats of the jobs claimed by runs in this worker process
+_heartbeats: dict = {}
+
+
+def _claim(task, j_repo, job_id: str):
+    """
+    Take the job for this run (JobRepository.claim: atomic move to RUNNING
+    under a lease) and keep the lease alive from a background thread until
+    _release(). Returns the Job, or None when this delivery must do nothing:
+    the job already finished, is leased by another live run, or was already
+    fanned out to segment subtasks. task_acks_late redelivers tasks after a
+    worker crash or deploy; this is what keeps them from running twice.
+    """
+    owner = f"{task.request.hostname or 'worker'}/{uuid.uuid4().hex[:8]}"
+    job = j_repo.claim(job_id, owner, settings.JOB_LEASE_SECONDS)
+    if job is None:
+        logger.info(f"Job {job_id} is finished or running elsewhere, ignoring duplicate delivery")
+        return None
+    if (job.meta or {}).get("mode") == "segmented":
+        logger.info(f"Job {job_id} was already dispatched as segments, ignoring duplicate delivery")
+        return None
+
+    stop = threading.Event()
+    _heartbeats[job_id] = stop
+    threading.Thread(target=_renew_lease, args=(job_id, owner, stop), daemon=True).start()
+    return job
+
+
+def _renew_lease(job_id: str, owner: str, stop: threading.Event):
+    while not stop.wait(settings.JOB_LEASE_SECONDS / 3):
+        db = SessionLocal()
+        try:
+            if not JobRepository(db).renew_lease(job_id, owner, settings.JOB_LEASE_SECONDS):
+                logger.warning(f"Lost the lease on job {job_id}")
+                return
+        except Exception:
+            logger.warning(f"Could not renew the lease on job {job_id}", exc_info=True)
+        finally:
+            db.close()
+
+
+def _release(job_id: str):
+    stop = _heartbeats.pop(job_id, None)
+    if stop:
+        stop.set()
+
+
+def _staged_path(video, job_id: str) -> str:
+    """Where an in-place edit of video is rendered before it replaces the file."""
+    base, ext = os.path.splitext(video.filepath)
+    return f"{base}.{job_id[:8]}.staged{ext}"
+
+
+def _swap_in_place(j_repo, video, job_id: str, staged: str):
+    """
+    Replace the video's file with an edit rendered to staged. The staged
+    path is committed on the job first, so a redelivered run can tell the
+    edit was already applied (see _resume_in_place) instead of applying it
+    a second time to the edited file.
+    """
+    j_repo.update_status(job_id=job_id, status=JobStatus.RUNNING.value, meta={"staged_output": staged})
+    os.replace(staged, video.filepath)
+
+
+def _resume_in_place(job, video) -> bool:
+    """True if an earlier run of the job already rendered its in-place edit; finishes an interrupted swap."""
+    staged = (job.meta or {}).get("staged_output")
+    if not staged:
+        return False
+    if os.path.exists(staged):
+        os.replace(staged, video.filepath)
+    logger.info(f"Job {job.id}: edit already rendered by an earlier run, not applying it again")
+    return True
 
 
 @celery.task(bind=True, name="app.tasks.video.process_upload")
-def process_upload_task(self, filepath: str, filename: str, job_id: str):
+def process_upload_task(self, filepath: str, filename: str, job_id: str, content_hash: str = None):
     db = SessionLocal()
     v_repo = VideoRepository(db)
     j_repo = JobRepository(db)
 
     try:
-        # Extract metadata
-        size = os.path.getsize(filepath)
-
-        # Create video record
-        video = v_repo.create(filename=filename, filepath=filepath, size=size)
-        db.commit()
-
-        # Update job as SUCCESS and link video
-        j_repo.update_status(
-            job_id=job_id,
-            status=JobStatus.SUCCESS.value,
-            meta={"filepath": filepath, "video_id": video.id},
-        )
-        db.commit()
+        if not _claim(self, j_repo, job_id):
+            return
+
+        # Extract metadata (single ffprobe run) and keyframes before touching the DB
+        info = probe.probe(filepath)
+        keyframes = probe.keyframe_index(filepath)
+
+        # Create video record and link it to the job in one transaction
+        with unit_of_work(db):
+            video = v_repo.create(filename=filename, filepath=filepath, size=info["size"], content_hash=content_hash)
+            v_repo.update_metadata(video, info)
+            v_repo.set_keyframes(video, keyframes)
+
+            # Update job as SUCCESS and link video
+            j_repo.update_status(
+                job_id=job_id,
+                status=JobStatus.SUCCESS.value,
+                meta={"filepath": filepath, "video_id": video.id},
+            )
 
     except Exception as e:
         logger.error(f"Error processing upload task: {e}", exc_info=True)
@@ -40,8 +186,11 @@ def process_upload_task(self, filepath: str, filename: str, job_id: str):
             status=JobStatus.FAILED.value,
             meta={"error": str(e)},
         )
-        db.commit()
+        # No video was created to hold the reference taken by the API
+        if content_hash:
+            _drop_blob_reference(db, content_hash, filepath)
     finally:
+        _release(job_id)
         db.close()
 
 
@@ -56,54 +205,242 @@ def trim_video_task(self, video_id: int, start: float, end: float, job_id: str):
         video = v_repo.get_video(video_id)
         if not video:
             raise ValueError(f"Video {video_id} not found")
+        if not _claim(self, j_repo, job_id):
+            return
 
-        # 2. Define trimmed file path
+        # 2. Define trimmed file path (per job, so trims of one video don't clobber each other)
         base, ext = os.path.splitext(video.filepath)
-        trimmed_filepath = f"{base}_trimmed{ext}"
-        logger.info(f"Trimming video {video.filepath} from {start} to {end}, saving to {trimmed_filepath}")
-        # 3. Trim video using ffmpeg
-        video_service.trim_video_ffmpeg(
-            input_path=video.filepath,
-            output_path=trimmed_filepath,
-            start=start,
-            end=end
+        trimmed_filepath = f"{base}_trimmed_{job_id[:8]}{ext}"
+
+        # 3. Reuse a cached trim of the same content/range, else trim using ffmpeg;
+        # the file only appears at trimmed_filepath once complete
+        source_hash = _source_hash(db, video)
+        cache_params = {"start": start, "end": end}
+        cached = output_cache.lookup(db, source_hash, TaskType.TRIM.value, cache_params)
+        with storage.atomic_output(trimmed_filepath) as part:
+            if cached:
+                output_cache.materialize(cached, part)
+            else:
+                logger.info(f"Trimming video {video.filepath} from {start} to {end}, saving to {trimmed_filepath}")
+                with progress_reporter(_publish_progress(self, job_id), duration=end - start):
+                    video_service.trim_video_ffmpeg(
+                        input_path=video.filepath,
+                        output_path=part,
+                        start=start,
+                        end=end,
+                        keyframes=_keyframes(v_repo, video),
+                        info=_stored_probe(video)
+                    )
+            finalize_mp4(part)
+            if not cached:
+                output_cache.store(db, source_hash, TaskType.TRIM.value, cache_params, part)
+
+        # 4. Probe the trimmed file
+        info = probe.probe(trimmed_filepath)
+        keyframes = probe.keyframe_index(trimmed_filepath)
+
+        with unit_of_work(db):
+            # 5. Create new Video record
+            trimmed_video = v_repo.create(
+                filename=f"{video.filename}_trimmed",
+                filepath=trimmed_filepath,
+                size=info["size"],
+                duration=info["duration"],
+                trimmed_from_id=video.id
+            )
+            v_repo.update_metadata(trimmed_video, info)
+            v_repo.set_keyframes(trimmed_video, keyframes)
+
+            # 6. Update job status SUCCESS
+            j_repo.update_status(
+                job_id=job_id,
+                status=JobStatus.SUCCESS.value,
+                meta={"trimmed_video_id": trimmed_video.id, "filepath": trimmed_filepath, "cached": bool(cached)}
+            )
+        logger.info(f"Trim job {job_id} completed successfully.")
+    except Exception as e:
+        logger.error(f"Error trimming video: {e}", exc_info=True)
+        j_repo.update_status(
+            job_id=job_id,
+            status=JobStatus.FAILED.value,
+            meta={"error": str(e)}
         )
+    finally:
+        _release(job_id)
+        db.close()
 
-        # 4. Get size and duration
-        size, duration = video_service.get_video_metadata(trimmed_filepath)
 
-        # 5. Create new Video record
-        trimmed_video = v_repo.create(
-            filename=f"{video.filename}_trimmed",
-            filepath=trimmed_filepath,
-            size=size,
-            duration=duration,
-            trimmed_from_id=video.id
-        )
-        db.commit()
+@celery.task(bind=True, name="app.tasks.video.batch_trim")
+def batch_trim_task(self, video_id: int, ranges: list, job_id: str):
+    """
+    Produce every (start, end) clip of ranges, overlapping clips from one
+    pass over the source. Each clip becomes its own Video row (trimmed_from_id = video_id) and its
+    status is tracked in the parent job's meta["clips"].
+    """
+    db = SessionLocal()
+    v_repo = VideoRepository(db)
+    j_repo = JobRepository(db)
+
+    try:
+        video = v_repo.get_video(video_id)
+        if not video:
+            raise ValueError(f"Video {video_id} not found")
+        if not _claim(self, j_repo, job_id):
+            return
 
-        # 6. Update job status SUCCESS
+        base, ext = os.path.splitext(video.filepath)
+        source_hash = _source_hash(db, video)
+        clips = [
+            {"start": start, "end": end, "status": JobStatus.PENDING.value,
+             "filepath": f"{base}_clip_{job_id[:8]}_{i}{ext}"}
+            for i, (start, end) in enumerate(ranges)
+        ]
+        # Clips are produced at temp names and renamed into place once finalized
+        parts = {clip["filepath"]: storage.part_path(clip["filepath"]) for clip in clips}
+
+        try:
+            # Clips already cut from identical content come from the cache; the
+            # rest are produced together in one ffmpeg pass.
+            to_cut = []
+            for clip in clips:
+                cached = output_cache.lookup(db, source_hash, TaskType.TRIM.value, {"start": clip["start"], "end": clip["end"]})
+                clip["cached"] = bool(cached)
+                if cached:
+                    output_cache.materialize(cached, parts[clip["filepath"]])
+                else:
+                    to_cut.append((clip["start"], clip["end"], parts[clip["filepath"]]))
+            if to_cut:
+                with progress_reporter(_publish_progress(self, job_id), duration=max(c[1] for c in to_cut) - min(c[0] for c in to_cut)):
+                    keyframes = _keyframes(v_repo, video) if settings.TRIM_MODE == "copy" else None
+                    video_service.batch_trim_ffmpeg(video.filepath, to_cut, keyframes=keyframes)
+
+            infos = {}
+            for clip in clips:
+                part = parts[clip["filepath"]]
+                try:
+                    finalize_mp4(part)
+                    if not clip["cached"]:
+                        output_cache.store(db, source_hash, TaskType.TRIM.value, {"start": clip["start"], "end": clip["end"]}, part)
+                    os.replace(part, clip["filepath"])
+                    infos[clip["filepath"]] = probe.probe(clip["filepath"])
+                except Exception as e:
+                    logger.error(f"Batch trim clip {clip['start']}-{clip['end']} failed: {e}", exc_info=True)
+                    clip.update(status=JobStatus.FAILED.value, error=str(e))
+        finally:
+            for part in parts.values():
+                if os.path.exists(part):
+                    os.remove(part)
+
+        # Register every clip and the job result in one transaction
+        with unit_of_work(db):
+            for clip in clips:
+                info = infos.get(clip["filepath"])
+                if info is None:
+                    continue
+                clip_video = v_repo.create(
+                    filename=f"{video.filename}_trimmed",
+                    filepath=clip["filepath"],
+                    size=info["size"],
+                    duration=info["duration"],
+                    trimmed_from_id=video.id
+                )
+                v_repo.update_metadata(clip_video, info)
+                clip.update(status=JobStatus.SUCCESS.value, video_id=clip_video.id)
+
+            succeeded = sum(c["status"] == JobStatus.SUCCESS.value for c in clips)
+            j_repo.update_status(
+                job_id=job_id,
+                status=JobStatus.SUCCESS.value if succeeded else JobStatus.FAILED.value,
+                meta={"clips": clips, "succeeded": succeeded, "failed": len(clips) - succeeded}
+            )
+        logger.info(f"Batch trim job {job_id} finished: {succeeded}/{len(clips)} clips.")
+    except Exception as e:
+        logger.error(f"Error batch trimming video: {e}", exc_info=True)
         j_repo.update_status(
             job_id=job_id,
-            status=JobStatus.SUCCESS.value,
-            meta={"trimmed_video_id": trimmed_video.id, "filepath": trimmed_filepath}
+            status=JobStatus.FAILED.value,
+            meta={"error": str(e)}
         )
-        db.commit()
-        logger.info(f"Trim job {job_id} completed successfully.")
+    finally:
+        _release(job_id)
+        db.close()
+
+
+@celery.task(bind=True, name="app.tasks.video.overlay_video", ffmpeg_threads=settings.FFMPEG_THREADS_HEAVY)
+def overlay_video_task(self, video_id: int, overlay_asset_path: str, overlay_kind: str, overlays_params: dict, job_id: str):
+    db = SessionLocal()
+    v_repo = VideoRepository(db)
+    j_repo = JobRepository(db)
+
+    try:
+        video = v_repo.get_video(video_id)
+        if not video:
+            raise ValueError(f"Video {video_id} not found")
+        job = _claim(self, j_repo, job_id)
+        if not job:
+            return
+
+        base, ext = os.path.splitext(video.filepath)
+        output_path = f"{base}_overlayed{ext}"
+
+        # The edit is rendered next to the file and swapped in, so a
+        # redelivered run never draws the overlay a second time.
+        cached = None
+        if not _resume_in_place(job, video):
+            overlay_kind = OverlayKind(overlay_kind)
+            source_hash = _source_hash(db, video)
+            operation = f"OVERLAY_{overlay_kind.value}"
+            cache_params = {
+                **overlays_params,
+                "asset": storage.hash_file(overlay_asset_path)[1] if overlay_asset_path else None,
+            }
+            staged = _staged_path(video, job_id)
+            cached = output_cache.lookup(db, source_hash, operation, cache_params)
+            if cached:
+                output_cache.materialize(cached, staged)
+            else:
+                with progress_reporter(_publish_progress(self, job_id), duration=video.duration):
+                    video_service.apply_overlays(
+                        overlay_kind,
+                        OverlayParams(**overlays_params),
+                        video.filepath,
+                        overlay_asset_path,
+                        output_path=staged,
+                    )
+            finalize_mp4(staged)
+            if not cached:
+                output_cache.store(db, source_hash, operation, cache_params, staged)
+            _swap_in_place(j_repo, video, job_id, staged)
+        # File was modified in place, so it no longer matches its upload blob
+        upload_hash = video.content_hash
+        with unit_of_work(db):
+            _reprobe_in_place(v_repo, video)
+            j_repo.update_status(
+                job_id=job_id,
+                status=JobStatus.SUCCESS.value,
+                meta={"filepath": output_path, "cached": bool(cached)}
+            )
+        if upload_hash and upload_hash != video.content_hash and video.trimmed_from_id is None:
+            _drop_blob_reference(db, upload_hash)
+
     except Exception as e:
-        logger.error(f"Error trimming video: {e}", exc_info=True)
+        logger.error(f"Error applying overlays: {e}", exc_info=True)
         j_repo.update_status(
             job_id=job_id,
             status=JobStatus.FAILED.value,
             meta={"error": str(e)}
         )
-        db.commit()
     finally:
+        _release(job_id)
         db.close()
 
 
-@celery.task(bind=True, name="app.tasks.video.overlay_video")
-def overlay_video_task(self, video_id: int, overlay_asset_path: str,overlay_kind:OverlayKind ,overlays_params: OverlayParams, job_id: str):
+@celery.task(bind=True, name="app.tasks.video.composite_overlays", ffmpeg_threads=settings.FFMPEG_THREADS_HEAVY)
+def composite_overlays_task(self, video_id: int, overlay_ids: list, job_id: str):
+    """
+    Render the given OverlayConfig rows, in order, onto a video in a single
+    encode and register the result as a new Video derived from the source.
+    """
     db = SessionLocal()
     v_repo = VideoRepository(db)
     j_repo = JobRepository(db)
@@ -112,38 +449,294 @@ def overlay_video_task(self, video_id: int, overlay_asset_path: str,overlay_kind
         video = v_repo.get_video(video_id)
         if not video:
             raise ValueError(f"Video {video_id} not found")
+        if not _claim(self, j_repo, job_id):
+            return
+
+        configs = {o.id: o for o in db.execute(
+            select(OverlayConfig).where(OverlayConfig.id.in_(overlay_ids))
+        ).scalars().all()}
+        missing = [i for i in overlay_ids if i not in configs]
+        if missing:
+            raise ValueError(f"Overlays not found: {missing}")
+        layers = [
+            {"kind": configs[i].kind.value, "params": configs[i].params, "asset_path": configs[i].asset_path}
+            for i in overlay_ids
+        ]
 
         base, ext = os.path.splitext(video.filepath)
-        output_path = f"{base}_overlayed{ext}"
+        output_path = f"{base}_composite_{job_id[:8]}{ext}"
+
+        source_hash = _source_hash(db, video)
+        cache_params = {"layers": [
+            {"kind": l["kind"], "params": l["params"],
+             "asset": storage.hash_file(l["asset_path"])[1] if l["asset_path"] else None}
+            for l in layers
+        ]}
+        cached = output_cache.lookup(db, source_hash, TaskType.COMPOSITE_OVERLAY.value, cache_params)
+        # Video layers have their own timeline, so only pure text/image
+        # composites are split into parallel segments.
+        plan = None
+        if not cached and not any(l["kind"] == "VIDEO" for l in layers):
+            plan = _segment_plan(v_repo, video)
+        if plan:
+            _dispatch_segments(j_repo, video, plan, job_id, "composite", {
+                "layers": layers,
+                "output_path": output_path,
+                "cache_params": cache_params,
+            })
+            return
+
+        with storage.atomic_output(output_path) as part:
+            if cached:
+                output_cache.materialize(cached, part)
+            else:
+                logger.info(f"Compositing {len(layers)} overlays onto {video.filepath}")
+                with progress_reporter(_publish_progress(self, job_id), duration=video.duration):
+                    compose_overlays(video.filepath, part, layers)
+            finalize_mp4(part)
+            if not cached:
+                output_cache.store(db, source_hash, TaskType.COMPOSITE_OVERLAY.value, cache_params, part)
+
+        _register_composite(v_repo, j_repo, video, output_path, job_id, cached=bool(cached))
+    except Exception as e:
+        logger.error(f"Error compositing overlays: {e}", exc_info=True)
+        j_repo.update_status(
+            job_id=job_id,
+            status=JobStatus.FAILED.value,
+            meta={"error": str(e)}
+        )
+    finally:
+        _release(job_id)
+        db.close()
+
 
-        video_service.apply_overlays(
-            overlay_kind,
-            overlays_params,
-            video.filepath,
-            overlay_asset_path,
+def _publish_progress(task, job_id: str):
+    """
+    Progress callback publishing ffmpeg progress as Celery task state (kept
+    in the Redis result backend), where the job status endpoints read it.
+    """
+    def publish(progress: dict):
+        task.update_state(task_id=job_id, state="PROGRESS", meta=progress)
+    return publish
+
+
+def _transcode_params(resolution: str, gop: float = None) -> dict:
+    """Cache params of a rendition; keyframe-aligned encodes are distinct outputs."""
+    return {"resolution": resolution, "gop": gop} if gop else {"resolution": resolution}
+
+
+def _package_versions(v_repo, video, versions: list, job_id: str) -> dict:
+    """
+    Package the renditions as HLS + DASH into a fresh per-job directory and
+    point the video at it. Returns the job meta describing the package.
+    """
+    order = list(video_service.RESOLUTIONS)
+    renditions = sorted(((v["quality"], v["filepath"]) for v in versions), key=lambda r: order.index(r[0]))
+    output_dir = video_service.package_dir(video.filepath, video.id, job_id)
+    paths = video_service.package_adaptive(
+        renditions, output_dir,
+        settings.PACKAGE_SEGMENT_DURATION, settings.PACKAGE_HLS_SEGMENT_TYPE,
+    )
+    v_repo.set_packages(video, paths["hls"], paths["dash"])
+    # Served under /videos/{id}/packages/{package id}/...; /videos/{id}/hls and
+    # /videos/{id}/dash redirect to the latest package.
+    return {"package": {"id": job_id, "hls": "hls/master.m3u8", "dash": "dash/manifest.mpd"}}
+
+
+def _register_versions(db, v_repo, j_repo, video, versions: list, job_id: str, extra_meta: dict = None):
+    """
+    Insert VideoVersion rows for finished renditions (one multi-row INSERT)
+    and mark the job SUCCESS, in a single transaction.
+    """
+    with unit_of_work(db):
+        v_repo.create_video_versions(video.id, versions)
+        j_repo.update_status(
+            job_id=job_id,
+            status=JobStatus.SUCCESS.value,
+            meta={
+                "versions": [v["quality"] for v in versions],
+                "timings": {v["quality"]: v["elapsed"] for v in versions},
+                **(extra_meta or {}),
+            }
+        )
+    logger.info(f"Version generation job {job_id} completed successfully.")
+
+
+def _register_composite(v_repo, j_repo, video, output_path: str, job_id: str, cached: bool = False):
+    """Register a composited file as a new Video derived from video and mark the job SUCCESS."""
+    info = probe.probe(output_path)
+    with unit_of_work(v_repo.db):
+        composite = v_repo.create(
+            filename=f"{video.filename}_composite",
+            filepath=output_path,
+            size=info["size"],
+            duration=info["duration"],
+            trimmed_from_id=video.id
         )
+        v_repo.update_metadata(composite, info)
 
         j_repo.update_status(
             job_id=job_id,
             status=JobStatus.SUCCESS.value,
-            meta={"filepath": output_path}
+            meta={"video_id": composite.id, "filepath": output_path, "cached": cached}
         )
-        db.commit()
+    logger.info(f"Composite overlay job {job_id} completed successfully.")
+
+
+def _segment_plan(v_repo, video) -> list:
+    """Keyframe-aligned segments for a long video, or None if it should be encoded in one piece."""
+    if not video.duration or video.duration < settings.SEGMENT_PARALLEL_MIN_DURATION:
+        return None
+    plan = video_service.plan_segments(_keyframes(v_repo, video), video.duration, settings.SEGMENT_DURATION)
+    return plan if len(plan) > 1 else None
+
+
+def _dispatch_segments(j_repo, video, plan: list, job_id: str, mode: str, params: dict):
+    """
+    Fan segments out as a Celery chord: one encode_segment_task per segment,
+    then concat_segments_task stitches the pieces and completes the job.
+    Per-segment status lives in the job's meta["segments"].
+    """
+    work_dir = os.path.join(os.path.dirname(video.filepath), ".segments", job_id)
+    os.makedirs(work_dir, exist_ok=True)
+    j_repo.update_status(
+        job_id=job_id,
+        status=JobStatus.RUNNING.value,
+        meta={
+            "mode": "segmented",
+            "segments": [{"start": s, "end": e, "status": JobStatus.PENDING.value} for s, e in plan],
+            "progress": 0.0,
+            "started_at": time.time(),
+        }
+    )
+    header = [
+        encode_segment_task.s(job_id, i, video.filepath, start, end, mode, params, work_dir)
+        for i, (start, end) in enumerate(plan)
+    ]
+    callback = concat_segments_task.s(video.id, job_id, mode, params, work_dir).on_error(
+        segments_failed_task.s(job_id=job_id, work_dir=work_dir)
+    )
+    chord(header)(callback)
+    logger.info(f"Job {job_id}: dispatched {len(plan)} {mode} segments for video {video.id}")
+
+
+@celery.task(bind=True, name="app.tasks.video.encode_segment", ffmpeg_threads=settings.FFMPEG_THREADS_HEAVY)
+def encode_segment_task(self, job_id: str, index: int, input_path: str, start: float, end: float,
+                        mode: str, params: dict, work_dir: str):
+    """
+    Encode one keyframe-aligned segment (video only) of a segment-parallel job.
+    A redelivered segment whose outputs were already recorded is not encoded again.
+    """
+    db = SessionLocal()
+    j_repo = JobRepository(db)
+    try:
+        if mode == "versions":
+            renditions = [
+                (quality, res, os.path.join(work_dir, f"{index:05d}_{quality}.mp4"))
+                for quality, res in params["resolutions"].items()
+            ]
+            outputs = {quality: path for quality, _, path in renditions}
+        elif mode == "composite":
+            outputs = {"composite": os.path.join(work_dir, f"{index:05d}.mp4")}
+        else:
+            raise ValueError(f"Unknown segment mode: {mode}")
+
+        job = j_repo.find(job_id)
+        segments = (job.meta or {}).get("segments", []) if job else []
+        done = index < len(segments) and segments[index].get("status") == JobStatus.SUCCESS.value
+        if done and all(os.path.exists(p) for p in outputs.values()):
+            logger.info(f"Segment {index} of job {job_id} already encoded, ignoring duplicate delivery")
+            return {"index": index, "outputs": outputs}
+
+        j_repo.record_segment(job_id, index, JobStatus.RUNNING.value)
+        started = time.monotonic()
+        if mode == "versions":
+            video_service.encode_ladder_segment(input_path, start, end, renditions, gop=params.get("gop"))
+        else:
+            compose_overlays(input_path, outputs["composite"], params["layers"], start=start, end=end)
+
+        j_repo.record_segment(job_id, index, JobStatus.SUCCESS.value, elapsed=round(time.monotonic() - started, 3))
+        return {"index": index, "outputs": outputs}
+    except Exception as e:
+        logger.error(f"Segment {index} of job {job_id} failed: {e}", exc_info=True)
+        j_repo.record_segment(job_id, index, JobStatus.FAILED.value, error=str(e))
+        raise
+    finally:
+        db.close()
 
+
+@celery.task(bind=True, name="app.tasks.video.concat_segments")
+def concat_segments_task(self, results: list, video_id: int, job_id: str, mode: str, params: dict, work_dir: str):
+    """Chord callback: stitch segment outputs with the concat demuxer and finish the job."""
+    db = SessionLocal()
+    v_repo = VideoRepository(db)
+    j_repo = JobRepository(db)
+    try:
+        job = j_repo.find(job_id)
+        if not job or job.status in (JobStatus.SUCCESS, JobStatus.FAILED):
+            logger.info(f"Job {job_id} already finished, ignoring duplicate concat delivery")
+            return
+        video = v_repo.get_video(video_id)
+        if not video:
+            raise ValueError(f"Video {video_id} not found")
+        results = sorted(results, key=lambda r: r["index"])
+        source_hash = _source_hash(db, video)
+        elapsed = round(time.time() - job.meta.get("started_at", time.time()), 3)
+
+        if mode == "versions":
+            stem = os.path.splitext(os.path.basename(video.filepath))[0]
+            versions = list(params["cached_versions"])
+            for quality, res in params["resolutions"].items():
+                output_path = os.path.join(params["output_dir"], f"{stem}_{quality}.mp4")
+                with storage.atomic_output(output_path) as part:
+                    video_service.concat_segments([r["outputs"][quality] for r in results], video.filepath, part, "aac")
+                    layout = finalize_mp4(part)
+                    output_cache.store(db, source_hash, TaskType.TRANSCODE.value, _transcode_params(res, params.get("gop")), part)
+                versions.append({"quality": quality, "filepath": output_path, "size": os.path.getsize(output_path),
+                                 "elapsed": elapsed, "mp4_layout": layout})
+            extra_meta = _package_versions(v_repo, video, versions, job_id) if params.get("gop") else None
+            _register_versions(db, v_repo, j_repo, video, versions, job_id, extra_meta)
+        else:
+            output_path = params["output_path"]
+            with storage.atomic_output(output_path) as part:
+                video_service.concat_segments([r["outputs"]["composite"] for r in results], video.filepath, part, "copy")
+                finalize_mp4(part)
+                output_cache.store(db, source_hash, TaskType.COMPOSITE_OVERLAY.value, params["cache_params"], part)
+            _register_composite(v_repo, j_repo, video, output_path, job_id)
     except Exception as e:
-        logger.error(f"Error applying overlays: {e}", exc_info=True)
+        logger.error(f"Error concatenating segments for job {job_id}: {e}", exc_info=True)
         j_repo.update_status(
             job_id=job_id,
             status=JobStatus.FAILED.value,
             meta={"error": str(e)}
         )
-        db.commit()
     finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        db.close()
+
+
+@celery.task(name="app.tasks.video.segments_failed")
+def segments_failed_task(request, exc, traceback, job_id: str, work_dir: str):
+    """Chord error callback: a segment failed, so fail the parent job and drop the pieces."""
+    db = SessionLocal()
+    try:
+        JobRepository(db).update_status(
+            job_id=job_id,
+            status=JobStatus.FAILED.value,
+            meta={"error": f"Segment encode failed: {exc}"}
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
         db.close()
 
 
-@celery.task(bind=True, name="app.tasks.video.generate_versions")
-def generate_versions_task(self, video_id: int, job_id: str):
+@celery.task(bind=True, name="app.tasks.video.generate_versions", ffmpeg_threads=settings.FFMPEG_THREADS_HEAVY)
+def generate_versions_task(self, video_id: int, job_id: str, package: bool = False):
+    """
+    Encode every rendition in RESOLUTIONS. With package=True the renditions
+    get keyframes aligned every PACKAGE_SEGMENT_DURATION seconds and are then
+    packaged as HLS + DASH for adaptive playback.
+    """
     db = SessionLocal()
     v_repo = VideoRepository(db)
     j_repo = JobRepository(db)
@@ -152,28 +745,61 @@ def generate_versions_task(self, video_id: int, job_id: str):
         video = v_repo.get_video(video_id)
         if not video:
             raise ValueError(f"Video {video_id} not found")
+        if not _claim(self, j_repo, job_id):
+            return
 
         base_dir = os.path.dirname(video.filepath)
         output_dir = os.path.join(base_dir, "versions")
 
-        versions = video_service.generate_multi_quality_videos(video.filepath, output_dir)
-
-        for v in versions:
-            v_repo.create_video_version(
-                video_id=video.id,
-                quality=v["quality"],
-                filepath=v["filepath"],
-                size=v["size"]
-            )
-        db.commit()
-
-        j_repo.update_status(
-            job_id=job_id,
-            status=JobStatus.SUCCESS.value,
-            meta={"versions": [v["quality"] for v in versions]}
-        )
-        db.commit()
-        logger.info(f"Version generation job {job_id} completed successfully.")
+        # Renditions already produced for identical content come from the cache;
+        # only the missing ones are encoded.
+        source_hash = _source_hash(db, video)
+        stem = os.path.splitext(os.path.basename(video.filepath))[0]
+        gop = settings.PACKAGE_SEGMENT_DURATION if package else None
+        versions, missing = [], {}
+        for quality, res in video_service.RESOLUTIONS.items():
+            cached = output_cache.lookup(db, source_hash, TaskType.TRANSCODE.value, _transcode_params(res, gop))
+            if not cached:
+                missing[quality] = res
+                continue
+            os.makedirs(output_dir, exist_ok=True)
+            output_path = output_cache.materialize(cached, os.path.join(output_dir, f"{stem}_{quality}.mp4"))
+            layout = finalize_mp4(output_path)
+            versions.append({"quality": quality, "filepath": output_path, "size": os.path.getsize(output_path),
+                             "elapsed": 0.0, "mp4_layout": layout})
+
+        if missing:
+            plan = _segment_plan(v_repo, video)
+            if plan:
+                # Long source: encode keyframe-aligned segments in parallel
+                # across the pool; concat_segments_task finishes the job.
+                _dispatch_segments(j_repo, video, plan, job_id, "versions", {
+                    "resolutions": missing,
+                    "output_dir": output_dir,
+                    "cached_versions": versions,
+                    "gop": gop,
+                })
+                return
+
+            # Encode into a per-job staging directory; each finished rendition
+            # is renamed into output_dir, so readers never see a partial file.
+            staging_dir = os.path.join(output_dir, f".staging-{job_id}")
+            try:
+                with progress_reporter(_publish_progress(self, job_id), duration=video.duration):
+                    generated = video_service.generate_multi_quality_videos(video.filepath, staging_dir, resolutions=missing, gop=gop)
+                for v in generated:
+                    v["mp4_layout"] = finalize_mp4(v["filepath"])
+                    v["size"] = os.path.getsize(v["filepath"])
+                    output_cache.store(db, source_hash, TaskType.TRANSCODE.value, _transcode_params(missing[v["quality"]], gop), v["filepath"])
+                    final_path = os.path.join(output_dir, os.path.basename(v["filepath"]))
+                    os.replace(v["filepath"], final_path)
+                    v["filepath"] = final_path
+                    versions.append(v)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+        extra_meta = _package_versions(v_repo, video, versions, job_id) if package else None
+        _register_versions(db, v_repo, j_repo, video, versions, job_id, extra_meta)
     except Exception as e:
         logger.error(f"Error generating video versions: {e}", exc_info=True)
         j_repo.update_status(
@@ -181,11 +807,11 @@ def generate_versions_task(self, video_id: int, job_id: str):
             status=JobStatus.FAILED.value,
             meta={"error": str(e)}
         )
-        db.commit()
     finally:
+        _release(job_id)
         db.close()
 
-@celery.task(bind=True, name="app.tasks.video.add_watermark")
+@celery.task(bind=True, name="app.tasks.video.add_watermark", ffmpeg_threads=settings.FFMPEG_THREADS_HEAVY)
 def add_watermark_task(self, video_id: int, watermark_path: str,job_id: str):
     db = SessionLocal()
     v_repo = VideoRepository(db)
@@ -196,15 +822,37 @@ def add_watermark_task(self, video_id: int, watermark_path: str,job_id: str):
         video = v_repo.get_video(video_id)
         if not video:
             raise ValueError(f"Video {video_id} not found")
+        job = _claim(self, j_repo, job_id)
+        if not job:
+            return
 
         # 2. Define trimmed file path
         input_path = video.filepath
         logger.info(f"Adding watermark to video {input_path}, ")
-        # 3. Trim video using ffmpeg
-        video_service.add_image_watermark(
-            input_path,
-            watermark_path
-        )
+        # 3. Reuse a cached watermark of the same content/asset, else run ffmpeg;
+        # rendered next to the file and swapped in (see _swap_in_place)
+        cached = None
+        if not _resume_in_place(job, video):
+            source_hash = _source_hash(db, video)
+            cache_params = {"asset": storage.hash_file(watermark_path)[1], "position": "top-right"}
+            staged = _staged_path(video, job_id)
+            cached = output_cache.lookup(db, source_hash, TaskType.WATERMARK.value, cache_params)
+            if cached:
+                output_cache.materialize(cached, staged)
+            else:
+                with progress_reporter(_publish_progress(self, job_id), duration=video.duration):
+                    video_service.add_image_watermark(
+                        input_path,
+                        watermark_path,
+                        aspect_ratio=video.width / video.height if video.width and video.height else None,
+                        output_path=staged,
+                    )
+            finalize_mp4(staged)
+            if not cached:
+                output_cache.store(db, source_hash, TaskType.WATERMARK.value, cache_params, staged)
+            _swap_in_place(j_repo, video, job_id, staged)
+        # File was modified in place, so it no longer matches its upload blob
+        upload_hash = video.content_hash
 
         # # 4. Get size and duration
         # size, duration = video_service.get_video_metadata(trimmed_filepath)
@@ -219,21 +867,59 @@ def add_watermark_task(self, video_id: int, watermark_path: str,job_id: str):
         # )
         # db.commit()
 
-        # 6. Update job status SUCCESS
+        # 6. Refresh the file's metadata and update job status SUCCESS
+        with unit_of_work(db):
+            _reprobe_in_place(v_repo, video)
+            j_repo.update_status(
+                job_id=job_id,
+                status=JobStatus.SUCCESS.value,
+                meta={"video_id": video_id, "filepath": input_path, "cached": bool(cached)}
+            )
+        if upload_hash and upload_hash != video.content_hash and video.trimmed_from_id is None:
+            _drop_blob_reference(db, upload_hash)
+        logger.info(f"Trim job {job_id} completed successfully.")
+    except Exception as e:
+        logger.error(f"Error trimming video: {e}", exc_info=True)
+        j_repo.update_status(
+            job_id=job_id,
+            status=JobStatus.FAILED.value,
+            meta={"error": str(e)}
+        )
+    finally:
+        _release(job_id)
+        db.close()
+
+
+@celery.task(bind=True, name="app.tasks.video.generate_thumbnails")
+def generate_thumbnails_task(self, video_id: int, job_id: str):
+    """Grab THUMBNAIL_COUNT evenly spaced frames of a video (see video_service.generate_thumbnails)."""
+    db = SessionLocal()
+    v_repo = VideoRepository(db)
+    j_repo = JobRepository(db)
+
+    try:
+        video = v_repo.get_video(video_id)
+        if not video:
+            raise ValueError(f"Video {video_id} not found")
+        if not _claim(self, j_repo, job_id):
+            return
+
+        output_dir = video_service.thumbnail_dir(video.filepath, video.id)
+        thumbnails = video_service.generate_thumbnails(video.filepath, output_dir, video.duration)
+
         j_repo.update_status(
             job_id=job_id,
             status=JobStatus.SUCCESS.value,
-            meta={"video_id": video_id, "filepath": input_path}
+            meta={"video_id": video_id, "thumbnails": thumbnails}
         )
-        db.commit()
-        logger.info(f"Trim job {job_id} completed successfully.")
+        logger.info(f"Thumbnails job {job_id} completed successfully.")
     except Exception as e:
-        logger.error(f"Error trimming video: {e}", exc_info=True)
+        logger.error(f"Error generating thumbnails: {e}", exc_info=True)
         j_repo.update_status(
             job_id=job_id,
             status=JobStatus.FAILED.value,
             meta={"error": str(e)}
         )
-        db.commit()
     finally:
+        _release(job_id)
         db.close()
@@ -0,0 +1,107 @@
+# tests/test_batch_trim.py
+"""
+Batch trims: one output, one Video row and one meta["clips"] entry per
+requested range; overlapping ranges only share the demux pass.
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.db.models import Job, Video
+from app.enums.job_status import JobStatus
+from app.enums.task_type import TaskType
+from app.services import video_service
+from app.tasks import video as video_tasks
+
+
+@pytest.fixture
+def ffmpeg_runs(monkeypatch):
+    """Capture ffmpeg commands instead of running them; outputs are written as empty files."""
+    runs = []
+
+    def run(cmd):
+        runs.append(cmd)
+        for i, arg in enumerate(cmd):
+            if arg in ("aac", "copy") and i + 1 < len(cmd):
+                open(cmd[i + 1], "wb").close()
+
+    monkeypatch.setattr(video_service, "_run_ffmpeg_logged", run)
+    return runs
+
+
+def _outputs(cmd):
+    """output path -> its (-ss, -to) arguments, in command order."""
+    outputs, window = {}, {}
+    args = cmd[cmd.index("-i") + 2:]
+    for i, arg in enumerate(args):
+        if arg in ("-ss", "-to"):
+            window[arg] = float(args[i + 1])
+        elif arg in ("aac", "copy") and i + 1 < len(args):
+            outputs[args[i + 1]] = (window.pop("-ss", 0.0), window.pop("-to"))
+    return outputs
+
+
+def test_overlapping_clips_share_a_pass_with_one_output_each(tmp_path, ffmpeg_runs, monkeypatch):
+    monkeypatch.setattr(settings, "TRIM_MODE", "accurate")
+    a, b, c, d = (str(tmp_path / f"{name}.mp4") for name in "abcd")
+    video_service.batch_trim_ffmpeg("in.mp4", [(15.0, 20.0, c), (0.0, 10.0, a), (100.0, 110.0, d), (5.0, 15.0, b)])
+
+    assert len(ffmpeg_runs) == 2
+    first, second = ffmpeg_runs
+    assert first[first.index("-ss") + 1] == "0.0"
+    assert _outputs(first) == {a: (0.0, 10.0), b: (5.0, 15.0), c: (15.0, 20.0)}
+    assert second[second.index("-ss") + 1] == "100.0"
+    assert _outputs(second) == {d: (0.0, 10.0)}
+
+
+def test_copy_mode_starts_clips_on_keyframes(tmp_path, ffmpeg_runs, monkeypatch):
+    monkeypatch.setattr(settings, "TRIM_MODE", "copy")
+    a, b = str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4")
+    video_service.batch_trim_ffmpeg("in.mp4", [(5.0, 9.0, a), (10.5, 14.0, b)], keyframes=[0.0, 4.0, 8.0, 12.0])
+
+    (cmd,) = ffmpeg_runs
+    assert float(cmd[cmd.index("-ss") + 1]) == pytest.approx(4.0, abs=1e-4)
+    outputs = _outputs(cmd)
+    # b starts on the keyframe at 8s, just before it on the seek's timeline
+    assert outputs[a] == (0.0, pytest.approx(5.0, abs=1e-4))
+    assert outputs[b][0] == pytest.approx(4.0, abs=1e-4) and outputs[b][0] < 4.0
+    assert "libx264" not in cmd
+
+
+def test_batch_trim_task_keeps_one_clip_per_range(tmp_path, ffmpeg_runs, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    Video.__table__.create(engine)
+    Job.__table__.create(engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(video_tasks, "SessionLocal", Session)
+    monkeypatch.setattr(settings, "TRIM_MODE", "accurate")
+    monkeypatch.setattr(settings, "JOB_CACHE_ENABLED", False)
+    monkeypatch.setattr(video_tasks, "_claim", lambda task, j_repo, job_id: j_repo.find(job_id))
+    monkeypatch.setattr(video_tasks, "_release", lambda job_id: None)
+    monkeypatch.setattr(video_tasks, "finalize_mp4", lambda path: None)
+    monkeypatch.setattr(video_tasks.output_cache, "lookup", lambda *args: None)
+    monkeypatch.setattr(video_tasks.output_cache, "store", lambda *args: None)
+    monkeypatch.setattr(video_tasks.probe, "probe", lambda path: {"size": 1, "duration": 1.0})
+
+    source = tmp_path / "source.mp4"
+    source.write_bytes(b"video")
+    with Session() as db:
+        db.add(Video(id=1, filename="source.mp4", filepath=str(source)))
+        db.add(Job(id="job-1", video_id=1, task=TaskType.BATCH_TRIM, status=JobStatus.PENDING, meta={}))
+        db.commit()
+
+    ranges = [(0.0, 10.0), (5.0, 15.0), (15.0, 20.0)]
+    video_tasks.batch_trim_task.run(1, ranges, "job-1")
+
+    assert len(ffmpeg_runs) == 1
+    with Session() as db:
+        clips = db.get(Job, "job-1").meta["clips"]
+        assert [(c["start"], c["end"], c["status"]) for c in clips] == [(s, e, JobStatus.SUCCESS.value) for s, e in ranges]
+        videos = {v.id: v for v in db.query(Video).filter(Video.trimmed_from_id == 1)}
+        assert sorted(videos) == sorted(c["video_id"] for c in clips)
+        for clip in clips:
+            assert videos[clip["video_id"]].filepath == clip["filepath"]
+            assert os.path.exists(clip["filepath"])
@@ -0,0 +1,127 @@
+# tests/test_job_cache.py
+"""
+Job status cache (app.services.job_cache) against fakeredis: write-through
+ordering by revision, and a polling benchmark counting the database reads
+GET /jobs/{id} makes with and without the cache.
+"""
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.api.v1 import jobs as jobs_api
+from app.core.config import settings
+from app.db.models import Job
+from app.enums.job_status import JobStatus
+from app.enums.task_type import TaskType
+from app.repositories.job_repo import AsyncJobRepository, JobRepository
+from app.services import job_cache
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(job_cache, "_client", fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(job_cache, "_async_client", fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr(settings, "JOB_CACHE_ENABLED", True)
+    return server
+
+
+def _job(status=JobStatus.PENDING, revision=0, meta=None):
+    return SimpleNamespace(
+        id="job-1",
+        video_id=1,
+        status=status,
+        task=TaskType.TRANSCODE,
+        meta=meta or {},
+        created_at=datetime(2026, 1, 1, tzinfo=timezone.utc),
+        revision=revision,
+    )
+
+
+def _cached_status():
+    snap = asyncio.run(job_cache.get("job-1"))
+    return snap and snap["status"]
+
+
+def test_store_replaces_older_snapshot():
+    job_cache.store(job_cache.snapshot(_job(JobStatus.PENDING, 0)))
+    job_cache.store(job_cache.snapshot(_job(JobStatus.RUNNING, 1)))
+    assert _cached_status() == JobStatus.RUNNING.value
+
+
+def test_stale_snapshot_never_overwrites_newer():
+    job_cache.store(job_cache.snapshot(_job(JobStatus.RUNNING, 2)))
+    job_cache.store(job_cache.snapshot(_job(JobStatus.PENDING, 1)))
+    asyncio.run(job_cache.populate(job_cache.snapshot(_job(JobStatus.PENDING, 0))))
+    assert _cached_status() == JobStatus.RUNNING.value
+
+
+def test_repopulation_racing_an_api_commit_loses():
+    # A GET read the PENDING row just before the API committed FAILED.
+    stale = job_cache.snapshot(_job(JobStatus.PENDING, 0))
+    asyncio.run(job_cache._store_all([job_cache.snapshot(_job(JobStatus.FAILED, 1))]))
+    asyncio.run(job_cache.populate(stale))
+    assert _cached_status() == JobStatus.FAILED.value
+
+
+def test_entry_without_revision_is_replaced(fake_redis):
+    fakeredis.FakeRedis(server=fake_redis).set("job:job-1", '{"job_id": "job-1", "status": "PENDING"}')
+    job_cache.store(job_cache.snapshot(_job(JobStatus.SUCCESS, 3)))
+    assert _cached_status() == JobStatus.SUCCESS.value
+
+
+def test_repository_writes_bump_revision_and_write_through():
+    engine = create_engine("sqlite://")
+    Job.__table__.create(engine)
+    with Session(engine) as db:
+        repo = JobRepository(db)
+        repo.create(job_id="job-1", video_id=None, task=TaskType.TRANSCODE.value)
+        repo.update_status("job-1", JobStatus.RUNNING.value, meta={"progress": 0.5})
+        repo.update_status("job-1", JobStatus.SUCCESS.value)
+
+        snap = asyncio.run(job_cache.get("job-1"))
+        assert snap["status"] == JobStatus.SUCCESS.value
+        assert snap["revision"] == 2
+        assert snap["meta"] == {"progress": 0.5}
+
+
+def test_polling_benchmark_db_reads(monkeypatch):
+    """
+    A client polls GET /jobs/{id} POLLS times while a worker moves the job
+    through its states. Without the cache every poll is a query; with it
+    only the first one (a miss) is.
+    """
+    polls, transitions = 200, 5
+    job = _job()
+    reads = []
+
+    async def find(self, job_id):
+        reads.append(job_id)
+        return job
+
+    monkeypatch.setattr(AsyncJobRepository, "find", find)
+
+    def run(cache_enabled):
+        reads.clear()
+        monkeypatch.setattr(settings, "JOB_CACHE_ENABLED", cache_enabled)
+        job.status, job.revision = JobStatus.PENDING, 0
+        for i in range(polls):
+            if i and i % (polls // transitions) == 0:
+                # Worker commit: the row changes and the snapshot is written through
+                job.status, job.revision = JobStatus.RUNNING, job.revision + 1
+                job.meta = {"progress": i / polls}
+                if cache_enabled:
+                    job_cache.store(job_cache.snapshot(job))
+            snap = asyncio.run(jobs_api._load_job("job-1", db=None))
+            assert snap["revision"] == job.revision
+        return len(reads)
+
+    uncached, cached = run(False), run(True)
+    print(f"\nDB reads for {polls} polls: {uncached} uncached, {cached} cached")
+    assert uncached == polls
+    assert cached == 1
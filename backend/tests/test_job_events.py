@@ -0,0 +1,61 @@
+# tests/test_job_events.py
+"""SSE job stream (GET /jobs/{id}/events) against a fakeredis status cache."""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+from app.api.v1 import jobs as jobs_api
+from app.core.config import settings
+from app.enums.job_status import JobStatus
+from app.enums.task_type import TaskType
+from app.services import job_cache
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(job_cache, "_client", fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(job_cache, "_async_client", fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr(settings, "JOB_CACHE_ENABLED", True)
+    monkeypatch.setattr(jobs_api, "STREAM_POLL_INTERVAL", 0.01)
+
+
+class _Session:
+    async def commit(self):
+        pass
+
+
+def _store(status, revision):
+    job_cache.store(job_cache.snapshot(SimpleNamespace(
+        id="pipeline-1", video_id=None, status=status, task=TaskType.PIPELINE,
+        meta={}, created_at=None, revision=revision,
+    )))
+
+
+def test_stream_follows_a_job_that_is_no_celery_task(monkeypatch):
+    # A pipeline job is never a Celery task id: its Celery state stays
+    # PENDING while the job finishes a few polls into the stream
+    polls = []
+
+    def celery_state(job_id):
+        polls.append(job_id)
+        if len(polls) == 3:
+            _store(JobStatus.FAILED, 2)
+        return "PENDING", None
+
+    monkeypatch.setattr(jobs_api, "_celery_state", celery_state)
+    _store(JobStatus.RUNNING, 1)
+
+    async def collect():
+        response = await jobs_api.stream_job_status("pipeline-1", db=_Session())
+        statuses = []
+        async for chunk in response.body_iterator:
+            if chunk.startswith("event: status"):
+                statuses.append(json.loads(chunk.split("data: ", 1)[1])["status"])
+        return statuses
+
+    statuses = asyncio.run(asyncio.wait_for(collect(), timeout=5))
+    assert statuses == [JobStatus.RUNNING.value, JobStatus.FAILED.value]
@@ -0,0 +1,44 @@
+# tests/test_multipart.py
+"""Multi-part assembly vs parts still being written (app.services.storage)."""
+import hashlib
+import threading
+
+import pytest
+
+from app.core.config import settings
+from app.services import storage
+
+
+@pytest.fixture(autouse=True)
+def storage_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(storage, "BLOB_DIR", tmp_path / "blobs")
+    monkeypatch.setattr(storage, "MULTIPART_DIR", tmp_path)
+
+
+def test_complete_waits_for_parts_being_written():
+    path = storage.create_multipart("upload-1", 8)
+    fd = storage.open_multipart(path)
+    done = []
+    completer = threading.Thread(target=lambda: done.append(storage.complete_multipart(path, "clip.mp4")))
+    completer.start()
+    completer.join(0.2)
+    assert not done, "completed while a part was still being written"
+
+    storage.write_part_chunk(fd, b"abcdefgh", 0)
+    storage.close_multipart(fd)
+    completer.join(5)
+    _, size, sha256 = done[0]
+    assert (size, sha256) == (8, hashlib.sha256(b"abcdefgh").hexdigest())
+    assert storage.blob_path(sha256).read_bytes() == b"abcdefgh"
+
+
+def test_parts_are_refused_once_completed():
+    path = storage.create_multipart("upload-2", 4)
+    fd = storage.open_multipart(path)
+    storage.write_part_chunk(fd, b"data", 0)
+    storage.close_multipart(fd)
+    storage.complete_multipart(path, "clip.mp4")
+
+    with pytest.raises(storage.UploadClosedError):
+        storage.open_multipart(path)